@@ -0,0 +1,58 @@
+"""
+Benchmark IWASOBI (and its main kernels) for increasing numbers of
+channels on simulated mixtures of AR(1) sources.
+
+Usage: python bench_iwasobi.py [nchannels ...]
+"""
+import sys
+import time
+
+import numpy as np
+from scipy.signal import lfilter
+
+from ptsa.iwasobi import IWASOBI
+
+# channel counts to run (e.g., 32 64 128 256)
+channel_counts = [int(c) for c in sys.argv[1:]] or [32, 64, 128, 256]
+
+# samples per channel (the 3*N^2 rule of thumb from WICA, capped)
+min_samples = 10000
+max_samples = 100000
+
+
+def simulate(nchannels, nsamples, rng):
+    # mixtures of AR(1) sources with random coefficients
+    sources = np.array([lfilter([1], [1, -rng.uniform(-.9, .9)],
+                                rng.randn(nsamples))
+                        for i in range(nchannels)])
+    return np.dot(rng.randn(nchannels, nchannels), sources)
+
+
+def timed(func, *args):
+    start = time.time()
+    res = func(*args)
+    return time.time() - start, res
+
+
+rng = np.random.RandomState(0)
+print('%8s %8s %10s %10s %10s %10s %10s' %
+      ('channels', 'samples', 'corr_est', 'uwajd', 'weights', 'wajd',
+       'total'))
+for nchannels in channel_counts:
+    nsamples = min(max(3 * nchannels**2, min_samples), max_samples)
+    x = simulate(nchannels, nsamples, rng)
+    x = (x.T - x.mean(1)).T
+    iw = IWASOBI()
+
+    # the kernels (one iteration each)
+    t_corr, C0 = timed(iw.corr_est, x, nsamples - iw.ar_max, iw.ar_max)
+    t_uwajd, (W, Ms) = timed(iw.uwajd, C0.copy(), 20)
+    t_weights, (H, ARC) = timed(iw.weights, Ms, iw.rmax, iw.eps0)
+    t_wajd, (W, Ms) = timed(iw.wajd, C0.copy(), H, W, 5)
+
+    # the whole separation
+    t_total, res = timed(iw, x)
+
+    print('%8d %8d %10.3f %10.3f %10.3f %10.3f %10.3f' %
+          (nchannels, nsamples, t_corr, t_uwajd, t_weights, t_wajd,
+           t_total))
@@ -9,9 +9,11 @@
 
 from dimarray import Dim, DimArray, AttrArray
 from .timeseries import TimeSeries
+from .lazytimeseries import LazyTimeSeries
 
 from .basewrapper import BaseWrapper
 from .arraywrapper import ArrayWrapper
+from .epochcache import EpochCache
 #from edfwrapper import EdfWrapper
 
 from .events import Events
@@ -9,6 +9,7 @@
 
 # local imports
 from .basewrapper import BaseWrapper
+from ptsa.helper import sliding_windows
 
 # global imports
 import numpy as np
@@ -41,23 +42,33 @@ class ArrayWrapper(BaseWrapper):
     def _get_annotations(self):
         return self._annotations
 
-    def _load_data(self, channels, event_offsets, dur_samp, offset_samp):
+    def _load_data(self, channels, event_offsets, dur_samp, offset_samp,
+                   out=None, dtype=None):
         """
         """
         # allocate for data
-        eventdata = np.empty((len(channels), len(event_offsets), dur_samp),
-                             dtype=self._data.dtype) * np.nan
-
-        # loop over events
-        for e, evOffset in enumerate(event_offsets):
-            # set the range
-            ssamp = offset_samp + evOffset
-            esamp = ssamp + dur_samp
-
-            # check the ranges
-            if ssamp < 0 or esamp > self._data.shape[1]:
-                raise IOError('Event with offset ' + str(evOffset) +
-                              ' is outside the bounds of the data.')
-            eventdata[:, e, :] = self._data[channels, ssamp:esamp]
+        if dtype is None:
+            dtype = self._data.dtype
+        eventdata = self._prepare_out(
+            out, (len(channels), len(event_offsets), dur_samp), dtype)
+
+        # check the ranges
+        event_offsets = np.atleast_1d(event_offsets)
+        ssamps = event_offsets + offset_samp
+        bad_evs = (ssamps < 0) | (ssamps + dur_samp > self._data.shape[1])
+        if np.any(bad_evs):
+            raise IOError('Event with offset ' +
+                          str(event_offsets[np.nonzero(bad_evs)[0][0]]) +
+                          ' is outside the bounds of the data.')
+
+        # gather all events for each channel from a strided view of
+        # the data (no per-event loop and no intermediate copies)
+        windows = sliding_windows(self._data, dur_samp, axis=1)
+        for c, channel in enumerate(channels):
+            if eventdata.dtype == windows.dtype:
+                np.take(windows[channel], ssamps, axis=0, out=eventdata[c],
+                        mode='clip')
+            else:
+                eventdata[c] = windows[channel][ssamps]
 
         return eventdata
@@ -10,9 +10,24 @@
 # local imports
 #from events import Events,TsEvents
 from .timeseries import TimeSeries, Dim
+from .lazytimeseries import LazyTimeSeries
 
 # global imports
+import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _file_identity(paths):
+    """
+    Return the absolute path, modification time, and size of each
+    file, which identifies the data they contain for caching.
+    """
+    ident = []
+    for path in paths:
+        st = os.stat(path)
+        ident.append((os.path.abspath(path), st.st_mtime_ns, st.st_size))
+    return ident
 
 
 class BaseWrapper(object):
@@ -22,6 +37,9 @@ class BaseWrapper(object):
     annotations, and channel information.  The annotations and channel
     information will typically be recarrays.
     """
+    # whether per-channel reads can run concurrently in threads (see
+    # n_io_threads in get_event_data)
+    _threaded_io = True
 
     # required methods that the child class must define.
     def _get_samplerate(self, channel=None):
@@ -109,10 +127,27 @@ class BaseWrapper(object):
         """
         raise NotImplementedError
 
-    def _load_data(self, channels, event_offsets, dur_samp, offset_samp):
+    def _get_identity(self):
+        """
+        Returns a description of the data behind the wrapper (e.g.,
+        the path, mtime, and size of its files along with any settings
+        that change the values loaded) that can be hashed to key an
+        EpochCache.
+
+        Returns
+        -------
+        identity : {object}
+            Anything with a stable repr, or None if the data can't be
+            identified, in which case results are not cached.
+        """
+        return None
+
+    def _load_data(self, channels, event_offsets, dur_samp, offset_samp,
+                   out=None, dtype=None):
         """
         Method for loading data that each child wrapper class must
-        implement.
+        implement.  Child classes should get the array to fill from
+        _prepare_out.
 
         Parameters
         ----------
@@ -127,6 +162,12 @@ class BaseWrapper(object):
         offset_samp : {int}
             Offset (in samples) from the event onset from where to
             extract the duration of the event.
+        out : {ndarray},optional
+            Array of shape [channels, events, duration] to load the
+            data into.
+        dtype : {numpy.dtype},optional
+            Data type of the returned array if out is not provided
+            (defaults to the natural dtype of the wrapper).
 
         Returns
         -------
@@ -136,6 +177,79 @@ class BaseWrapper(object):
         """
         raise NotImplementedError
 
+    def _prepare_out(self, out, shape, dtype):
+        """
+        Return the array that _load_data should fill: either the out
+        array provided by the caller (after checking its shape) or a
+        new, uninitialized array of the given shape and dtype.
+        """
+        shape = tuple(int(i) for i in shape)
+        if out is None:
+            return np.empty(shape, dtype=dtype)
+        if out.shape != shape:
+            raise ValueError('The out array has shape ' + str(out.shape) +
+                             ', but ' + str(shape) + ' is required.')
+        return out
+
+    def _load_data_threaded(self, channels, event_offsets, dur_samp,
+                            offset_samp, n_io_threads, out=None, dtype=None):
+        """
+        Load data with the channel loop spread over a pool of
+        threads.  Each channel is loaded with a separate call to
+        _load_data and each worker writes into its own slice of the
+        preallocated output array, so the result is identical to a
+        single call to _load_data.
+
+        Parameters
+        ----------
+        channels : {array_like}
+            Channel indices to load.
+        event_offsets : {array_like}
+            List of offsets into the data (in samples) marking event
+            onsets.
+        dur_samp : {int}
+            Duration in samples of each event.
+        offset_samp : {int}
+            Offset (in samples) from the event onset from where to
+            extract the duration of the event.
+        n_io_threads : {int}
+            Maximum number of threads to use.
+        out : {ndarray},optional
+            Array of shape [channels, events, duration] to load the
+            data into.
+        dtype : {numpy.dtype},optional
+            Data type of the returned array if out is not provided.
+
+        Returns
+        -------
+        data : {ndarray}
+            Array of data in the form [channels, events, duration].
+        """
+        first_chan = 0
+        if out is None:
+            # load the first channel here to determine the output dtype
+            first = self._load_data(channels[:1], event_offsets,
+                                    dur_samp, offset_samp, dtype=dtype)
+            out = np.empty((len(channels),) + first.shape[1:],
+                           dtype=first.dtype)
+            out[:1] = first
+            first_chan = 1
+            del first
+        else:
+            out = self._prepare_out(out, (len(channels), len(event_offsets),
+                                          dur_samp), None)
+
+        def _fill(c):
+            self._load_data(channels[c:c + 1], event_offsets,
+                            dur_samp, offset_samp, out=out[c:c + 1])
+
+        # fan the remaining channels out over the pool (list forces
+        # any exceptions in the workers to be raised here)
+        with ThreadPoolExecutor(max_workers=n_io_threads) as pool:
+            list(pool.map(_fill, range(first_chan, len(channels))))
+
+        return out
+
     def append_data(self, data):
         """
         """
@@ -152,7 +266,8 @@ class BaseWrapper(object):
                        filt_freq=None, filt_type='stop', filt_order=4,
                        keep_buffer=False,
                        loop_axis=None, num_mp_procs=0, eoffset='eoffset',
-                       eoffset_in_time=True):
+                       eoffset_in_time=True, n_io_threads=0,
+                       out=None, dtype=None, cache=None):
         """
         Return an TimeSeries containing data for the specified channel
         in the form [events,duration].
@@ -187,6 +302,26 @@ class BaseWrapper(object):
         eoffset_in_time: {boolean},optional
             If True, the unit of the event offsets is taken to be
             time (unit of the data), otherwise samples.
+        n_io_threads: {int},optional
+            Number of threads to use for loading the channels in
+            parallel, which helps when reads are latency bound (e.g.,
+            one file per channel on network storage).  0 or 1 means
+            load all channels serially.  Ignored by wrappers whose
+            reads cannot overlap (e.g., EdfWrapper).
+        out: {ndarray},optional
+            Preallocated array of shape (channels, events, samples)
+            to load the data into (the samples include the buffer).
+            The returned TimeSeries shares memory with it unless the
+            data are filtered or resampled.
+        dtype: {numpy.dtype},optional
+            Data type to load the data as (e.g., np.float32 to halve
+            the memory), defaults to the natural dtype of the wrapper.
+        cache: {EpochCache},optional
+            Cache to look up the (loaded and processed) data in before
+            reading it and to store it in afterwards.  Entries are
+            keyed by the identity of the wrapper and all parameters
+            that affect the result.  Ignored when out is provided or
+            the wrapper can't identify its data.
         """
 
         # translate back to dur and offset
@@ -268,9 +403,34 @@ class BaseWrapper(object):
                              if isinstance(c, str) else c for c in channels])
         channels.sort()
 
+        # see if we already have the result
+        cache_key = None
+        if cache is not None and out is None:
+            identity = self._get_identity()
+            if identity is not None:
+                cache_key = cache.make_key(
+                    identity, channels, event_offsets, dur_samp, offset_samp,
+                    buf, resampled_rate, filt_freq, filt_type, filt_order,
+                    keep_buffer, None if dtype is None else np.dtype(dtype).str)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    data, info = cached
+                    dims = [Dim(self.channels[channels], 'channels'),
+                            Dim(events, 'events'),
+                            Dim(info['time'], 'time')]
+                    return TimeSeries(data, 'time', info['samplerate'],
+                                      dims=dims)
+
         # load the timeseries (this must be implemented by subclasses)
-        eventdata = self._load_data(
-            channels, event_offsets, dur_samp, offset_samp)
+        if (n_io_threads > 1 and len(channels) > 1 and
+                self._threaded_io):
+            eventdata = self._load_data_threaded(
+                channels, event_offsets, dur_samp, offset_samp,
+                n_io_threads, out=out, dtype=dtype)
+        else:
+            eventdata = self._load_data(
+                channels, event_offsets, dur_samp, offset_samp,
+                out=out, dtype=dtype)
 
         # calc the time range
         # get the samplesize
@@ -306,13 +466,30 @@ class BaseWrapper(object):
             # remove the buffer
             eventdata = eventdata.remove_buffer(buf)
 
+        if cache_key is not None:
+            cache.put(cache_key, np.asarray(eventdata),
+                      {'time': np.asarray(eventdata['time']),
+                       'samplerate': eventdata.samplerate})
+
         # return the timeseries
         return eventdata
 
-    def get_all_data(self, channels=None):
+    def get_all_data(self, channels=None, lazy=False):
         """
         Return a TimeSeries containing all the data.
+
+        Parameters
+        ----------
+        channels: {array_like},optional
+            Indices of the channels to return (all by default).
+        lazy: {boolean},optional
+            If True, return a LazyTimeSeries that only reads the
+            channels and samples selected from it when it is loaded,
+            which is how to work with recordings that don't fit in
+            memory.
         """
+        if lazy:
+            return LazyTimeSeries(self, channels)
         if channels is None:
             channels = np.arange(self.nchannels)
         dur_samp = self.nsamples
@@ -8,7 +8,8 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 # local imports
-from .basewrapper import BaseWrapper
+from .basewrapper import BaseWrapper, _file_identity
+from ptsa.helper import sliding_windows
 
 # global imports
 import numpy as np
@@ -122,7 +123,7 @@ class BVWrapper(BaseWrapper):
         # open the file to figure out the nsamples
         mm = np.memmap(self._data_file, dtype=self._dtype,
                        mode='r')
-        self._nsamples = mm.shape[0] / self._nchannels
+        self._nsamples = mm.shape[0] // self._nchannels
 
     def _get_nchannels(self):
         return self._nchannels
@@ -130,6 +131,10 @@ class BVWrapper(BaseWrapper):
     def _get_channel_info(self):
         return self._channel_info
 
+    def _get_identity(self):
+        return ('BVWrapper',
+                _file_identity([self.filepath, self._data_file]))
+
     def _get_nsamples(self, channel=None):
         return self._nsamples
 
@@ -174,29 +179,38 @@ class BVWrapper(BaseWrapper):
         # sort by index and return
         return annotations[np.argsort(index)]
 
-    def _load_data(self, channels, event_offsets, dur_samp, offset_samp):
+    def _load_data(self, channels, event_offsets, dur_samp, offset_samp,
+                   out=None, dtype=None):
         """
         """
         # allocate for data
-        eventdata = np.empty((len(channels), len(event_offsets), int(dur_samp)),
-                             dtype=np.float64) * np.nan
+        if dtype is None:
+            dtype = np.float64
+        eventdata = self._prepare_out(
+            out, (len(channels), len(event_offsets), dur_samp), dtype)
 
         # Memmap to the file
         mm = np.memmap(self._data_file, dtype=self._dtype,
                        mode='r', shape=(int(self._nsamples), self._nchannels))
 
-    # loop over events
-        for e, ev_offset in enumerate(event_offsets):
-            # set the range
-            ssamp = offset_samp + ev_offset
-
-            if (ssamp + dur_samp - 1) > self._nsamples:
-                raise IOError('Event with offset ' + str(ev_offset) +
-                              ' is outside the bounds of the data.')
-
-            # only pick the channels of interest and scale
-            dat = np.multiply(mm[ssamp:int(ssamp + dur_samp), channels],
-                              self._channel_info['scale'][channels])
-            eventdata[:, e, :] = dat.T
+        # check the ranges
+        event_offsets = np.atleast_1d(event_offsets)
+        ssamps = event_offsets + offset_samp
+        bad_evs = (ssamps < 0) | (ssamps + dur_samp > self._nsamples)
+        if np.any(bad_evs):
+            raise IOError('Event with offset ' +
+                          str(event_offsets[np.nonzero(bad_evs)[0][0]]) +
+                          ' is outside the bounds of the data.')
+
+        # gather the channels of interest for all events at once from
+        # a strided view of the file, giving (events, channels, time)
+        dat = sliding_windows(mm, dur_samp, axis=0)[
+            np.ix_(ssamps, channels)]
+
+        # scale each channel once while copying into place
+        np.multiply(dat.transpose(1, 0, 2),
+                    self._channel_info['scale'][channels][:, np.newaxis,
+                                                          np.newaxis],
+                    out=eventdata, casting='unsafe')
 
         return eventdata
@@ -7,5 +7,5 @@
 #
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
-from edf import read_samples, read_number_of_samples
-from edf import read_samplerate, read_annotations, read_number_of_signals
+from .edf import read_samples, read_event_samples, read_number_of_samples
+from .edf import read_samplerate, read_annotations, read_number_of_signals
@@ -1,3 +1,6 @@
+# cython: language_level=2
+import os
+
 import numpy as np
 cimport numpy as np
 
@@ -42,9 +45,15 @@ cdef extern from "edfwrap.h":
                                int edfsignal, 
                                long long offset,
                                int n, 
-                               double *buf)
+                               double *buf) nogil
+
+def _encode_path(filepath):
+    # the C library takes the path as a char array
+    if isinstance(filepath, bytes):
+        return filepath
+    return os.fsencode(filepath)
 
-def read_number_of_signals(char *filepath):
+def read_number_of_signals(filepath):
     """
     read_number_of_signals(filepath)
 
@@ -63,9 +72,11 @@ def read_number_of_signals(char *filepath):
     """
     # get a header
     cdef edf_hdr_struct hdr
+    cdef bytes bpath = _encode_path(filepath)
+    cdef char *cpath = bpath
 
     # open the file
-    if open_file_readonly(filepath, &hdr, EDFLIB_READ_ALL_ANNOTATIONS) < 0:
+    if open_file_readonly(cpath, &hdr, EDFLIB_READ_ALL_ANNOTATIONS) < 0:
         print "Error opening file."
         return None
 
@@ -77,7 +88,7 @@ def read_number_of_signals(char *filepath):
 
     return num_signals
 
-def read_annotations(char *filepath):
+def read_annotations(filepath):
     """
     read_annotations(filepath)
 
@@ -97,9 +108,11 @@ def read_annotations(char *filepath):
     """
     # get a header
     cdef edf_hdr_struct hdr
+    cdef bytes bpath = _encode_path(filepath)
+    cdef char *cpath = bpath
 
     # open the file
-    if open_file_readonly(filepath, &hdr, EDFLIB_READ_ALL_ANNOTATIONS) < 0:
+    if open_file_readonly(cpath, &hdr, EDFLIB_READ_ALL_ANNOTATIONS) < 0:
         print "Error opening file."
         return None
 
@@ -132,7 +145,7 @@ def read_annotations(char *filepath):
         #[onsets,durations,annotations],
         names='onsets,durations,annotations')
         
-def read_number_of_samples(char *filepath, int edfsignal):
+def read_number_of_samples(filepath, int edfsignal):
     """
     read_number_of_samples(filepath, edfsignal)
 
@@ -154,9 +167,11 @@ def read_number_of_samples(char *filepath, int edfsignal):
     """
     # get a header
     cdef edf_hdr_struct hdr
+    cdef bytes bpath = _encode_path(filepath)
+    cdef char *cpath = bpath
 
     # open the file
-    if open_file_readonly(filepath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
+    if open_file_readonly(cpath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
         print "Error opening file."
         return None
 
@@ -169,7 +184,7 @@ def read_number_of_samples(char *filepath, int edfsignal):
 
     return num_samples
 
-def read_samplerate(char *filepath, int edfsignal):
+def read_samplerate(filepath, int edfsignal):
     """
     read_samplerate(filepath, edfsignal)
 
@@ -191,9 +206,11 @@ def read_samplerate(char *filepath, int edfsignal):
     """
     # get a header
     cdef edf_hdr_struct hdr
+    cdef bytes bpath = _encode_path(filepath)
+    cdef char *cpath = bpath
 
     # open the file
-    if open_file_readonly(filepath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
+    if open_file_readonly(cpath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
         print "Error opening file."
         return None
 
@@ -206,7 +223,7 @@ def read_samplerate(char *filepath, int edfsignal):
 
     return samplerate
 
-def read_samples(char *filepath, int edfsignal, long offset, int n):
+def read_samples(filepath, int edfsignal, long offset, int n):
     """
     read_samples(filepath, edfsignal, offset, n)
 
@@ -234,9 +251,11 @@ def read_samples(char *filepath, int edfsignal, long offset, int n):
 
     # get a header
     cdef edf_hdr_struct hdr
+    cdef bytes bpath = _encode_path(filepath)
+    cdef char *cpath = bpath
 
     # open the file
-    if open_file_readonly(filepath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
+    if open_file_readonly(cpath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
         print "Error opening file."
         return None
     
@@ -258,3 +277,99 @@ def read_samples(char *filepath, int edfsignal, long offset, int n):
     # return the buffer, truncated to the number of samples
     return buf[0:nread]
 
+
+def read_event_samples(filepath, channels, offsets, int n, out=None,
+                       long long offset=0):
+    """
+    read_event_samples(filepath, channels, offsets, n, out=None, offset=0)
+
+    Read in the same number of samples for many signals and many
+    offsets from an EDF/BDF file, opening the file only once.  The
+    GIL is released while the samples are read.
+
+    Parameters
+    ----------
+    filepath : {str}
+        The path and name of the EDF/BDF file.
+    channels : {array_like of ints}
+        The signals to read.
+    offsets : {array_like of longs}
+        Offsets in samples into the file where to start reading.
+    n : {int}
+        Number of samples to read, starting at each offset.
+    out : {np.ndarray},optional
+        C-contiguous float64 array of shape (channels, offsets, n) to
+        read the samples into.
+    offset : {long},optional
+        Offset in samples added to each of the offsets (e.g., to read
+        from before an event onset).
+
+    Returns
+    -------
+    samples : {np.ndarray}
+        An ndarray of shape (channels, offsets, n) with the samples
+        read from the file (out if provided).
+
+    """
+    cdef np.ndarray[np.int32_t, ndim=1] chans = np.ascontiguousarray(
+        channels, dtype=np.int32)
+    cdef np.ndarray[np.int64_t, ndim=1] offs = np.ascontiguousarray(
+        offsets, dtype=np.int64)
+    cdef Py_ssize_t nchans = chans.shape[0]
+    cdef Py_ssize_t noffs = offs.shape[0]
+
+    # allocate space for all the samples at once (or check the buffer
+    # we were given)
+    if out is None:
+        out = np.empty((nchans, noffs, n), dtype=dtype_f64)
+    elif (out.dtype != dtype_f64 or not out.flags.c_contiguous or
+          not out.flags.writeable or out.shape != (nchans, noffs, n)):
+        raise ValueError('out must be a writeable, C-contiguous float64 ' +
+                         'array of shape ' + str((nchans, noffs, n)) + '.')
+    cdef np.ndarray[dtype_f64_t, ndim=3] buf = out
+    cdef dtype_f64_t *bufp = <dtype_f64_t*>buf.data
+    cdef np.int32_t *chansp = <np.int32_t*>chans.data
+    cdef np.int64_t *offsp = <np.int64_t*>offs.data
+
+    # get a header
+    cdef edf_hdr_struct hdr
+    cdef bytes bpath = _encode_path(filepath)
+    cdef char *cpath = bpath
+
+    # open the file
+    if open_file_readonly(cpath, &hdr, EDFLIB_DO_NOT_READ_ANNOTATIONS) < 0:
+        raise IOError('Error opening file ' + str(filepath) + '.')
+
+    # check the signals
+    cdef Py_ssize_t c, e
+    for c in range(nchans):
+        if chans[c] < 0 or chans[c] >= hdr.edfsignals:
+            edfclose_file(hdr.handle)
+            raise ValueError('Invalid signal ' + str(chans[c]) +
+                             ', the file has ' + str(hdr.edfsignals) +
+                             ' signals.')
+
+    # loop over signals and offsets, reading into the buffer
+    cdef Py_ssize_t bad = -1
+    with nogil:
+        for c in range(nchans):
+            for e in range(noffs):
+                # (edflib would silently start a negative offset at 0)
+                if (offsp[e] + offset < 0 or
+                        read_samples_from_file(&hdr, chansp[c],
+                                               offsp[e] + offset, n,
+                                               bufp + (c * noffs + e) * n)
+                        < n):
+                    bad = e
+                    break
+            if bad >= 0:
+                break
+
+    # close the file
+    edfclose_file(hdr.handle)
+
+    if bad >= 0:
+        raise IOError('Event with offset ' + str(offs[bad]) +
+                      ' is outside the bounds of the data.')
+
+    return out
@@ -8,20 +8,39 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 # local imports
-from .basewrapper import BaseWrapper
-from .edf import read_samples, read_number_of_samples
+from .basewrapper import BaseWrapper, _file_identity
+from .edf import read_event_samples, read_number_of_samples
 from .edf import read_samplerate, read_annotations
 from .edf import read_number_of_signals
 # global imports
 import numpy as np
 import os.path
+import threading
+
+# edflib refuses to open a file that is already open, so reads of the
+# same file are serialized (different files are read concurrently,
+# since the extension releases the GIL while reading)
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(filepath):
+    key = os.path.abspath(filepath)
+    with _file_locks_guard:
+        if key not in _file_locks:
+            _file_locks[key] = threading.Lock()
+        return _file_locks[key]
 
 
 class EdfWrapper(BaseWrapper):
     """
     Interface to data stored in a EDF file and related formats (such
     as BDF).
+
+    All channels of a request are read in one pass over the file, so
+    n_io_threads in get_event_data is ignored.
     """
+    _threaded_io = False
 
     def __init__(self, filepath):
         """
@@ -39,7 +58,8 @@ class EdfWrapper(BaseWrapper):
         else:
             raise IOError(str(filepath) + '\n does not exist!' +
                           'Valid path to data file is needed!')
-        self._nchannels = read_number_of_signals(self.filepath)
+        with _file_lock(self.filepath):
+            self._nchannels = read_number_of_signals(self.filepath)
 
         numbers = []
         names = []
@@ -59,7 +79,8 @@ class EdfWrapper(BaseWrapper):
         if channel is None:
             # pick first channel
             channel = 0
-        return read_number_of_samples(self.filepath, channel)
+        with _file_lock(self.filepath):
+            return read_number_of_samples(self.filepath, channel)
 
     def _get_channel_info(self):
         return self._channel_info
@@ -68,34 +89,39 @@ class EdfWrapper(BaseWrapper):
         if channel is None:
             # pick first channel
             channel = 0
-        return read_samplerate(self.filepath, channel)
+        with _file_lock(self.filepath):
+            return read_samplerate(self.filepath, channel)
 
     def _get_annotations(self):
-        return read_annotations(self.filepath)
+        with _file_lock(self.filepath):
+            return read_annotations(self.filepath)
+
+    def _get_identity(self):
+        return ('EdfWrapper', _file_identity([self.filepath]))
 
-    def _load_data(self, channels, event_offsets, dur_samp, offset_samp):
+    def _load_data(self, channels, event_offsets, dur_samp, offset_samp,
+                   out=None, dtype=None):
         """        
         """
-        # allocate for data
-        eventdata = np.empty((len(channels), len(event_offsets), dur_samp),
-                             dtype=np.float64) * np.nan
-
-        # loop over events
-        # PBS: eventually move this to the cython file
-        for c, channel in enumerate(channels):
-            for e, ev_offset in enumerate(event_offsets):
-                # set the range
-                ssamp = offset_samp + ev_offset
-
-                # read the data
-                dat = read_samples(self.filepath,
-                                   channel,
-                                   ssamp, dur_samp)
-
-                # check the ranges
-                if len(dat) < dur_samp:
-                    raise IOError('Event with offset ' + str(ev_offset) +
-                                  ' is outside the bounds of the data.')
-                eventdata[c, e, :] = dat
+        shape = (len(channels), len(event_offsets), dur_samp)
+        # read straight into the caller's array when the extension can
+        # (C-contiguous float64), otherwise read and convert
+        if out is not None:
+            out = self._prepare_out(out, shape, None)
+            direct = out.dtype == np.float64 and out.flags.c_contiguous
+        else:
+            direct = dtype is None or np.dtype(dtype) == np.float64
+
+        # read all channels and events with the file opened only once
+        # (raises an IOError if an event is outside the bounds)
+        with _file_lock(self.filepath):
+            eventdata = read_event_samples(
+                self.filepath, np.asarray(channels), event_offsets,
+                dur_samp, out=out if direct else None, offset=offset_samp)
+
+        if not direct:
+            out = self._prepare_out(out, shape, dtype)
+            out[:] = eventdata
+            eventdata = out
 
         return eventdata
@@ -0,0 +1,159 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+# global imports
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+class EpochCache(object):
+    """
+    In-memory and (optional) on-disk cache for the epochs returned by
+    BaseWrapper.get_event_data.
+
+    Entries are keyed by a hash of the identity of the wrapper (the
+    path, modification time, and size of its files) and all the
+    parameters used to load and process the data, so changing either
+    the files or the parameters results in a cache miss.  Both levels
+    evict the least recently used entries once their size limits are
+    exceeded.
+
+    Parameters
+    ----------
+    cachedir : {str},optional
+        Directory for the on-disk cache.  If None, only the in-memory
+        cache is used.
+    max_memory_bytes : {int},optional
+        Maximum total size of the arrays kept in memory.
+    max_disk_bytes : {int},optional
+        Maximum total size of the arrays kept in cachedir.
+
+    Examples
+    --------
+    >>> cache = EpochCache('/tmp/epochs')
+    >>> dat = wrapper.get_event_data(0, events, -.5, 1., cache=cache)
+    """
+
+    def __init__(self, cachedir=None, max_memory_bytes=256 * 1024**2,
+                 max_disk_bytes=4 * 1024**3):
+        self.cachedir = cachedir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        if cachedir is not None and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def make_key(self, identity, *params):
+        """
+        Return the hash of a wrapper identity and the processing
+        parameters (arrays are hashed by their contents).
+        """
+        h = hashlib.sha1()
+        h.update(repr(identity).encode())
+        for p in params:
+            if isinstance(p, np.ndarray):
+                h.update(repr((p.dtype.str, p.shape)).encode())
+                h.update(np.ascontiguousarray(p).tobytes())
+            else:
+                h.update(repr(p).encode())
+        return h.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cachedir, key)
+        return base + '.npy', base + '.npz'
+
+    def get(self, key):
+        """
+        Return (data, info) for a key or None if it is not cached.
+        Data from memory are copied and data from disk are a
+        copy-on-write memmap, so changing them leaves the cache intact.
+        """
+        if key in self._memory:
+            data, info = self._memory.pop(key)
+            self._memory[key] = (data, info)
+            return data.copy(), info
+        if self.cachedir is not None:
+            data_path, meta_path = self._paths(key)
+            if os.path.isfile(data_path) and os.path.isfile(meta_path):
+                # (nothing is unpickled, since the directory may be
+                # shared)
+                with np.load(meta_path, allow_pickle=False) as meta:
+                    info = dict([(k, meta[k][()] if meta[k].ndim == 0
+                                  else meta[k]) for k in meta.files])
+                data = np.load(data_path, mmap_mode='c',
+                               allow_pickle=False)
+                # mark as recently used and keep in memory for the
+                # next hit
+                os.utime(data_path, None)
+                self._put_memory(key, data, info)
+                return data, info
+        return None
+
+    def put(self, key, data, info):
+        """
+        Store an array (and a dict of info with arrays and numbers)
+        for a key.  Entries with object arrays are only kept in
+        memory.
+        """
+        data = np.asarray(data)
+        self._put_memory(key, data, info)
+        # on disk
+        if (self.cachedir is not None and data.nbytes <= self.max_disk_bytes
+                and not data.dtype.hasobject and
+                not any([np.asarray(v).dtype.hasobject
+                         for v in info.values()])):
+            data_path, meta_path = self._paths(key)
+            np.save(data_path, data)
+            np.savez(meta_path, **info)
+            self._evict_disk()
+
+    def _put_memory(self, key, data, info):
+        # (a copy of) the data in the in-memory LRU
+        if data.nbytes > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[0].nbytes
+        self._memory[key] = (np.array(data), info)
+        self._memory_bytes += data.nbytes
+        while self._memory_bytes > self.max_memory_bytes:
+            old_key, (old_data, old_info) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_data.nbytes
+
+    def _evict_disk(self):
+        # gather the cached files, least recently used first
+        entries = []
+        for fname in os.listdir(self.cachedir):
+            if fname.endswith('.npy'):
+                path = os.path.join(self.cachedir, fname)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum([e[1] for e in entries])
+        for mtime, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            meta_path = path[:-len('.npy')] + '.npz'
+            if os.path.isfile(meta_path):
+                os.remove(meta_path)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all entries from memory and disk.
+        """
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self.cachedir is not None:
+            for fname in os.listdir(self.cachedir):
+                if fname.endswith('.npy') or fname.endswith('.npz'):
+                    os.remove(os.path.join(self.cachedir, fname))
@@ -9,11 +9,36 @@
 
 # global imports
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
 from .timeseries import TimeSeries, Dim
 
 #import pdb
 
 
+def _completed(submit, items, max_pending):
+    """
+    Yield (item, result) pairs as the futures returned by submit(item)
+    complete, with at most max_pending of them in flight, so finished
+    results do not pile up in memory.
+    """
+    pending = {}
+    try:
+        for item in items:
+            pending[submit(item)] = item
+            while len(pending) >= max_pending:
+                done = wait(pending, return_when=FIRST_COMPLETED)[0]
+                for fut in done:
+                    yield pending.pop(fut), fut.result()
+        while pending:
+            done = wait(pending, return_when=FIRST_COMPLETED)[0]
+            for fut in done:
+                yield pending.pop(fut), fut.result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
 class Events(np.recarray):
     """
     A recarray with the events to be analyzed. Includes convenience
@@ -122,7 +147,8 @@ class Events(np.recarray):
                  filt_freq=None, filt_type='stop', filt_order=4,
                  keep_buffer=False, esrc='esrc', eoffset='eoffset',
                  loop_axis=None, num_mp_procs=0,
-                 eoffset_in_time=True):
+                 eoffset_in_time=True, n_io_threads=0,
+                 num_src_workers=0, src_worker_type='thread'):
         """
         Return the requested range of data for each event by using the
         proper data retrieval mechanism for each event.
@@ -159,10 +185,21 @@ class Events(np.recarray):
         eoffset_in_time: {boolean},optional
             If True, the unit of the event offsets is taken to be
             time (unit of the data), otherwise samples.
+        n_io_threads: {int},optional
+            Number of threads each source uses to load its channels
+            (see BaseWrapper.get_event_data).
+        num_src_workers: {int},optional
+            Number of workers for loading the different sources
+            concurrently.  0 means load the sources serially.
+        src_worker_type: {'thread','process'},optional
+            Whether the workers are threads or processes (the sources
+            must be picklable for processes).
 
         Returns
         -------
-        A TimeSeries instance with dimensions (channels,events,time).
+        A TimeSeries instance with dimensions (channels,events,time)
+        and the events in their original order.  Its dtype can hold
+        the data of all sources (see np.result_type).
         """
 
         # check for necessary fields
@@ -171,54 +208,75 @@ class Events(np.recarray):
             raise ValueError(esrc + ' and ' + eoffset + ' must be valid fieldnames ' +
                              'specifying source and offset for the data.')
 
-        # get ready to load dat
-        eventdata = []
-        events = []
-
-        # speed up by getting unique event sources first
-        usources = np.unique(self[esrc])
-
-        # loop over unique sources
-        eventdata = None
-        for src in usources:
-            # get the eventOffsets from that source
-            ind = np.atleast_1d(self[esrc] == src)
-
-            if len(ind) == 1:
-                event_offsets = self[eoffset]
-                events.append(self)
+        # group the event indices by source (in order of appearance)
+        srcs = np.atleast_1d(self[esrc])
+        ev_inds = {}
+        for i, src in enumerate(srcs):
+            ev_inds.setdefault(src, []).append(i)
+        usources = list(ev_inds.keys())
+        offsets = np.atleast_1d(self[eoffset])
+
+        # arguments for getting the timeseries for each source
+        def _load_args(src):
+            return (channels, offsets[ev_inds[src]],
+                    start_time, end_time, buffer_time,
+                    resampled_rate, filt_freq, filt_type, filt_order,
+                    keep_buffer, loop_axis, num_mp_procs, eoffset,
+                    eoffset_in_time, n_io_threads)
+
+        # load the sources, possibly concurrently (at most
+        # num_src_workers results are held at a time)
+        if num_src_workers and len(usources) > 1:
+            if src_worker_type == 'thread':
+                pool = ThreadPoolExecutor(max_workers=num_src_workers)
+            elif src_worker_type == 'process':
+                pool = ProcessPoolExecutor(max_workers=num_src_workers)
             else:
-                event_offsets = self[ind][eoffset]
-                events.append(self[ind])
-
-            # print "Loading %d events from %s" % (ind.sum(),src)
-            # get the timeseries for those events
-            newdat = src.get_event_data(channels,
-                                        event_offsets,
-                                        start_time,
-                                        end_time,
-                                        buffer_time,
-                                        resampled_rate,
-                                        filt_freq,
-                                        filt_type,
-                                        filt_order,
-                                        keep_buffer,
-                                        loop_axis,
-                                        num_mp_procs,
-                                        eoffset,
-                                        eoffset_in_time)
-            if eventdata is None:
-                eventdata = newdat
-            else:
-                eventdata = eventdata.extend(newdat, axis=1)
+                raise ValueError("src_worker_type must be 'thread' or " +
+                                 "'process'. Invalid value: " +
+                                 str(src_worker_type))
+            results = _completed(
+                lambda src: pool.submit(src.get_event_data,
+                                        *_load_args(src)),
+                usources, num_src_workers)
+        else:
+            pool = None
+            results = ((src, src.get_event_data(*_load_args(src)))
+                       for src in usources)
+
+        # write each source into the preallocated data as it arrives
+        # (the channel and time dims are known once the first source
+        # is loaded)
+        eventdata = None
+        try:
+            for src, newdat in results:
+                if eventdata is None:
+                    tdim = newdat['time']
+                    cdim = newdat['channels']
+                    srate = newdat.samplerate
+                    eventdata = np.empty((newdat.shape[0], len(srcs),
+                                          newdat.shape[2]),
+                                         dtype=newdat.dtype)
+                else:
+                    if (newdat.shape[0] != eventdata.shape[0] or
+                            newdat.shape[2] != eventdata.shape[2]):
+                        raise ValueError('The data from all sources must ' +
+                                         'have the same channels and ' +
+                                         'time range.')
+                    dtype = np.result_type(eventdata.dtype, newdat.dtype)
+                    if dtype != eventdata.dtype:
+                        # promote the sources loaded so far
+                        eventdata = eventdata.astype(dtype)
+                eventdata[:, ev_inds[src], :] = newdat
+                del newdat
+        finally:
+            results.close()
+            if pool is not None:
+                pool.shutdown()
 
-        # concatenate (must eventually check that dims match)
-        tdim = eventdata['time']
-        cdim = eventdata['channels']
-        srate = eventdata.samplerate
-        events = np.concatenate(events).view(self.__class__)
         eventdata = TimeSeries(eventdata,
                                'time', srate,
-                               dims=[cdim, Dim(events, 'events'), tdim])
+                               dims=[cdim, Dim(np.atleast_1d(self), 'events'),
+                                     tdim])
 
         return eventdata
@@ -8,25 +8,193 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 # global imports
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 import h5py
 
 # local imports
-from .basewrapper import BaseWrapper
+from .basewrapper import BaseWrapper, _file_identity
 from .timeseries import TimeSeries
+from .lazytimeseries import LazyTimeSeries
+from ptsa import filt
+from ptsa.helper import sliding_windows
+
+
+# handles inherited by a forked child process (see _HandlePool)
+_forked_handles = []
+
+
+class _HandlePool(object):
+    """
+    Least-recently-used pool of open h5py.File handles keyed by file
+    path and mode.  A handle opened for appending is also used for
+    reading, and a read-only handle is closed before the same file is
+    opened for appending.  The pool is guarded by a lock, so it can be
+    used from several threads.
+
+    Handles for appending are only kept while a writing() block is
+    active, since HDF5 locks files that are open for writing (so no
+    other process could even read them).  A forked child process
+    starts with an empty pool.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._handles = OrderedDict()
+        # the file_opts each handle was opened with
+        self._opts = {}
+        # number of active writing() blocks per path
+        self._writers = {}
+        self._lock = threading.RLock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # the child must not use (or close, which would release the
+        # parent's file locks) the inherited handles, so keep them
+        # alive but out of the pool
+        _forked_handles.extend(self._handles.values())
+        self._handles = OrderedDict()
+        self._opts = {}
+        self._writers = {}
+        self._lock = threading.RLock()
+
+    def get(self, filepath, mode='r', **file_opts):
+        """
+        Return an open handle for the file, opening it if necessary.
+        Any file_opts (e.g., rdcc_nbytes) that are not None are passed
+        on to h5py.File.  They can only be applied when a file is
+        opened, so a pooled handle that was opened with different
+        values is closed and reopened.
+        """
+        path = os.path.abspath(filepath)
+        file_opts = dict([(k, v) for k, v in file_opts.items()
+                          if v is not None])
+        with self._lock:
+            if mode == 'r' and (path, 'a') in self._handles:
+                # the writable handle will do
+                mode = 'a'
+            elif mode == 'a':
+                # HDF5 will not open a file we already have open
+                # read-only
+                self._close_key((path, 'r'))
+            key = (path, mode)
+
+            f = self._handles.pop(key, None)
+            opts = self._opts.get(key, {})
+            if f is not None and any([opts.get(k) != v
+                                      for k, v in file_opts.items()]):
+                # reopen to apply the new options
+                if f.id.valid:
+                    f.close()
+                f = None
+            if f is None or not f.id.valid:
+                f = h5py.File(path, mode, **file_opts)
+                self._opts[key] = file_opts
+            # (re)insert as the most recently used
+            self._handles[key] = f
+
+            # evict the least recently used handles (except those
+            # being written to)
+            old_keys = [k for k in self._handles
+                        if k[1] != 'a' or k[0] not in self._writers]
+            for old_key in old_keys[:max(0, len(self._handles) -
+                                          self.max_open)]:
+                self._close_key(old_key)
+            return f
+
+    @contextmanager
+    def writing(self, filepath, **file_opts):
+        """
+        Context manager providing a handle for appending to a file.
+        The handle is closed (after flushing) when the outermost
+        writing() block for the file exits.
+        """
+        path = os.path.abspath(filepath)
+        with self._lock:
+            self._writers[path] = self._writers.get(path, 0) + 1
+        try:
+            yield self.get(path, 'a', **file_opts)
+        finally:
+            with self._lock:
+                self._writers[path] -= 1
+                if self._writers[path] == 0:
+                    del self._writers[path]
+                    self._close_key((path, 'a'))
+
+    def _close_key(self, key):
+        with self._lock:
+            f = self._handles.pop(key, None)
+            self._opts.pop(key, None)
+            if f is not None and f.id.valid:
+                f.close()
+
+    def close(self, filepath=None):
+        """
+        Close all handles to a file (or every handle if filepath is
+        None).
+        """
+        with self._lock:
+            if filepath is None:
+                keys = list(self._handles.keys())
+            else:
+                path = os.path.abspath(filepath)
+                keys = [k for k in self._handles.keys() if k[0] == path]
+            for key in keys:
+                self._close_key(key)
+
+
+def _to_hdf5_rec(rec):
+    """
+    Convert unicode fields (which h5py can not store) of a record
+    array to byte strings.
+    """
+    rec = np.asarray(rec)
+    if rec.dtype.names is None:
+        if rec.dtype.kind == 'U':
+            rec = np.char.encode(rec)
+        return rec
+    descr = []
+    for name in rec.dtype.names:
+        dt = rec.dtype[name]
+        if dt.kind == 'U':
+            dt = np.dtype('S%d' % max(1, dt.itemsize // 4))
+        descr.append((name, dt))
+    new_rec = np.empty(rec.shape, dtype=descr)
+    for name in rec.dtype.names:
+        if rec.dtype[name].kind == 'U':
+            new_rec[name] = np.char.encode(rec[name])
+        else:
+            new_rec[name] = rec[name]
+    return new_rec
 
 
 class HDF5Wrapper(BaseWrapper):
     """
     Interface to data stored in an HDF5 file.
+
+    Open file handles are kept in a pool shared by all instances (so
+    repeated calls do not reopen the file) and the metadata are cached
+    after the first read.  Call close() or use the wrapper as a
+    context manager to release the file.
     """
 
+    # shared pool of open file handles
+    _handle_pool = _HandlePool()
+
+    # upper limit on the size of a single merged read in _load_data
+    _max_read_bytes = 64 * 1024**2
+
     def __init__(self, filepath, dataset_name='data',
                  annotations_name='annotations',
                  channel_info_name='channel_info',
                  data=None, file_dtype=None, apply_gain=True, gain_buffer=.005,
                  samplerate=None, nchannels=None, nsamples=None,
-                 annotations=None, channel_info=None, **hdf5opts):
+                 annotations=None, channel_info=None, rdcc_nbytes=None,
+                 **hdf5opts):
         """
         Initialize the interface to the data.
 
@@ -45,6 +213,13 @@ class HDF5Wrapper(BaseWrapper):
 
         HDF5Wrapper('data.hdf5', data=data, file_dtype=np.int16, compression='gzip')
 
+        The size of the HDF5 chunk cache (in bytes) used when the file
+        is opened can be set with rdcc_nbytes.  Increasing it beyond
+        the 1MB default helps when reading events from compressed,
+        chunked datasets.  The cache size is set when a file is
+        opened, so a file already in the pool of open handles with a
+        different size is reopened.
+
         """
         # set up the basic params of the data
         self.filepath = filepath
@@ -55,63 +230,202 @@ class HDF5Wrapper(BaseWrapper):
         self.gain_buffer = gain_buffer
         self.gain = None
         self.hdf5opts = hdf5opts
+        self.rdcc_nbytes = rdcc_nbytes
 
         self.file_dtype = file_dtype
         self.data_dtype = None
 
+        # cached dataset and metadata
+        self._dset = None
+        self._dset_file = None
+        self._clear_cache()
+
         # see if create dataset
         if not data is None:
             # must provide samplerate and data
-            # connect to the file and get the dataset
-            f = h5py.File(self.filepath, 'a')
-
-            # use the data to create a dataset
-            self.data_dtype = data.dtype
-            d = f.create_dataset(self.dataset_name,
-                                 data=self._data_to_file(data),
-                                 **hdf5opts)
-            d.attrs['data_dtype'] = data.dtype.char
-            d.attrs['gain'] = self.gain
-
-            if not 'samplerate' in d.attrs:
-                # must have provided samplerate
-                if isinstance(data, TimeSeries):
-                    # get the samplerate from the TimeSeries
-                    samplerate = data.samplerate
-                if samplerate is None:
-                    raise ValueError("You must specify a samplerate " +
-                                     "if the dataset does not already exist.")
-                # set the samplerate
-                d.attrs['samplerate'] = samplerate
-
-            # create annotations if necessary
-            if not annotations is None:
-                if self.annotations_name in f:
-                    raise ValueError("Told to create dataset annotations, " +
-                                     "but %s already exists." %
-                                     self.annotations_name)
-                a = f.create_dataset(self.annotations_name,
-                                     data=annotations, **hdf5opts)
-
-            # create channel_info if necessary
-            if not channel_info is None:
-                if self.channel_info_name in f:
-                    raise ValueError("Told to create dataset channel_info, " +
-                                     "but %s already exists." %
-                                     self.channel_info_name)
-                c = f.create_dataset(self.channel_info_name,
-                                     data=channel_info, **hdf5opts)
-
-            # close the hdf5 file
-            f.close()
+            # connect to the file and get the dataset (the file is
+            # closed again when done)
+            with self._writing() as f:
+                # use the data to create a dataset
+                self.data_dtype = data.dtype
+                d = f.create_dataset(self.dataset_name,
+                                     data=self._data_to_file(data),
+                                     **hdf5opts)
+                d.attrs['data_dtype'] = data.dtype.char
+                d.attrs['gain'] = self.gain
+
+                if not 'samplerate' in d.attrs:
+                    # must have provided samplerate
+                    if isinstance(data, TimeSeries):
+                        # get the samplerate from the TimeSeries
+                        samplerate = data.samplerate
+                    if samplerate is None:
+                        raise ValueError("You must specify a samplerate " +
+                                         "if the dataset does not already " +
+                                         "exist.")
+                    # set the samplerate
+                    d.attrs['samplerate'] = samplerate
+
+                # create annotations if necessary
+                if not annotations is None:
+                    if self.annotations_name in f:
+                        raise ValueError(("Told to create dataset " +
+                                          "annotations, but %s already " +
+                                          "exists.") % self.annotations_name)
+                    a = f.create_dataset(self.annotations_name,
+                                         data=annotations, **hdf5opts)
+
+                # create channel_info if necessary
+                if not channel_info is None:
+                    if self.channel_info_name in f:
+                        raise ValueError(("Told to create dataset " +
+                                          "channel_info, but %s already " +
+                                          "exists.") % self.channel_info_name)
+                    c = f.create_dataset(self.channel_info_name,
+                                         data=channel_info, **hdf5opts)
+
+                # make sure it's on disk
+                f.flush()
         else:
             # connect to the file and get info
-            f = h5py.File(self.filepath, 'r')
-            d = f[self.dataset_name]
+            d = self._get_dataset()
             self.data_dtype = np.dtype(d.attrs['data_dtype'])
             self.file_dtype = d.dtype
             self.gain = d.attrs['gain']
 
+    @classmethod
+    def from_wrapper(cls, wrapper, filepath, chunk_samples=2**15,
+                     channels=None, dataset_name='data',
+                     annotations_name='annotations',
+                     channel_info_name='channel_info',
+                     file_dtype=None, apply_gain=True, gain_buffer=.005,
+                     copy_info=True, rdcc_nbytes=None, filt_freq=None,
+                     filt_type='stop', filt_order=4, **hdf5opts):
+        """
+        Convert the data from any wrapper into an HDF5 file, streaming
+        it in blocks so that memory use is bounded by the block size
+        rather than the size of the recording.  The data can be
+        (zero-phase) filtered on the way, which is how to filter a
+        whole session, e.g., high-pass it at .5 Hz.
+
+        Parameters
+        ----------
+        wrapper : {BaseWrapper}
+            Wrapper providing the data to convert.
+        filepath : {str}
+            HDF5 file to write to (created if necessary).
+        chunk_samples : {int},optional
+            Number of samples (for all channels) to read and write at
+            a time.
+        channels : {array_like},optional
+            Indices of the channels to convert (defaults to all).
+        file_dtype : {numpy.dtype},optional
+            Data type to store in the file.  When storing float data
+            as integers, a first pass over the data determines the
+            gain (see HDF5Wrapper).
+        copy_info : {bool},optional
+            Whether to copy the annotations and channel info from the
+            wrapper if it provides them.
+        filt_freq : {array_like},optional
+            The range of frequencies to filter with a Butterworth
+            filter (see filt.filtfilt_blocks).  The filtered data are
+            float64 and must be stored as floats.
+        filt_type : {scipy.signal.band_dict.keys()},optional
+            Filter type.
+        filt_order : {int},optional
+            The order of the filter.
+        **hdf5opts : {**kwargs},optional
+            Options for creating the (resizable) dataset, such as
+            compression and chunks.
+
+        Returns
+        -------
+        wrapper : {HDF5Wrapper}
+            Wrapper for the new dataset.
+        """
+        if channels is None:
+            channels = np.arange(wrapper.nchannels)
+        channels = np.atleast_1d(channels)
+        nsamples = int(wrapper.nsamples)
+        starts = list(range(0, nsamples, int(chunk_samples)))
+
+        def _read_block(start):
+            dur = min(int(chunk_samples), nsamples - start)
+            return np.asarray(wrapper._load_data(channels, [start],
+                                                 dur, 0))[:, 0, :]
+
+        # get the data dtype from the first block
+        block = _read_block(0)
+        data_dtype = block.dtype
+        if filt_freq is not None:
+            # the filter passes are stored in the file
+            data_dtype = np.dtype(np.float64)
+            block = None
+        if file_dtype is None:
+            file_dtype = data_dtype
+        file_dtype = np.dtype(file_dtype)
+        if filt_freq is not None and file_dtype.kind != 'f':
+            raise ValueError('Filtered data must be stored as floats.')
+
+        # first pass to calc the gain if going from float to int
+        gain = 1.0
+        if (file_dtype.kind == 'i') and (data_dtype.kind == 'f'):
+            maxabs = np.abs(block).max()
+            for start in starts[1:]:
+                maxabs = max(maxabs, np.abs(_read_block(start)).max())
+            fr = np.iinfo(file_dtype).max * 2
+            dr = maxabs * 2 * (1. + gain_buffer)
+            if dr > 0:
+                gain = dr / fr
+
+        # keep the file open for writing until all the blocks are in
+        # (it is closed, and so unlocked, when done)
+        with cls._handle_pool.writing(filepath,
+                                      rdcc_nbytes=rdcc_nbytes) as f:
+            # create an empty, resizable dataset (with room for all the
+            # data when filtering in place)
+            d = f.create_dataset(dataset_name,
+                                 shape=(len(channels),
+                                        0 if filt_freq is None else nsamples),
+                                 maxshape=(len(channels), None),
+                                 dtype=file_dtype, **hdf5opts)
+            d.attrs['data_dtype'] = data_dtype.char
+            d.attrs['gain'] = gain
+            d.attrs['samplerate'] = wrapper.samplerate
+
+            # copy over the info
+            if copy_info:
+                infos = [(annotations_name, wrapper._get_annotations),
+                         (channel_info_name,
+                          lambda: wrapper.channel_info[channels])]
+                for name, get_info in infos:
+                    try:
+                        info = get_info()
+                    except NotImplementedError:
+                        info = None
+                    if info is not None:
+                        f.create_dataset(name, data=_to_hdf5_rec(info))
+            f.flush()
+
+            # then stream the blocks into the file
+            hw = cls(filepath, dataset_name=dataset_name,
+                     annotations_name=annotations_name,
+                     channel_info_name=channel_info_name,
+                     apply_gain=apply_gain, rdcc_nbytes=rdcc_nbytes)
+            if filt_freq is not None:
+                filt.buttfilt_blocks(LazyTimeSeries(wrapper, channels),
+                                     f[dataset_name], filt_freq,
+                                     wrapper.samplerate, filt_type,
+                                     filt_order, block_samples=chunk_samples)
+                f.flush()
+            else:
+                hw.append_data(block)
+                del block
+                for start in starts[1:]:
+                    hw.append_data(_read_block(start))
+
+        return hw
+
     def _data_to_file(self, data):
         # process the datatypes
         if self.file_dtype is None:
@@ -148,97 +462,211 @@ class HDF5Wrapper(BaseWrapper):
         else:
             return np.asarray(data, dtype=self.data_dtype)
 
+    def _get_file(self, mode='r'):
+        """
+        Return an open handle to the file from the shared pool.
+        """
+        return self._handle_pool.get(self.filepath, mode,
+                                     rdcc_nbytes=self.rdcc_nbytes)
+
+    def _writing(self):
+        """
+        Context manager providing the file handle for writing (see
+        _HandlePool.writing).
+        """
+        return self._handle_pool.writing(self.filepath,
+                                         rdcc_nbytes=self.rdcc_nbytes)
+
+    def _get_dataset(self, mode='r'):
+        """
+        Return the dataset, reusing it as long as its file handle is
+        still open.
+        """
+        f = self._get_file(mode)
+        if self._dset is None or self._dset_file is not f or \
+                not self._dset.id.valid:
+            self._dset = f[self.dataset_name]
+            self._dset_file = f
+        return self._dset
+
+    def _clear_cache(self):
+        self._samplerate = None
+        self._nchannels = None
+        self._annotations = None
+        self._channel_info = None
+
+    def close(self):
+        """
+        Close all open handles to the file.
+        """
+        self._dset = None
+        self._dset_file = None
+        self._handle_pool.close(self.filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # h5py objects can not be pickled, so the dataset is looked up
+        # again (through the pool of the receiving process) when needed
+        state = self.__dict__.copy()
+        state['_dset'] = None
+        state['_dset_file'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def _get_samplerate(self, channel=None):
         # Same samplerate for all channels.
         # get the samplerate property of the dataset
-        f = h5py.File(self.filepath, 'r')
-        data = f[self.dataset_name]
-        samplerate = data.attrs['samplerate']
-        f.close()
-        return samplerate
+        if self._samplerate is None:
+            self._samplerate = self._get_dataset().attrs['samplerate']
+        return self._samplerate
 
     def _get_nsamples(self, channel=None):
-        # get the dimensions of the data
-        f = h5py.File(self.filepath, 'r')
-        data = f[self.dataset_name]
-        nsamples = data.shape[1]
-        f.close()
-        return nsamples
+        # get the dimensions of the data (not cached, since any
+        # wrapper of the file can append to it)
+        return self._get_dataset().shape[1]
 
     def _get_nchannels(self):
         # get the dimensions of the data
-        f = h5py.File(self.filepath, 'r')
-        data = f[self.dataset_name]
-        nchannels = data.shape[0]
-        f.close()
-        return nchannels
+        if self._nchannels is None:
+            self._nchannels = self._get_dataset().shape[0]
+        return self._nchannels
 
     def _get_annotations(self):
         # get the dimensions of the data
-        f = h5py.File(self.filepath, 'r')
-        if self.annotations_name in f:
-            annot = f[self.annotations_name][:]
-        else:
-            annot = None
-        f.close()
-        return annot
+        if self._annotations is None:
+            f = self._get_file()
+            if self.annotations_name in f:
+                self._annotations = f[self.annotations_name][:]
+        return self._annotations
 
     def _set_annotations(self, annotations):
         # get the dimensions of the data
-        f = h5py.File(self.filepath, 'a')
-        if self.annotations_name in f:
-            del f[self.annotations_name]
+        with self._writing() as f:
+            if self.annotations_name in f:
+                del f[self.annotations_name]
+
+            a = f.create_dataset(self.annotations_name,
+                                 data=annotations, **self.hdf5opts)
+            f.flush()
+        self._annotations = None
 
-        a = f.create_dataset(self.annotations_name,
-                             data=annotations, **self.hdf5opts)
-        f.close()
+    def _get_identity(self):
+        return ('HDF5Wrapper', _file_identity([self.filepath]),
+                self.dataset_name, self.apply_gain)
 
     def _get_channel_info(self):
         # get the dimensions of the data
-        f = h5py.File(self.filepath, 'r')
-        if self.channel_info_name in f:
-            chan_info = f[self.channel_info_name][:]
-        else:
-            chan_info = None
-        f.close()
-        return chan_info
+        if self._channel_info is None:
+            f = self._get_file()
+            if self.channel_info_name in f:
+                self._channel_info = f[self.channel_info_name][:]
+        return self._channel_info
 
     def _set_channel_info(self, channel_info):
         # get the dimensions of the data
-        f = h5py.File(self.filepath, 'a')
-        if self.channel_info_name in f:
-            del f[self.channel_info_name]
+        with self._writing() as f:
+            if self.channel_info_name in f:
+                del f[self.channel_info_name]
 
-        a = f.create_dataset(self.channel_info_name,
-                             data=channel_info, **self.hdf5opts)
-        f.close()
+            a = f.create_dataset(self.channel_info_name,
+                                 data=channel_info, **self.hdf5opts)
+            f.flush()
+        self._channel_info = None
 
-    def _load_data(self, channels, event_offsets, dur_samp, offset_samp):
-        """
+    def _merge_windows(self, ssamps, dur_samp, data, nchannels):
         """
-        # connect to the file and get the dataset
-        f = h5py.File(self.filepath, 'r')
-        data = f[self.dataset_name]
-
-        # allocate for data
-        eventdata = np.empty((len(channels), len(event_offsets), dur_samp),
-                             dtype=self.data_dtype) * np.nan
+        Group event windows into as few hyperslab reads as possible.
 
-    # loop over events
-        for e, evOffset in enumerate(event_offsets):
-                # set the range
-            ssamp = offset_samp + evOffset
-            esamp = ssamp + dur_samp
+        Windows are sorted by start sample and merged while they
+        overlap, touch, or share an HDF5 chunk along the time axis
+        (so no chunk is decompressed more than once), as long as the
+        merged read stays below _max_read_bytes.
 
-            # check the ranges
-            if ssamp < 0 or esamp > data.shape[1]:
-                raise IOError('Event with offset ' + str(evOffset) +
-                              ' is outside the bounds of the data.')
-            eventdata[:, e, :] = self._data_from_file(
-                data[channels, ssamp:esamp])
+        Returns
+        -------
+        blocks : {list}
+            List of (event_indices, start_samp, end_samp) tuples.
+        """
+        # chunk size along the time axis
+        if data.chunks is None:
+            csize = 1
+        else:
+            csize = data.chunks[1]
+        max_span = max(dur_samp, self._max_read_bytes //
+                       max(1, nchannels * data.dtype.itemsize))
+
+        order = np.argsort(ssamps, kind='mergesort')
+        blocks = []
+        cur = [order[0]]
+        bstart = ssamps[order[0]]
+        bend = bstart + dur_samp
+        for i in order[1:]:
+            s = ssamps[i]
+            e = s + dur_samp
+            if ((s <= bend or s // csize <= (bend - 1) // csize) and
+                    max(e, bend) - bstart <= max_span):
+                # add to the current read
+                cur.append(i)
+                bend = max(e, bend)
+            else:
+                # start a new read
+                blocks.append((np.array(cur), bstart, bend))
+                cur = [i]
+                bstart = s
+                bend = e
+        blocks.append((np.array(cur), bstart, bend))
+        return blocks
+
+    def _load_data(self, channels, event_offsets, dur_samp, offset_samp,
+                   out=None, dtype=None):
+        """
+        """
+        # get the dataset
+        data = self._get_dataset()
+        channels = np.atleast_1d(channels)
+        event_offsets = np.atleast_1d(event_offsets)
 
-        # close the file
-        f.close()
+        # allocate for data
+        if dtype is None:
+            dtype = self.data_dtype
+        eventdata = self._prepare_out(
+            out, (len(channels), len(event_offsets), dur_samp), dtype)
+        if len(event_offsets) == 0 or len(channels) == 0:
+            return eventdata
+
+        # check the ranges
+        ssamps = event_offsets + offset_samp
+        bad_evs = (ssamps < 0) | (ssamps + dur_samp > data.shape[1])
+        if np.any(bad_evs):
+            raise IOError('Event with offset ' +
+                          str(event_offsets[np.nonzero(bad_evs)[0][0]]) +
+                          ' is outside the bounds of the data.')
+
+        # split the (sorted) channels into contiguous runs, so each
+        # read is a simple hyperslab instead of a fancy index
+        corder = np.argsort(channels, kind='mergesort')
+        schans = channels[corder]
+        runs = np.split(np.arange(len(schans)),
+                        np.nonzero(np.diff(schans) != 1)[0] + 1)
+
+        # read each merged window once and scatter the events into
+        # the output
+        for evinds, bstart, bend in self._merge_windows(ssamps, dur_samp,
+                                                        data, len(channels)):
+            for run in runs:
+                block = data[schans[run[0]]:schans[run[-1]] + 1,
+                             bstart:bend]
+                windows = sliding_windows(block, dur_samp)[
+                    :, ssamps[evinds] - bstart]
+                eventdata[np.ix_(corder[run], evinds)] = \
+                    self._data_from_file(windows)
 
         return eventdata
 
@@ -246,47 +674,39 @@ class HDF5Wrapper(BaseWrapper):
         """
         Must be all channels.
         """
-        # connect to the file and get the dataset
-        f = h5py.File(self.filepath, 'a')
-
         # get the dataset (must already exist)
-        d = f[self.dataset_name]
-
-        # check data size
-        if data.shape[0] != d.shape[0]:
-            raise ValueError("New data must have the same number of channels: %d." %
-                             d.shape[0])
+        with self._writing() as f:
+            d = f[self.dataset_name]
 
-        # reshape to hold new data
-        cursamp = d.shape[1]
-        newsamp = data.shape[1]
-        d.shape = (d.shape[0], cursamp + newsamp)
+            # check data size
+            if data.shape[0] != d.shape[0]:
+                raise ValueError("New data must have the same number of " +
+                                 "channels: %d." % d.shape[0])
 
-        # append the data
-        d[:, cursamp:cursamp + newsamp] = self._data_to_file(data)
+            # reshape to hold new data
+            cursamp = d.shape[1]
+            newsamp = data.shape[1]
+            d.resize((d.shape[0], cursamp + newsamp))
 
-        # close the file
-        f.close()
+            # append the data
+            d[:, cursamp:cursamp + newsamp] = self._data_to_file(data)
+            f.flush()
 
     def set_channel_data(self, channel, data):
         """
         Set the data for an entire channel.  Will reshape the nsamples
         of the entire dataset to match, throwing out data if smaller.
         """
-        # connect to the file and get the dataset
-        f = h5py.File(self.filepath, 'a')
-
         # get the dataset (must already exist)
-        d = f[self.dataset_name]
-
-        # reshape if necessary
-        cursamp = d.shape[1]
-        newsamp = len(data)
-        if cursamp != newsamp:
-            d.shape = (d.shape[0], newsamp)
+        with self._writing() as f:
+            d = f[self.dataset_name]
 
-        # set the data
-        d[channel, :] = self._data_to_file(data)
+            # reshape if necessary
+            cursamp = d.shape[1]
+            newsamp = len(data)
+            if cursamp != newsamp:
+                d.resize((d.shape[0], newsamp))
 
-        # close the file
-        f.close()
+            # set the data
+            d[channel, :] = self._data_to_file(data)
+            f.flush()
@@ -0,0 +1,184 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+# global imports
+import re
+import numpy as np
+
+# local imports
+from .timeseries import TimeSeries, Dim
+
+
+class LazyTimeSeries(object):
+    """
+    Continuous [channels, time] view of the data behind a wrapper
+    that reads nothing until it is materialized.
+
+    Indexing and select only narrow down the channels and the
+    (contiguous) sample range of the view.  The data are read from the
+    wrapper with load (or anything that converts it to an array), or
+    piecewise with iter_chunks.
+
+    Parameters
+    ----------
+    wrapper : {BaseWrapper}
+        Wrapper providing the data.
+    channels : {array_like},optional
+        Indices of the channels to include (all by default).
+    start : {int},optional
+        First sample of the view.
+    stop : {int},optional
+        Sample after the last one in the view (defaults to nsamples).
+    step : {int},optional
+        Sample step applied when loading.
+
+    Examples
+    --------
+    >>> lts = wrapper.get_all_data(lazy=True)
+    >>> dat = lts[:4].select(time=(lts['time'] >= 10) & (lts['time'] < 20))
+    >>> dat = dat.load()
+    """
+    tdim = 'time'
+    dim_names = ['channels', 'time']
+    ndim = 2
+
+    def __init__(self, wrapper, channels=None, start=0, stop=None, step=1):
+        self.wrapper = wrapper
+        if channels is None:
+            channels = np.arange(wrapper.nchannels)
+        self._channels = np.atleast_1d(channels)
+        self._start = int(start)
+        self._stop = wrapper.nsamples if stop is None else int(stop)
+        self._step = int(step)
+        if self._step < 1:
+            raise ValueError('The sample step must be positive.')
+        if self._start < 0 or self._stop > wrapper.nsamples or \
+                self._start > self._stop:
+            raise ValueError('Invalid sample range: ' +
+                             str((self._start, self._stop)))
+
+    samplerate = property(lambda self:
+                          float(self.wrapper.samplerate) / self._step)
+    shape = property(lambda self:
+                     (len(self._channels),
+                      len(range(self._start, self._stop, self._step))))
+    taxis = property(lambda self: 1)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return ('LazyTimeSeries(' + self.wrapper.__class__.__name__ +
+                ', shape=' + str(self.shape) + ')')
+
+    def _get_time(self):
+        samplesize = 1. / self.wrapper.samplerate
+        return np.arange(self._start, self._stop, self._step) * samplesize
+
+    def _get_dims(self):
+        return [Dim(self.wrapper.channels[self._channels], 'channels'),
+                Dim(self._get_time(), 'time')]
+
+    dims = property(_get_dims)
+
+    def _new(self, channels, start, stop, step):
+        return LazyTimeSeries(self.wrapper, channels, start, stop, step)
+
+    def __getitem__(self, index):
+        """
+        Channel and time indices narrow the view (time must be an
+        int or a slice), whereas a dimension name returns the values
+        of that dimension.
+        """
+        if isinstance(index, str):
+            if index == 'channels':
+                return self.wrapper.channels[self._channels]
+            elif index == 'time':
+                return self._get_time()
+            raise KeyError(index)
+        if not isinstance(index, tuple):
+            index = (index,)
+        if len(index) > 2:
+            raise IndexError('Too many indices for a [channels, time] view.')
+        channels = self._channels
+        start, stop, step = self._start, self._stop, self._step
+        if len(index) > 0:
+            channels = np.atleast_1d(channels[index[0]])
+        if len(index) > 1:
+            tind = index[1]
+            if isinstance(tind, slice):
+                rng = range(start, stop, step)[tind]
+                if rng.step < 0 and len(rng) > 1:
+                    raise IndexError('Negative time steps are not supported.')
+                start, step = rng.start, rng.step
+                stop = rng.start + len(rng) * rng.step
+            else:
+                start = range(start, stop, step)[int(tind)]
+                stop = start + 1
+        return self._new(channels, start, min(stop, self._stop), step)
+
+    def select(self, *args, **kwargs):
+        """
+        Returns a narrowed view filtered with the select conditions,
+        which are specified just like for DimArray.select.  The
+        selected time points must be contiguous.
+        """
+        ind = {'channels': np.ones(len(self._channels), dtype=bool),
+               'time': np.ones(self.shape[1], dtype=bool)}
+        for arg in args:
+            if not isinstance(arg, str):
+                raise TypeError('All args must be strings, ' +
+                                'but you passed: ' + str(type(arg)))
+            found_dim = False
+            for k in self.dim_names:
+                if re.search(r'\b' + k + r'\b', arg) is not None:
+                    found_dim = True
+                    filterStr = re.sub(r'\b' + k + r'\b',
+                                       'np.asarray(self["' + k + '"])', arg)
+                    ind[k] = ind[k] & eval(filterStr)
+                    break
+            if not found_dim:
+                raise ValueError("The provided filter string did not specify " +
+                                 "any valid dimensions: " + str(arg))
+        for key, value in kwargs.items():
+            if key in ind:
+                ind[key] = ind[key] & np.asarray(value)
+
+        # turn the time selection into a sample range
+        tind = np.nonzero(ind['time'])[0]
+        if len(tind) == 0:
+            start = stop = 0
+        else:
+            if np.any(np.diff(tind) != 1):
+                raise ValueError('The selected time points must be ' +
+                                 'contiguous.')
+            start, stop = tind[0], tind[-1] + 1
+        return self[ind['channels'], start:stop]
+
+    def load(self, dtype=None):
+        """
+        Read the data of the view and return them as a TimeSeries.
+        """
+        n = self._stop - self._start
+        data = self.wrapper._load_data(self._channels, [self._start], n, 0,
+                                       dtype=dtype)[:, 0, ::self._step]
+        return TimeSeries(data, 'time', self.samplerate, dims=self.dims)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.load(), dtype=dtype)
+
+    def iter_chunks(self, chunk_samples, dtype=None):
+        """
+        Generate consecutive TimeSeries of at most chunk_samples
+        (loaded) samples that together cover the view, so the data can
+        be processed without reading all of it at once.
+        """
+        chunk_samples = int(chunk_samples)
+        for i in range(0, self.shape[1], chunk_samples):
+            yield self[:, i:i + chunk_samples].load(dtype=dtype)
@@ -8,12 +8,11 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 # local imports
-from .basewrapper import BaseWrapper
+from .basewrapper import BaseWrapper, _file_identity
+from ptsa.helper import sliding_windows
 
 # global imports
 import numpy as np
-import string
-import struct
 import os
 from glob import glob
 
@@ -47,16 +46,16 @@ class RawBinWrapper(BaseWrapper):
         if 'gain' in self._params:
             self._gain = self._params['gain']
 
-        # set the nBytes and format str
+        # set the nBytes and (little endian) dtype
         if self._format == 'single':
             self._nbytes = 4
-            self._fmt_str = 'f'
+            self._dtype = np.dtype('<f4')
         elif self._format == 'short' or self._format == 'int16':
             self._nbytes = 2
-            self._fmt_str = 'h'
+            self._dtype = np.dtype('<i2')
         elif self._format == 'double':
             self._nbytes = 8
-            self._fmt_str = 'd'
+            self._dtype = np.dtype('<f8')
 
         self._chanfiles = glob(self._dataroot + '.*[0-9]')
         # sorting because the order of the output from glob is
@@ -95,7 +94,8 @@ class RawBinWrapper(BaseWrapper):
                 raise ValueError(
                     'File length does not correspond to data format!')
             else:
-                self._nsamples = chanfile.tell() / self._nbytes
+                self._nsamples = chanfile.tell() // self._nbytes
+            chanfile.close()
         return self._nsamples
 
     def _get_nchannels(self):
@@ -106,6 +106,10 @@ class RawBinWrapper(BaseWrapper):
     def _get_channel_info(self):
         return self._channel_info
 
+    def _get_identity(self):
+        return ('RawBinWrapper', _file_identity(self._chanfiles),
+                self._dtype.str, self._gain, self._samplerate)
+
     def _get_annotations(self):
         # no annotations for raw data
         annot = None
@@ -131,7 +135,7 @@ class RawBinWrapper(BaseWrapper):
             # get the columns by splitting
             cols = line.strip().split()
             # set the params
-            params[cols[0]] = eval(string.join(cols[1:]))
+            params[cols[0]] = eval(' '.join(cols[1:]))
         if ('samplerate' not in params) or ('gain' not in params):
             raise ValueError(
                 'Params file must contain samplerate and gain!\n' +
@@ -139,54 +143,47 @@ class RawBinWrapper(BaseWrapper):
         # return the params dict
         return params
 
-    def _load_data(self, channels, event_offsets, dur_samp, offset_samp):
+    def _load_data(self, channels, event_offsets, dur_samp, offset_samp,
+                   out=None, dtype=None):
         """
         """
 
         # allocate for data
-        eventdata = np.empty((len(channels), len(event_offsets), dur_samp),
-                             dtype=np.float) * np.nan
+        if dtype is None:
+            dtype = np.float64
+        eventdata = self._prepare_out(
+            out, (len(channels), len(event_offsets), dur_samp), dtype)
 
         # loop over channels
+        event_offsets = np.asarray(event_offsets)
         for c, channel in enumerate(channels):
             # determine the file
             eegfname = self._dataroot + '.' + \
                 self._channel_info['name'][channel]
             # eegfname = '{}.{:0>3}'.format(self._dataroot,channel)
-            if os.path.isfile(eegfname):
-                efile = open(eegfname, 'rb')
-            else:
+            if not os.path.isfile(eegfname):
                 raise IOError(
                     'EEG file not found: ' + eegfname)
                 # 'EEG file not found for channel {:0>3} '.format(channel) +
                 # 'and file root {}\n'.format(self._dataroot))
 
-            # loop over events
-            for e, ev_offset in enumerate(event_offsets):
-                # seek to the position in the file
-                thetime = offset_samp + ev_offset
-                efile.seek(self._nbytes * thetime, 0)
-
-                # read the data
-                data = efile.read(int(self._nbytes * dur_samp))
-
-                # convert from string to array based on the format
-                # hard codes little endian
-                data = np.array(struct.unpack(
-                    '<' + str(len(data) / self._nbytes) +
-                    self._fmt_str, data))
+            # memmap the file (hard codes little endian)
+            mm = np.memmap(eegfname, dtype=self._dtype, mode='r')
 
-                # make sure we got some data
-                if len(data) < dur_samp:
-                    raise IOError(
-                        'Event with offset ' + str(ev_offset) +
-                        ' is outside the bounds of file ' + str(eegfname))
-
-                # append it to the events
-                eventdata[c, e, :] = data
-
-        # multiply by the gain
-        eventdata *= self._gain
+            # make sure every event is within the file
+            ssamps = event_offsets + offset_samp
+            bad_evs = (ssamps < 0) | (ssamps + dur_samp > len(mm))
+            if np.any(bad_evs):
+                raise IOError(
+                    'Event with offset ' +
+                    str(event_offsets[np.nonzero(bad_evs)[0][0]]) +
+                    ' is outside the bounds of file ' + str(eegfname))
+
+            # gather all the events at once from a strided view of
+            # the file and apply the gain as we copy it into place
+            np.multiply(sliding_windows(mm, dur_samp)[ssamps], self._gain,
+                        out=eventdata[c], casting='unsafe')
+            del mm
 
         return eventdata
 
@@ -394,3 +394,33 @@ class test_Events(TestCase):
         ed3 = events.get_data(3, .5, .1, .25)
 
         assert_array_almost_equal(ed[:], ed3[:], decimal=6)
+
+    def test_get_data_sources(self):
+        # interleave events from two sources
+        aw2 = ArrayWrapper(np.random.rand(10, 1000), 200)
+        srcs = [self.aw, aw2, self.aw, aw2]
+        eoffsets = [80, 140, 270, 500]
+        events = np.rec.fromarrays((srcs, eoffsets),
+                                   names='esrc,eoffset').view(Events)
+        for workers in [0, 2]:
+            ed = events.get_data([2, 3], -.1, .4, eoffset_in_time=False,
+                                 num_src_workers=workers)
+            # events stay in their original order
+            assert_array_equal(np.asarray(ed.dims[1]['eoffset']), eoffsets)
+            for e, (src, o) in enumerate(zip(srcs, eoffsets)):
+                ed2 = src.get_event_data([2, 3], [o], -.1, .4,
+                                         eoffset_in_time=False)
+                assert_array_equal(np.asarray(ed)[:, e],
+                                   np.asarray(ed2)[:, 0])
+
+        # the output dtype holds the data of all sources
+        aw3 = ArrayWrapper(np.float32(np.random.rand(10, 1000)), 200)
+        events = np.rec.fromarrays(([aw3, self.aw, aw3], eoffsets[:3]),
+                                   names='esrc,eoffset').view(Events)
+        for workers in [0, 1, 2]:
+            ed = events.get_data([2, 3], -.1, .4, eoffset_in_time=False,
+                                 num_src_workers=workers)
+            self.assertEqual(ed.dtype, np.float64)
+            ed2 = aw3.get_event_data([2, 3], [eoffsets[2]], -.1, .4,
+                                     eoffset_in_time=False)
+            assert_array_equal(np.asarray(ed)[:, 2], np.asarray(ed2)[:, 0])
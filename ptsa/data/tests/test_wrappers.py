@@ -0,0 +1,442 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal,\
+    assert_array_almost_equal
+
+from ptsa.data.rawbinwrapper import RawBinWrapper
+from ptsa.data.hdf5wrapper import HDF5Wrapper
+from ptsa.data import ArrayWrapper, EpochCache
+from ptsa.data.bvwrapper import BVWrapper
+from ptsa.filt import buttfilt
+try:
+    from ptsa.data.edfwrapper import EdfWrapper
+    from ptsa.data.edf import read_event_samples
+except ImportError:
+    # the EDF extension has not been built
+    EdfWrapper = None
+
+
+class test_RawBinWrapper(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dataroot = os.path.join(self.tmpdir, 'subj')
+        self.gain = .5
+        self.dat = np.int16(np.random.randint(-1000, 1000, (4, 1000)))
+        for c in range(self.dat.shape[0]):
+            self.dat[c].astype('<i2').tofile(self.dataroot + '.%03d' % (c + 1))
+        f = open(self.dataroot + '.params', 'w')
+        f.write('samplerate 200\ndataformat \'int16\'\ngain %f\n' % self.gain)
+        f.close()
+        self.rw = RawBinWrapper(self.dataroot)
+        self.eoffsets = [80, 140, 270]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_data(self):
+        ed = self.rw._load_data(np.array([0, 2]), self.eoffsets, 101, -20)
+        ed2 = np.array([[self.dat[c, o - 20:o + 81] for o in self.eoffsets]
+                        for c in [0, 2]]) * self.gain
+        assert_array_almost_equal(ed, ed2)
+        self.assertEqual(self.rw.nsamples, self.dat.shape[1])
+
+    def test_out_of_bounds(self):
+        self.assertRaises(IOError, self.rw._load_data,
+                          np.array([0]), [950], 101, 0)
+
+    def test_threaded_load(self):
+        ed = self.rw.get_event_data(None, self.eoffsets, -.1, .4,
+                                    eoffset_in_time=False)
+        ed_mt = self.rw.get_event_data(None, self.eoffsets, -.1, .4,
+                                       eoffset_in_time=False,
+                                       n_io_threads=3)
+        assert_array_equal(ed, ed_mt)
+        self.assertEqual(ed.dtype, ed_mt.dtype)
+
+    def test_out_dtype(self):
+        ed = self.rw.get_event_data(None, self.eoffsets, -.1, .4,
+                                    eoffset_in_time=False)
+        out = np.empty(ed.shape, dtype=np.float32)
+        ed32 = self.rw.get_event_data(None, self.eoffsets, -.1, .4,
+                                      eoffset_in_time=False, out=out,
+                                      n_io_threads=2)
+        self.assertEqual(ed32.dtype, np.float32)
+        assert_array_almost_equal(out, ed)
+        ed32 = self.rw.get_event_data(None, self.eoffsets, -.1, .4,
+                                      eoffset_in_time=False,
+                                      dtype=np.float32)
+        assert_array_equal(ed32, out)
+        self.assertRaises(ValueError, self.rw.get_event_data, None,
+                          self.eoffsets, -.1, .4, eoffset_in_time=False,
+                          out=out[:, :2])
+
+    def test_cache(self):
+        cache = EpochCache(os.path.join(self.tmpdir, 'cache'))
+        kwargs = dict(eoffset_in_time=False, buffer_time=.1, cache=cache)
+        ed = self.rw.get_event_data(None, self.eoffsets, -.1, .4, **kwargs)
+        # memory hit (a copy, so changing it leaves the cache intact)
+        ed2 = self.rw.get_event_data(None, self.eoffsets, -.1, .4, **kwargs)
+        assert_array_equal(ed, ed2)
+        assert_array_equal(np.asarray(ed['time']), np.asarray(ed2['time']))
+        ed2[:] = 0
+        assert_array_equal(
+            self.rw.get_event_data(None, self.eoffsets, -.1, .4, **kwargs),
+            ed)
+
+        # disk hit from a new cache comes back memory mapped
+        kwargs['cache'] = EpochCache(cache.cachedir)
+        ed3 = self.rw.get_event_data(None, self.eoffsets, -.1, .4, **kwargs)
+        base = ed3
+        while base.base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        self.assertTrue(isinstance(base, np.memmap))
+        assert_array_equal(ed, ed3)
+        self.assertEqual(ed3.samplerate, ed.samplerate)
+        # and is kept in memory for the next hit
+        self.assertEqual(len(kwargs['cache']._memory), 1)
+        ed3 = self.rw.get_event_data(None, self.eoffsets, -.1, .4, **kwargs)
+        self.assertFalse(isinstance(ed3.base, np.memmap))
+        assert_array_equal(ed, ed3)
+
+        # other parameters and changed files miss
+        ed4 = self.rw.get_event_data(None, self.eoffsets, -.1, .3, **kwargs)
+        self.assertEqual(ed4.shape[-1], ed.shape[-1] - 20)
+        os.utime(self.dataroot + '.001', (0, 0))
+        self.assertEqual(len(os.listdir(cache.cachedir)), 4)
+        self.rw.get_event_data(None, self.eoffsets, -.1, .4, **kwargs)
+        self.assertEqual(len(os.listdir(cache.cachedir)), 6)
+
+        # LRU eviction down to the size limits
+        cache = EpochCache(cache.cachedir, max_memory_bytes=ed.nbytes,
+                           max_disk_bytes=2 * ed.nbytes)
+        for i in range(3):
+            cache.put(str(i), ed, {})
+        self.assertEqual(list(cache._memory.keys()), ['2'])
+        self.assertEqual(len([f for f in os.listdir(cache.cachedir)
+                              if f.endswith('.npy')]), 1)
+        cache.clear()
+        self.assertEqual(os.listdir(cache.cachedir), [])
+
+
+class test_HDF5Wrapper(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'data.hdf5')
+        self.dat = np.random.rand(4, 1000)
+        self.hw = HDF5Wrapper(self.filepath, data=self.dat, samplerate=200)
+        self.eoffsets = [80, 140, 270]
+
+    def tearDown(self):
+        self.hw.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_data(self):
+        ed = self.hw._load_data(np.array([0, 2]), self.eoffsets, 101, -20)
+        ed2 = np.array([[self.dat[c, o - 20:o + 81] for o in self.eoffsets]
+                        for c in [0, 2]])
+        assert_array_equal(ed, ed2)
+        self.assertRaises(IOError, self.hw._load_data,
+                          np.array([0]), [950], 101, 0)
+
+    def test_handles(self):
+        # the same handle and dataset are reused across calls
+        d = self.hw._get_dataset()
+        self.assertEqual(self.hw.samplerate, 200)
+        self.assertEqual(self.hw.nsamples, self.dat.shape[1])
+        self.assertTrue(self.hw._get_dataset() is d)
+
+        # closing releases the file and reopens on demand
+        self.hw.close()
+        self.assertFalse(d.id.valid)
+        with HDF5Wrapper(self.filepath) as hw:
+            assert_array_equal(hw._load_data(np.arange(4), [0], 1000, 0),
+                               self.dat[:, np.newaxis, :])
+            d = hw._get_dataset()
+        self.assertFalse(d.id.valid)
+
+        # a different chunk cache size reopens the pooled handle
+        f = self.hw._get_file()
+        hw = HDF5Wrapper(self.filepath, rdcc_nbytes=4 * 1024**2)
+        self.assertFalse(f.id.valid)
+        self.assertEqual(hw._get_file().id.get_access_plist().get_cache()[2],
+                         4 * 1024**2)
+        self.assertTrue(self.hw._get_file() is hw._get_file())
+
+    def test_write_handles(self):
+        # only read handles stay open after writing, so other processes
+        # can open the file (HDF5 locks files open for writing)
+        filepath = os.path.join(self.tmpdir, 'append.hdf5')
+        hw = HDF5Wrapper(filepath, data=self.dat, samplerate=200,
+                         maxshape=(4, None))
+        hw2 = HDF5Wrapper(filepath)
+        self.assertEqual(hw2.nsamples, 1000)
+        hw.append_data(self.dat[:, :10])
+        self.assertEqual(hw.nsamples, 1010)
+        self.assertEqual(hw2.nsamples, 1010)
+        self.assertFalse(any([k[1] == 'a' for k in
+                              HDF5Wrapper._handle_pool._handles]))
+        subprocess.check_call([sys.executable, '-c',
+                               'import h5py; h5py.File(%r, "r").close()' %
+                               filepath])
+
+        # a forked child starts with an empty pool
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(w, str(len(HDF5Wrapper._handle_pool._handles)).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(r, 16), b'0')
+        os.close(r)
+        os.close(w)
+
+    def test_pickle(self):
+        # the open dataset is dropped and looked up again
+        self.hw._get_dataset()
+        hw = pickle.loads(pickle.dumps(self.hw))
+        self.assertTrue(hw._dset is None)
+        assert_array_equal(hw._load_data(np.array([1]), self.eoffsets, 10, 0),
+                           self.hw._load_data(np.array([1]), self.eoffsets,
+                                              10, 0))
+
+    def test_chunked_load(self):
+        filepath = os.path.join(self.tmpdir, 'chunked.hdf5')
+        hw = HDF5Wrapper(filepath, data=self.dat, samplerate=200,
+                         chunks=(2, 64), compression='gzip',
+                         rdcc_nbytes=4 * 1024**2)
+        # unsorted, overlapping and far apart events
+        eoffsets = [700, 30, 35, 400, 130, 900, 35]
+        channels = np.array([3, 0, 1])
+        ed = hw._load_data(channels, eoffsets, 50, -10)
+        ed2 = np.array([[self.dat[c, o - 10:o + 40] for o in eoffsets]
+                        for c in channels])
+        assert_array_equal(ed, ed2)
+
+        # force more, smaller reads
+        hw._max_read_bytes = 1
+        assert_array_equal(hw._load_data(channels, eoffsets, 50, -10), ed2)
+        hw.close()
+
+    def test_from_wrapper(self):
+        aw = ArrayWrapper(self.dat, 200)
+        # stream in blocks that don't divide the recording evenly
+        hw = HDF5Wrapper.from_wrapper(aw, os.path.join(self.tmpdir, 'f.hdf5'),
+                                      chunk_samples=300)
+        self.assertEqual(hw.nsamples, self.dat.shape[1])
+        self.assertEqual(hw.samplerate, 200)
+        assert_array_equal(hw._load_data(np.arange(4), [0], 1000, 0)[:, 0],
+                           self.dat)
+        assert_array_equal(hw.channel_info['number'], np.arange(1, 5))
+        hw.close()
+
+        # convert to int16, with the gain from a first pass
+        hw = HDF5Wrapper.from_wrapper(aw, os.path.join(self.tmpdir, 'i.hdf5'),
+                                      chunk_samples=300, file_dtype=np.int16,
+                                      compression='gzip')
+        self.assertEqual(hw.file_dtype, np.int16)
+        assert_array_almost_equal(
+            hw._load_data(np.arange(4), [0], 1000, 0)[:, 0], self.dat,
+            decimal=4)
+        hw.close()
+
+        # high-pass filter a subset of channels on the way
+        hw = HDF5Wrapper.from_wrapper(aw, os.path.join(self.tmpdir, 'h.hdf5'),
+                                      chunk_samples=300, channels=[1, 3],
+                                      filt_freq=[1.], filt_type='high')
+        assert_array_almost_equal(
+            hw._load_data(np.arange(2), [0], 1000, 0)[:, 0],
+            buttfilt(self.dat[[1, 3]], [1.], 200, 'high', 4), decimal=10)
+        hw.close()
+        self.assertRaises(ValueError, HDF5Wrapper.from_wrapper, aw,
+                          os.path.join(self.tmpdir, 'x.hdf5'),
+                          file_dtype=np.int16, filt_freq=[1.],
+                          filt_type='high')
+
+
+class test_ArrayWrapper(TestCase):
+    def setUp(self):
+        self.dat = np.random.rand(4, 1000)
+        self.aw = ArrayWrapper(self.dat, 200)
+
+    def test_load_data(self):
+        eoffsets = np.random.randint(20, 900, 500)
+        channels = np.array([1, 3])
+        ed2 = np.array([[self.dat[c, o - 20:o + 60] for o in eoffsets]
+                        for c in channels])
+        assert_array_equal(self.aw._load_data(channels, eoffsets, 80, -20),
+                           ed2)
+        assert_array_equal(self.aw._load_data(channels, eoffsets, 80, -20,
+                                              dtype=np.float32),
+                           ed2.astype(np.float32))
+        self.assertRaises(IOError, self.aw._load_data,
+                          channels, [10, 990], 80, -20)
+
+    def test_lazy_all_data(self):
+        lts = self.aw.get_all_data(lazy=True)
+        self.assertEqual(lts.shape, self.dat.shape)
+        dat = self.aw.get_all_data()
+        ts = lts.load()
+        assert_array_equal(ts, dat)
+        assert_array_almost_equal(np.asarray(ts['time']),
+                                  np.asarray(dat['time']))
+        assert_array_equal(np.asarray(lts), self.dat)
+
+        # narrowing the view only reads the selection
+        sub = lts[[1, 3], 100:300:2][:, 10:]
+        self.assertEqual(sub.shape, (2, 90))
+        self.assertEqual(sub.samplerate, 100)
+        assert_array_equal(sub.load(), self.dat[[1, 3], 120:300:2])
+        sub = lts.select("time>=1", "time<1.5",
+                         channels=[True, False, True, False])
+        assert_array_equal(sub.load(), self.dat[[0, 2], 200:300])
+        assert_array_equal(np.asarray(sub['channels']['number']), [1, 3])
+        self.assertRaises(ValueError, lts.select,
+                          time=(lts['time'] < 1) | (lts['time'] > 2))
+
+        # streaming in chunks covers the data
+        chunks = list(lts[:, 5:].iter_chunks(300))
+        self.assertEqual([c.shape[1] for c in chunks], [300, 300, 300, 95])
+        assert_array_equal(np.concatenate(chunks, axis=1), self.dat[:, 5:])
+
+
+class test_BVWrapper(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dat = np.int16(np.random.randint(-1000, 1000, (1000, 3)))
+        self.scales = np.array([.5, 1., .1])
+        self.dat.astype('<i2').tofile(os.path.join(self.tmpdir, 'test.eeg'))
+        hdr = ('Brain Vision Data Exchange Header File Version 1.0\n' +
+               '[Common Infos]\nDataFile=test.eeg\nMarkerFile=test.vmrk\n' +
+               'DataFormat=BINARY\nDataOrientation=MULTIPLEXED\n' +
+               'NumberOfChannels=3\nSamplingInterval=5000\n' +
+               '[Binary Infos]\nBinaryFormat=INT_16\n[Channel Infos]\n' +
+               ''.join(['Ch%d=E%d,,%g,uV\n' % (i + 1, i + 1, sc)
+                        for i, sc in enumerate(self.scales)]) +
+               '[Comment]\n')
+        self.filepath = os.path.join(self.tmpdir, 'test.vhdr')
+        f = open(self.filepath, 'w')
+        f.write(hdr)
+        f.close()
+        self.bw = BVWrapper(self.filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_data(self):
+        eoffsets = [30, 500, 120]
+        channels = np.array([0, 2])
+        ed = self.bw._load_data(channels, eoffsets, 50, -10)
+        ed2 = np.array([[self.dat[o - 10:o + 40, c] * self.scales[c]
+                         for o in eoffsets] for c in channels])
+        assert_array_almost_equal(ed, ed2)
+        self.assertEqual(self.bw.nsamples, 1000)
+        self.assertRaises(IOError, self.bw._load_data,
+                          channels, [980], 50, -10)
+
+
+def _write_edf(filepath, dat, samplerate):
+    """
+    Write int16 [channels, samples] data to a minimal EDF file with
+    1 s data records and identical digital and physical ranges.
+    """
+    nchans = dat.shape[0]
+    nrecords = dat.shape[1] // samplerate
+
+    def field(val, width):
+        return str(val).ljust(width)[:width]
+    hdr = (field(0, 8) + field('X X X X', 80) +
+           field('Startdate 01-JAN-2000 X X X', 80) +
+           '01.01.00' + '00.00.00' + field(256 * (nchans + 1), 8) +
+           field('', 44) + field(nrecords, 8) + field(1, 8) +
+           field(nchans, 4))
+    for width, vals in [(16, ['E%d' % (c + 1) for c in range(nchans)]),
+                        (80, [''] * nchans), (8, ['uV'] * nchans),
+                        (8, [-32768] * nchans), (8, [32767] * nchans),
+                        (8, [-32768] * nchans), (8, [32767] * nchans),
+                        (80, [''] * nchans), (8, [samplerate] * nchans),
+                        (32, [''] * nchans)]:
+        hdr += ''.join([field(v, width) for v in vals])
+    records = dat[:, :nrecords * samplerate].reshape(
+        nchans, nrecords, samplerate).transpose(1, 0, 2)
+    f = open(filepath, 'wb')
+    f.write(hdr.encode('ascii'))
+    f.write(records.astype('<i2').tobytes())
+    f.close()
+
+
+@unittest.skipIf(EdfWrapper is None, 'EDF extension not built')
+class test_EdfWrapper(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'test.edf')
+        self.dat = np.int16(np.random.randint(-1000, 1000, (3, 1000)))
+        _write_edf(self.filepath, self.dat, 200)
+        self.ew = EdfWrapper(self.filepath)
+        self.eoffsets = [30, 500, 120]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_data(self):
+        self.assertEqual(self.ew.nchannels, 3)
+        self.assertEqual(self.ew.samplerate, 200)
+        self.assertEqual(self.ew.nsamples, 1000)
+        channels = np.array([0, 2])
+        ed = self.ew._load_data(channels, self.eoffsets, 50, -10)
+        ed2 = np.array([[self.dat[c, o - 10:o + 40] for o in self.eoffsets]
+                        for c in channels])
+        assert_array_equal(ed, ed2)
+        self.assertRaises(IOError, self.ew._load_data,
+                          channels, [980], 50, -10)
+        self.assertRaises(IOError, self.ew._load_data,
+                          channels, [5], 50, -10)
+        # the error reports the event offset (not the shifted one)
+        with self.assertRaises(IOError) as cm:
+            self.ew._load_data(channels, [30, 980], 50, -10)
+        self.assertTrue('offset 980 ' in str(cm.exception))
+        self.assertRaises(ValueError, self.ew._load_data,
+                          np.array([0, 3]), self.eoffsets, 50, -10)
+        self.assertRaises(IOError, read_event_samples,
+                          os.path.join(self.tmpdir, 'missing.edf'),
+                          [0], [0], 10)
+
+    def test_threaded_load(self):
+        # reads of the file are serialized, so the pool is skipped
+        ed = self.ew.get_event_data(None, self.eoffsets, -.05, .2,
+                                    eoffset_in_time=False)
+        ed_mt = self.ew.get_event_data(None, self.eoffsets, -.05, .2,
+                                       eoffset_in_time=False,
+                                       n_io_threads=3)
+        assert_array_equal(ed, ed_mt)
+
+    def test_out_dtype(self):
+        ed = self.ew.get_event_data(None, self.eoffsets, -.05, .2,
+                                    eoffset_in_time=False)
+        # float64 buffers are filled by the extension directly
+        out = np.empty(ed.shape)
+        ed64 = self.ew.get_event_data(None, self.eoffsets, -.05, .2,
+                                      eoffset_in_time=False, out=out,
+                                      n_io_threads=2)
+        self.assertTrue(np.shares_memory(ed64, out))
+        assert_array_equal(out, ed)
+        ed32 = self.ew.get_event_data(None, self.eoffsets, -.05, .2,
+                                      eoffset_in_time=False,
+                                      dtype=np.float32)
+        self.assertEqual(ed32.dtype, np.float32)
+        assert_array_equal(ed32, ed)
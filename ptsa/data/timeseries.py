@@ -181,7 +181,7 @@ class TimeSeries(DimArray):
         return (self.take(list(range(int(num_samp[0]),
                                      self.shape[self.taxis] - int(num_samp[1]))), self.taxis))
 
-    def filtered(self, freq_range, filt_type='stop', order=4):
+    def filtered(self, freq_range, filt_type='stop', order=4, use_sos=False):
         """
         Filter the data using a Butterworth filter and return a new
         TimeSeries instance.
@@ -194,6 +194,9 @@ class TimeSeries(DimArray):
             Filter type.
         order = {int}
             The order of the filter.
+        use_sos = {bool},optional
+            Design and apply the filter as second-order sections,
+            which is stable for high orders and narrow bands.
 
         Returns
         -------
@@ -203,7 +206,8 @@ class TimeSeries(DimArray):
 
         filtered_array = filt.buttfilt(np.asarray(self),
                                        freq_range, self.samplerate, filt_type,
-                                       order, axis=self.taxis)
+                                       order, axis=self.taxis,
+                                       use_sos=use_sos)
         attrs = self._attrs.copy()
         for k in list(self._required_attrs.keys()):
             attrs.pop(k, None)
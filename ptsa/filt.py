@@ -8,48 +8,192 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 from scipy.signal import butter, cheby1, firwin, lfilter
+from scipy.signal import sosfilt, sosfilt_zi, sosfiltfilt
 from numpy import asarray, vstack, hstack, eye, ones, zeros, linalg, newaxis, r_, flipud, convolve, matrix, array, concatenate
 import numpy as np
 from scipy.special import sinc
+from functools import lru_cache
 
 
 from .helper import reshape_to_2d, reshape_from_2d, repeat_to_match_dims
 
 from .filtfilt import filtfilt as filtfilt_future
+from .filtfilt import lfilter_zi as lfilter_zi_future
 
 import pdb
 
 
-def buttfilt(dat, freq_range, sample_rate, filt_type, order, axis=-1):
+@lru_cache(maxsize=128)
+def _butter_design(order, freq_range, sample_rate, filt_type, use_sos):
+    # cached Butterworth design
+    wn = asarray(freq_range) / (sample_rate / 2.)
+    if use_sos:
+        return (butter(order, wn, filt_type, output='sos'),)
+    return tuple(butter(order, wn, filt_type))
+
+
+def butter_design(order, freq_range, sample_rate, filt_type, use_sos=False):
+    """Design a Butterworth filter, reusing earlier designs.
+
+    Designs are cached per (order, band, samplerate, type, form), so
+    filtering many events or sessions with the same settings only
+    designs the filter once.
+
+    Parameters
+    ----------
+    order : {int}
+        The order of the filter.
+    freq_range : {array_like}
+        The band edges (or cutoff) in Hz.
+    sample_rate : {float}
+        Sample rate of the data.
+    filt_type : {scipy.signal.band_dict.keys()}
+        Filter type.
+    use_sos : {bool},optional
+        Return second-order sections instead of [b, a].
+
+    Returns
+    -------
+    (b, a) or (sos,), copied from the cache.
+    """
+    freq_range = tuple(float(f) for f in np.atleast_1d(freq_range))
+    return tuple(c.copy() for c in
+                 _butter_design(int(order), freq_range, float(sample_rate),
+                                filt_type, bool(use_sos)))
+
+
+def buttfilt(dat, freq_range, sample_rate, filt_type, order, axis=-1,
+             use_sos=False):
     """Wrapper for a Butterworth filter.
 
+    With use_sos the filter is designed and applied as second-order
+    sections (sosfiltfilt), which stays numerically stable for high
+    orders and narrow bands (e.g., line noise notches at high sample
+    rates) where the transfer-function form does not.
+
     """
 
     # make sure dat is an array
     dat = asarray(dat)
 
-    # reshape the data to 2D with time on the 2nd dimension
-    #origshape = dat.shape
-    #dat = reshape_to_2d(dat,axis)
+    # generate the (cached) butterworth filter coefficients
+    coefs = butter_design(order, freq_range, sample_rate, filt_type,
+                          use_sos=use_sos)
 
-    # set up the filter
-    freq_range = asarray(freq_range)
+    if use_sos:
+        dat = sosfiltfilt(coefs[0], dat, axis=axis)
+    else:
+        [b, a] = coefs
+        dat = filtfilt_future(b, a, dat, axis=axis)
 
-    # Nyquist frequency
-    nyq = sample_rate / 2.
+    return dat
 
-    # generate the butterworth filter coefficients
-    [b, a] = butter(order, freq_range / nyq, filt_type)
 
-    # loop over final dimension
-    # for i in xrange(dat.shape[0]):
-    #    dat[i] = filtfilt(b,a,dat[i])
-    #dat = filtfilt2(b,a,dat,axis=axis)
-    dat = filtfilt_future(b, a, dat, axis=axis)
+def buttfilt_blocks(x, out, freq_range, sample_rate, filt_type, order,
+                    block_samples=2**16, use_sos=False):
+    """Streaming version of buttfilt for [channels, time] data that
+    don't fit in memory.  See filtfilt_blocks.
 
-    # reshape the data back
-    #dat = reshape_from_2d(dat,axis,origshape)
-    return dat
+    """
+    coefs = butter_design(order, freq_range, sample_rate, filt_type,
+                          use_sos=use_sos)
+    if use_sos:
+        return sosfiltfilt_blocks(coefs[0], x, out,
+                                  block_samples=block_samples)
+    [b, a] = coefs
+    return filtfilt_blocks(b, a, x, out, block_samples=block_samples)
+
+
+def _filtfilt_blocks(filt, zi, x, out, block_samples, padlen):
+    # forward-backward filtering of [channels, time] blocks, where
+    # filt(x, z) returns (y, z) and zi(x0) the initial state for x0
+    nsamples = x.shape[1]
+    if nsamples <= padlen:
+        raise ValueError("The length of the input vector x must be at least "
+                         "padlen, which is %d." % padlen)
+    block_samples = int(block_samples)
+    starts = list(range(0, nsamples, block_samples))
+
+    # make the odd extensions at both ends (before out can overwrite x)
+    head = asarray(x[:, :padlen + 1], dtype=np.float64)
+    tail = asarray(x[:, nsamples - padlen - 1:], dtype=np.float64)
+    left_ext = 2 * head[:, :1] - head[:, padlen:0:-1]
+    right_ext = 2 * tail[:, -1:] - tail[:, -2:-(padlen + 2):-1]
+
+    # forward pass
+    y, z = filt(left_ext, zi(left_ext[:, :1]))
+    for start in starts:
+        stop = min(start + block_samples, nsamples)
+        y, z = filt(asarray(x[:, start:stop], dtype=np.float64), z)
+        out[:, start:stop] = y
+    y, z = filt(right_ext, z)
+
+    # backward pass, starting from the end of the extension
+    y, z = filt(y[:, ::-1], zi(y[:, -1:]))
+    for start in starts[::-1]:
+        stop = min(start + block_samples, nsamples)
+        y, z = filt(asarray(out[:, start:stop])[:, ::-1], z)
+        out[:, start:stop] = y[:, ::-1]
+
+    return out
+
+
+def filtfilt_blocks(b, a, x, out, block_samples=2**16, padlen=None):
+    """Forward-backward filter [channels, time] data block by block.
+
+    The result is the same as filtfilt (with odd padding), but only
+    block_samples samples of all channels are held in memory at a
+    time.  The forward pass carries the filter state (zi) from block
+    to block and writes its output to out, then the backward pass
+    reads the blocks of out in reverse order, carrying its state from
+    the end of the data back to the start, and overwrites them with
+    the final result.
+
+    Parameters
+    ----------
+    b, a : {array_like}
+        The filter coefficients.
+    x : {array_like}
+        2-D array-like with time on the last axis that supports
+        x[:, start:stop] (e.g., an array, np.memmap, h5py dataset, or
+        LazyTimeSeries).
+    out : {array_like}
+        Writable 2-D array-like of the same shape as x (may be x
+        itself).
+    block_samples : {int},optional
+        Number of samples to filter at a time.
+    padlen : {int},optional
+        Length of the odd extension at each end (defaults to
+        3*max(len(a),len(b)) like filtfilt).
+
+    Returns
+    -------
+    out
+    """
+    b = asarray(b)
+    a = asarray(a)
+    if padlen is None:
+        padlen = 3 * max(len(a), len(b))
+    zi = lfilter_zi_future(b, a)[newaxis, :]
+    return _filtfilt_blocks(lambda d, z: lfilter(b, a, d, axis=-1, zi=z),
+                            lambda x0: zi * x0,
+                            x, out, block_samples, padlen)
+
+
+def sosfiltfilt_blocks(sos, x, out, block_samples=2**16, padlen=None):
+    """Block-by-block sosfiltfilt, otherwise just like filtfilt_blocks.
+
+    The default padlen matches sosfiltfilt.
+
+    """
+    sos = asarray(sos)
+    if padlen is None:
+        padlen = 3 * (2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(),
+                                             (sos[:, 5] == 0).sum()))
+    zi = sosfilt_zi(sos)[:, newaxis, :]
+    return _filtfilt_blocks(lambda d, z: sosfilt(sos, d, axis=-1, zi=z),
+                            lambda x0: zi * x0[newaxis],
+                            x, out, block_samples, padlen)
 
 ######
 # Code for decimate modified from http://www.bigbold.com/snippets/posts/show/1209
@@ -26,7 +26,7 @@ def reshape_to_2d(data, axis):
 
     # reshape and transpose the data
     newdata = np.reshape(np.transpose(data, tuple(newdims)),
-                         (np.prod(dshape, axis=0) / n, n))
+                         (np.prod(dshape, axis=0) // n, n))
 
     # make sure we have a copy
     #newdata = newdata.copy()
@@ -186,6 +186,40 @@ def pad_to_next_pow2(x, axis=0):
         return x
 
 
+def sliding_windows(x, window, axis=-1):
+    """
+    Return a read-only strided view of all windows of a given length
+    along an axis.
+
+    Parameters
+    ----------
+    x : {array}
+        Input array (can be a np.memmap).
+    window : {int}
+        Length of each window in samples.
+    axis : {int},optional
+        Axis along which to slide the window.
+
+    Returns
+    -------
+    A view with the window axis appended as the last dimension and
+    x.shape[axis]-window+1 window positions along axis. No data are
+    copied, so indexing window positions (e.g., with an array of
+    event onsets) gathers all windows in a single operation.
+    """
+    x = np.asarray(x)
+    if axis < 0:
+        axis = axis + x.ndim
+    window = int(window)
+    nwin = x.shape[axis] - window + 1
+    if window < 0 or nwin < 0:
+        raise ValueError('Window must not be longer than the array axis.')
+    shape = x.shape[:axis] + (nwin,) + x.shape[axis + 1:] + (window,)
+    strides = x.strides + (x.strides[axis],)
+    return np.lib.stride_tricks.as_strided(x, shape=shape, strides=strides,
+                                           writeable=False)
+
+
 def centered(arr, newsize):
     """
     Return the center newsize portion of the input array.
@@ -211,7 +245,7 @@ def centered(arr, newsize):
     # Do make a copy of arr.shape when creating array:
     currsize = np.array(arr.shape)
     # determine start- & end-indices and slice:
-    startind = (currsize - newsize) / 2
+    startind = (currsize - newsize) // 2
     endind = startind + newsize
     myslice = [slice(startind[k], endind[k]) for k in range(len(endind))]
     return arr[tuple(myslice)]
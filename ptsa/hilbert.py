@@ -9,10 +9,11 @@
 
 import sys
 import numpy as np
-from scipy.signal import hilbert
+from scipy.signal import hilbert, sosfreqz
 
 from ptsa.data.timeseries import TimeSeries, Dim
 from ptsa.helper import next_pow2
+from ptsa.filt import butter_design
 
 freq_bands = [('delta', [2.0, 4.0]),
               ('theta', [4.0, 8.0]),
@@ -22,8 +23,39 @@ freq_bands = [('delta', [2.0, 4.0]),
               ('gamma_2', [44.0, 100.0])]
 
 
-def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True):
+def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True,
+                filter_bank=False, order=4, dtype=None):
     """
+    Calculate the Hilbert envelope (power) of the data in each band.
+
+    Parameters
+    ----------
+    dat_ts : {TimeSeries}
+        The data.
+    bands : {list},optional
+        List of (name, [low, high]) tuples (defaults to freq_bands).
+    pad_to_pow2 : {bool},optional
+        Pad the time axis to the next power of two for the FFTs.
+    verbose : {bool},optional
+        Print the bands as they are processed.
+    filter_bank : {bool},optional
+        Instead of band-pass filtering and Hilbert transforming the
+        data once per band, take a single FFT of the data, apply the
+        zero-phase response of all the band-pass filters together with
+        the analytic-signal mask, and run one batched inverse FFT.
+        The responses are the same as for filtering, but they are
+        applied circularly, so the edges differ from the default (use
+        a buffer as usual).
+    order : {int},optional
+        Order of the Butterworth band-pass filters.
+    dtype : {numpy.dtype},optional
+        Data type of the returned power (e.g., np.float32).
+
+    Returns
+    -------
+    pow : {TimeSeries}
+        The envelope with a new 'freqs' dim (named by the bands)
+        prepended to the dims of the data.
     """
     # set default freq bands
     if bands is None:
@@ -37,6 +69,13 @@ def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True):
     else:
         npts = npts_orig
 
+    if filter_bank:
+        pow = _hilbert_pow_bank(np.asarray(dat_ts), bands, dat_ts.samplerate,
+                                npts, taxis, order, dtype)
+        return TimeSeries(pow, tdim=dat_ts.tdim, samplerate=dat_ts.samplerate,
+                          dims=[Dim([band[0] for band in bands], 'freqs')] +
+                          list(dat_ts.dims.copy()))
+
     # calc the hilbert power
     if verbose:
         sys.stdout.write('Hilbert Bands: ')
@@ -47,7 +86,8 @@ def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True):
             sys.stdout.write('%s ' % band[0])
             sys.stdout.flush()
         p = TimeSeries(np.abs(hilbert(dat_ts.filtered(band[1],
-                                                      filt_type='pass'),
+                                                      filt_type='pass',
+                                                      order=order),
                                       N=npts, axis=taxis).take(np.arange(npts_orig),
                                                                axis=taxis)),
                        tdim=dat_ts.tdim, samplerate=dat_ts.samplerate,
@@ -60,4 +100,41 @@ def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True):
     if verbose:
         sys.stdout.write('\n')
         sys.stdout.flush()
+    if dtype is not None:
+        pow = pow.astype(dtype)
     return pow
+
+
+def _hilbert_pow_bank(dat, bands, samplerate, npts, axis, order, dtype):
+    """
+    Hilbert envelope of dat in all bands from one forward and one
+    batched inverse FFT (see hilbert_pow).
+    """
+    npts_orig = dat.shape[axis]
+    dat = np.moveaxis(dat, axis, -1)
+
+    # analytic-signal mask (as in scipy.signal.hilbert)
+    h = np.zeros(npts)
+    if npts % 2 == 0:
+        h[0] = h[npts // 2] = 1
+        h[1:npts // 2] = 2
+    else:
+        h[0] = 1
+        h[1:(npts + 1) // 2] = 2
+
+    # zero-phase (|H|^2, as with filtfilt) response of each band-pass
+    # filter, combined with the mask
+    w = 2 * np.pi * np.abs(np.fft.fftfreq(npts))
+    resp = np.empty((len(bands), npts))
+    for i, band in enumerate(bands):
+        sos = butter_design(order, band[1], samplerate, 'pass',
+                            use_sos=True)[0]
+        resp[i] = np.abs(sosfreqz(sos, worN=w)[1])**2 * h
+
+    # one forward FFT, all bands back at once
+    X = np.fft.fft(dat, n=npts, axis=-1)
+    resp = resp.reshape((len(bands),) + (1,) * (dat.ndim - 1) + (npts,))
+    pow = np.abs(np.fft.ifft(X[np.newaxis] * resp, axis=-1)[..., :npts_orig])
+    if dtype is not None:
+        pow = pow.astype(dtype)
+    return np.moveaxis(pow, -1, axis + 1)
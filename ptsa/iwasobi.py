@@ -9,7 +9,6 @@
 
 # global imports
 import numpy as np
-from scipy.linalg import toeplitz, hankel
 
 #import pdb
 #from IPython.Debugger import Tracer; debug_here = Tracer()
@@ -76,7 +75,7 @@ class IWASOBI():
             W, Ms = self.wajd(C0, H, W, 5)
 
         # ISR=CRLB4(ARC)/N;
-        ISR = self.CRLB4(ARC) / np.float(N)
+        ISR = self.CRLB4(ARC) / float(N)
 
         # %t1 = [t1 cputime-time_start];
         # signals=W*x+(W*Xmean)*ones(1,N);
@@ -100,89 +99,16 @@ class IWASOBI():
          % DEFAULT PARAMETERS: M=2; phi=randn(2*K-1,M); eps=randn(1,2);
          %   SIZE of phi SHOULD BE (2*K-1,M).
          %   SIZE of eps SHOULD BE (1,M).
+
+        All M matrices are built and inverted at once.
         """
+        # the toeplitz part is phi(|i-j|) and the hankel part phi(i+j)
+        i, j = np.ogrid[:K, :K]
+        A = (phi[np.abs(i - j), :M] + phi[i + j, :M]).transpose(2, 0, 1)
+        A[:, np.arange(K), np.arange(K)] += np.asarray(eps)[:M, np.newaxis]
 
-        # %C=[];
-        C = []
-        # %for im=1:M
-        # %  A=toeplitz(phi(1:K,im),phi(1:K,im)')+hankel(phi(1:K,im),phi(K:2*K-1,im)')+eps(im)*eye(K);
-        # %  C=[C inv(A)];
-        # %end
-        for im in range(M):
-            A = (toeplitz(phi[:K, im], phi[:K, im].T) +
-                 hankel(phi[:K, im], phi[K - 1:2 * K, im].T) +
-                 eps[im] * np.eye(K))
-            C.append(np.linalg.inv(A))
-
-        return np.concatenate(C, axis=1)
-
-        # # phi(2*K,1:M)=0;
-        # phi[2*K-1,:M] = 0
-        # # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-        # # almold=2*phi(1,:)+eps;
-        # almold = 2*phi[0,:]+eps
-        # # C0=1./almold;
-        # C0 = 1/almold
-        # # x1=zeros(K,M); x2=x1; x3=x1; x4=x1;
-        # x1 = np.zeros((K,M))
-        # x2 = np.zeros((K,M))
-        # x3 = np.zeros((K,M))
-        # x4 = np.zeros((K,M))
-        # # x1(1,:)=C0; x2(1,:)=C0;
-        # x1[0,:] = C0
-        # x2[0,:] = C0
-        # # x3(1,:)=-C0.*phi(2,:);
-        # x3[0,:] = -C0*phi[1,:]
-        # # x4(1,:)=-2*C0.*phi(2,:);
-        # x4[0,:] = -2.*C0*phi[1,:]
-        # # x4old=[];
-        # x4old = []
-        # # lalold=2*phi(2,:)./almold;
-        # lalold = 2*phi[1,:]/almold
-        # # for k=1:K-1
-        # for k in xrange(K-1):
-        #     #     f2o=phi(k+1:-1:2,:)+phi(k+1:2*k,:);
-        #     f2o = phi[k+1:0:-1,:] + phi[k+1:2*k+1,:]
-        #     #     alm=sum(f2o.*x4(1:k,:),1)+phi(1,:)+eps+phi(2*k+1,:);
-        #     #     a0=zeros(1,M);
-        #     #     if k<K-1
-        #     #        a0=phi(k+2,:);
-        #     #     end
-        #     #     gam1=sum(f2o.*x1(1:k,:),1);
-        #     #     gam3=sum(f2o.*x3(1:k,:),1)+a0+phi(k,:);
-        #     #     x4(k+1,:)=ones(1,M);
-        #     #     b1m=sum(([phi(2:k+1,:); a0]+[zeros(1,M); phi(1:k,:)]).*x4(1:k+1,:));
-        #     #     b2m=sum(([a0; phi(k+1:-1:2,:)]+phi(k+2:2*k+2,:)).*x4(1:k+1,:));
-        #     #     latemp=b2m./alm;
-        #     #     b2m=latemp-lalold; lalold=latemp;
-        #     #     bom=alm./almold;
-        #     #     ok=ones(k+1,1);
-        #     #     x2(1:k+1,:)=x4(1:k+1,:).*(ok*(1./alm));
-        #     #     x1(1:k+1,:)=[x1(1:k,:); zeros(1,M)]-(ok*gam1).*x2(1:k+1,:);
-        #     #     x3(1:k+1,:)=[x3(1:k,:); zeros(1,M)]-(ok*gam3).*x2(1:k+1,:);
-        #     #     x4temp=x4(1:k,:);
-        #     #     x4(1:k+1,:)=[zeros(1,M); x4(1:k,:)]+[x4(2:k,:); ones(1,M); zeros(1,M)]...
-        #     #        -(ok*bom).*[x4old; ones(1,M); zeros(1,M)]...
-        #     #        -(ok*b2m).*x4(1:k+1,:)-(ok*b1m).*x1(1:k+1,:)-(ok*x4(1,:)).*x3(1:k+1,:);
-        #     #     x4old=x4temp;
-        #     #     almold=alm;
-        # # end  % of for
-        # # MK=M*K;
-        # MK=M*K
-        # # G=zeros(K,MK);
-        # G = np.zeros((K,MK))
-        # # G(:,1:K:MK)=x1; clast=zeros(K,M);
-        # # f1=[phi(2:K,:); zeros(1,M)]+[zeros(1,M); phi(1:K-1,:)];
-        # # f2=[zeros(1,M); phi(K:-1:2,:)]+[phi(K+1:2*K-1,:); zeros(1,M)];
-        # # for k=2:K
-        # #     ck=G(:,k-1:K:MK);
-        # #     G(:,k:K:MK)=[ck(2:K,:); zeros(1,M)]+[zeros(1,M);  ck(1:K-1,:)]...
-        # #           -clast-(ok*sum(f1.*ck)).*x1-(ok*sum(f2.*ck)).*x2-(ok*ck(1,:)).*x3...
-        # #           -(ok*ck(K,:)).*x4;
-        # #     clast=ck;
-        # # end
-
-        # # end %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%   of THinv5
+        # C=[C inv(A)];
+        return np.linalg.inv(A).transpose(1, 0, 2).reshape(K, M * K)
 
     def armodel(self, R, rmax):
         """
@@ -191,42 +117,49 @@ class IWASOBI():
         % to compute AR coefficients of the sources given covariance functions 
         % but if the zeros have magnitude > rmax, the zeros are pushed back.
         %
+
+        All sources are processed at once.
         """
         # [M,d]=size(R);
         M, d = R.shape
 
-        # AR = zeros(M,d);
-        AR = np.zeros((M, d))
-
-        # for id=1:d
-        for id in range(d):
-            # AR(:,id)=[1; -toeplitz(R(1:M-1,id),R(1:M-1,id)')\R(2:M,id)];
-            AR[:, id] = np.r_[1, np.linalg.lstsq(-toeplitz(R[:M - 1, id], R[:M - 1, id].T),
-                                                 R[1:M, id])[0]]
-            # v=roots(AR(:,id)); %%% mimicks the matlab function "polystab"
-            v = np.roots(AR[:, id])
-            # %    v1(1,id)=max(abs(v));
-            #v1[0,id] = np.max(np.abs(v))
-            #     vs=0.5*(sign(abs(v)-1)+1);
-            vs = 0.5 * (np.sign(np.abs(v) - 1) + 1)
-            #     v=(1-vs).*v+vs./conj(v);
-            v = (1 - vs) * v + vs / np.conj(v)
-            #     vmax=max(abs(v));
-            vmax = np.max(np.abs(v))
-            # %    v2(1,id)=max(abs(v));
-            #     if vmax>rmax
-            #        v=v*rmax/vmax;
-            #     end
-            if vmax > rmax:
-                v = v * rmax / vmax
-            #     AR(:,id)=real(poly(v)'); %%% reconstructs back the covariance function
-            AR[:, id] = np.real(np.poly(v).T)
-        # end
+        # AR(:,id)=[1; -toeplitz(R(1:M-1,id),R(1:M-1,id)')\R(2:M,id)];
+        i, j = np.ogrid[:M - 1, :M - 1]
+        T = R[np.abs(i - j), :].transpose(2, 0, 1)
+        try:
+            a = np.linalg.solve(-T, R[1:M, :].T[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            a = np.array([np.linalg.lstsq(-T[id], R[1:M, id], rcond=None)[0]
+                          for id in range(d)])
+        # v=roots(AR(:,id)); %%% mimicks the matlab function "polystab"
+        # (the eigenvalues of the companion matrices)
+        comp = np.zeros((d, M - 1, M - 1))
+        comp[:, 0, :] = -a
+        comp[:, np.arange(1, M - 1), np.arange(M - 2)] = 1
+        v = np.linalg.eigvals(comp)
+        #     vs=0.5*(sign(abs(v)-1)+1);
+        #     v=(1-vs).*v+vs./conj(v);
+        # (only reflecting the roots outside the unit circle, so zero
+        # roots stay zero)
+        outside = np.abs(v) > 1
+        v[outside] = 1 / np.conj(v[outside])
+        #     vmax=max(abs(v));
+        vmax = np.max(np.abs(v), axis=1)
+        #     if vmax>rmax
+        #        v=v*rmax/vmax;
+        #     end
+        v = v * np.where(vmax > rmax, rmax / vmax, 1.)[:, np.newaxis]
+        #     AR(:,id)=real(poly(v)'); %%% reconstructs back the covariance function
+        poly = np.ones((d, 1), dtype=v.dtype)
+        for k in range(M - 1):
+            poly = (np.concatenate([poly, np.zeros((d, 1))], axis=1) -
+                    v[:, k:k + 1] *
+                    np.concatenate([np.zeros((d, 1)), poly], axis=1))
+        AR = np.real(poly).T.copy()
         # Rs=ar2r(AR);
         Rs = self.ar2r(AR)
         # sigmy=R(1,:)./Rs(1,:);
         sigmy = R[0, :] / Rs[0, :]
-        # % [v1; v2]
         # end %%%%%%%%%%%%%%%%%%%%%%%  of armodel
         return AR, sigmy
 
@@ -313,7 +246,7 @@ class IWASOBI():
         for index in range(q + 1):
             #irange = NumOfSources*(index) + np.arange(NumOfSources)
             i = NumOfSources * (index)
-            R_est[:, i:i + NumOfSources] = (1 / np.float(T)) * \
+            R_est[:, i:i + NumOfSources] = (1 / float(T)) * \
                 (np.dot(x[:, :T], x[:, index:T + index].T))
 
         return R_est
@@ -322,63 +255,34 @@ class IWASOBI():
         """
         function [H ARC]=weights(Ms,rmax,eps0)
         %
+
+        The source pairs are processed at once.
         """
         # [d,Ld]=size(Ms);
         d, Ld = Ms.shape
         # L=floor(Ld/d);
-        L = np.int32(np.floor(Ld / np.float(d)))
-        # d2=d*(d-1)/2;
-        d2 = np.int32(d * (d - 1) / 2.)
-        # R=zeros(L,d);
-        R = np.zeros((L, d))
-        # for index=1:L
-        #     id=(index-1)*d;
-        #     R(index,:)=diag(Ms(:,id+1:id+d)).';  %%% columns of R will contain
+        L = Ld // d
+        # R(index,:)=diag(Ms(:,id+1:id+d)).';  %%% columns of R will contain
         #                            %%% covariance function of the separated components
-        # end
-        for index in range(L):
-            id = index * d
-            R[index, :] = np.diag(Ms[:, id:id + d])
+        R = np.einsum('iki->ki', Ms[:, :L * d].reshape(d, L, d))
         # %
         # [ARC,sigmy]=armodel(R,rmax);      %%% compute AR models of estimated components
         ARC, sigmy = self.armodel(R, rmax)
         # %
-        # AR3=zeros(2*L-1,d2);
-        AR3 = np.zeros((2 * L - 1, d2))
-        # ll = 1;
-        # for i=2:d
-        #   for k=1:i-1
-        #       AR3(:,ll) = conv(ARC(:,i),ARC(:,k));
-        #       ll = ll+1;
-        # %    AR3=[AR3 conv(AR(:,i),AR(:,k))];
-        #   end
-        # end
-        ll = 0
-        for i in range(1, d):
-            for k in range(i):
-                AR3[:, ll] = np.convolve(ARC[:, i], ARC[:, k])
-                ll += 1
+        # AR3(:,ll) = conv(ARC(:,i),ARC(:,k)); for all pairs k < i
+        I, K = np.tril_indices(d, -1)
+        AR3 = np.zeros((2 * L - 1, len(I)))
+        for a in range(L):
+            AR3[a:a + L, :] += ARC[a, I] * ARC[:, K]
         # phi=ar2r(AR3);     %%%%%%%%%% functions phi to evaluate CVinv
         phi = self.ar2r(AR3)
         # H=THinv5(phi,L,d2,eps0*phi(1,:));  %%%% to compute inversions of CV
         #                                        %%%% It has dimension zeros(M,M*d2).
-        H = self.THinv5(phi, L, d2, eps0 * phi[0, :])
-        # im=1;
-        # for i=2:d
-        #   for k=1:i-1
-        #      fact=1/(sigmy(1,i)*sigmy(1,k));
-        #      imm=(im-1)*L;
-        #      H(:,imm+1:imm+L)=H(:,imm+1:imm+L)*fact;
-        #      im=im+1;
-        #   end
-        # end
-        im = 0
-        for i in range(1, d):
-            for k in range(i):
-                fact = 1 / (sigmy[i] * sigmy[k])
-                imm = im * L
-                H[:, imm:imm + L] = H[:, imm:imm + L] * fact
-                im += 1
+        H = self.THinv5(phi, L, len(I), eps0 * phi[0, :])
+        # fact=1/(sigmy(1,i)*sigmy(1,k));
+        # H(:,imm+1:imm+L)=H(:,imm+1:imm+L)*fact;
+        fact = 1 / (sigmy[I] * sigmy[K])
+        H = (H.reshape(L, len(I), L) * fact[:, np.newaxis]).reshape(L, -1)
 
         # end %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% of weights
         return (H, ARC)
@@ -398,18 +302,14 @@ class IWASOBI():
         # Rs=ar2r(ARC);
         Rs = self.ar2r(ARC)
 
-        # sum_Rs_s=zeros(K,K);
-        sum_Rs_s = np.zeros((K, K))
-
         # for s=0:M-1
         #     for t=0:M-1
         #         sum_Rs_s=sum_Rs_s+(ARC(s+1,:).*ARC(t+1,:))'*Rs(abs(s-t)+1,:);
         #     end
         # end
-        for s in range(M):
-            for t in range(M):
-                sum_Rs_s += np.dot((ARC[s, :] * ARC[t, :])[np.newaxis, :].T,
-                                   Rs[np.abs(s - t), :][np.newaxis, :])
+        s, t = np.ogrid[:M, :M]
+        sum_Rs_s = np.einsum('stk,stl->kl', ARC[s] * ARC[t],
+                             Rs[np.abs(s - t)])
 
         # denom=sum_Rs_s'.*sum_Rs_s+eye(K)-1;
         denom = sum_Rs_s.T * sum_Rs_s + np.eye(K) - 1
@@ -422,6 +322,17 @@ class IWASOBI():
         # end %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% of CRLB4
         return ISR
 
+    def _transform(self, M, W_est, L):
+        """
+        Return Ms with the blocks W_est*M_k*W_est' of the L matrices in
+        M and their diagonals as the columns of Rs.
+        """
+        d = W_est.shape[0]
+        Mb = M[:, :L * d].reshape(d, L, d).transpose(1, 0, 2)
+        Msb = np.matmul(np.matmul(W_est, Mb), W_est.T)
+        Rs = np.diagonal(Msb, axis1=1, axis2=2).T.copy()
+        return Msb.transpose(1, 0, 2).reshape(d, L * d), Rs
+
     def uwajd(self, M, maxnumiter=20, W_est0=None):
         """
         function [W_est Ms]=uwajd(M,maxnumiter,W_est0)
@@ -441,7 +352,7 @@ class IWASOBI():
         # [d Md]=size(M);
         d, Md = M.shape
         # L=floor(Md/d);
-        L = np.int32(np.floor(Md / np.float(d)))
+        L = Md // d
         # Md=L*d;
         Md = L * d
         # iter=0;
@@ -467,33 +378,26 @@ class IWASOBI():
         #    maxnumiter=20;
         # end
         # Ms=M;
-        Ms = M.copy()
         # Rs=zeros(d,L);
-        Rs = np.zeros((d, L))
         # for k=1:L
         #       ini=(k-1)*d;
         #       M(:,ini+1:ini+d)=0.5*(M(:,ini+1:ini+d)+M(:,ini+1:ini+d)');
         #       Ms(:,ini+1:ini+d)=W_est*M(:,ini+1:ini+d)*W_est';
         #       Rs(:,k)=diag(Ms(:,ini+1:ini+d));
         # end
-        for k in range(L):
-            ini = k * d
-            M[:, ini:ini + d] = 0.5 * (M[:, ini:ini + d] + M[:, ini:ini + d].T)
-            Ms[:, ini:ini +
-                d] = np.dot(np.dot(W_est, M[:, ini:ini + d]), W_est.T)
-            Rs[:, k] = np.diag(Ms[:, ini:ini + d])
+        Mb = M[:, :Md].reshape(d, L, d)
+        Mb[:] = 0.5 * (Mb + Mb.transpose(2, 1, 0))
+        Ms, Rs = self._transform(M, W_est, L)
 
         # crit=sum(Ms(:).^2)-sum(Rs(:).^2);
         crit = (Ms**2).sum() - (Rs**2).sum()
 
+        # the source pairs (id, id2) with id2 < id
+        I, K = np.tril_indices(d, -1)
+
         # while improve>eps && iter<maxnumiter
         while improve > eps and iter < maxnumiter:
             #   b11=[]; b12=[]; b22=[]; c1=[]; c2=[];
-            b11 = []
-            b12 = []
-            b22 = []
-            c1 = []
-            c2 = []
             #   for id=2:d
             #     Yim=Ms(1:id-1,id:d:Md);
             #     b22=[b22; sum(Rs(id,:).^2)*ones(id-1,1)];
@@ -502,18 +406,15 @@ class IWASOBI():
             #     c2=[c2; (Rs(id,:)*Yim')'];
             #     c1=[c1; sum(Rs(1:id-1,:).*Yim,2)];
             #   end
-            for id in range(1, d):
-                Yim = Ms[0:id, id:Md:d]
-                b22.append(np.dot((Rs[id, :]**2).sum(0), np.ones((id, 1))))
-                b12.append(np.dot(Rs[id, :], Rs[:id, :].T).T)
-                b11.append((Rs[:id, :]**2).sum(1))
-                c2.append(np.dot(Rs[id, :], Yim.T).T)
-                c1.append((Rs[:id, :] * Yim).sum(1))
-            b22 = np.squeeze(np.vstack(b22))
-            b12 = np.hstack(b12)
-            b11 = np.hstack(b11)
-            c2 = np.hstack(c2)
-            c1 = np.hstack(c1)
+            # (for all the pairs at once)
+            Yim = Ms.reshape(d, L, d)[K, :, I]
+            Rs_I = Rs[I]
+            Rs_K = Rs[K]
+            b22 = (Rs_I**2).sum(1)
+            b12 = (Rs_I * Rs_K).sum(1)
+            b11 = (Rs_K**2).sum(1)
+            c2 = (Rs_I * Yim).sum(1)
+            c1 = (Rs_K * Yim).sum(1)
             #   det0=b11.*b22-b12.^2;
             det0 = b11 * b22 - b12**2
             #   d1=(c1.*b22-b12.*c2)./det0;
@@ -522,18 +423,14 @@ class IWASOBI():
             d2 = (b11 * c2 - b12 * c1) / det0
             # %    value=norm([d1; d2])
             #   m=0;
-            m = 0
-            #   A0=eye(d);
             A0 = np.eye(d)
             #   for id=2:d
             #       A0(id,1:id-1)=d1(m+1:m+id-1,1)';
             #       A0(1:id-1,id)=d2(m+1:m+id-1,1);
             #       m=m+id-1;
             #   end
-            for id in range(1, d):
-                A0[id, 0:id] = d1[m:m + id]
-                A0[0:id, id] = d2[m:m + id]
-                m += id
+            A0[I, K] = d1
+            A0[K, I] = d2
 
             #   Ainv=inv(A0);
             Ainv = np.linalg.inv(A0)
@@ -550,11 +447,7 @@ class IWASOBI():
             #      Ms(:,ini+1:ini+d) = W_est*M(:,ini+1:ini+d)*W_est';
             #      Rs(:,k)=diag(Ms(:,ini+1:ini+d));
             #   end
-            for k in range(L):
-                ini = k * d
-                Ms[:, ini:ini +
-                    d] = np.dot(np.dot(W_est, M[:, ini:ini + d]), W_est.T)
-                Rs[:, k] = np.diag(Ms[:, ini:ini + d])
+            Ms, Rs = self._transform(M, W_est, L)
             #   critic=sum(Ms(:).^2)-sum(Rs(:).^2);
             critic = (Ms**2).sum() - (Rs**2).sum()
             # %   improve=abs(critic-crit(end));
@@ -593,9 +486,9 @@ class IWASOBI():
         # [d Md]=size(M);
         d, Md = M.shape
         # L=floor(Md/d);
-        L = np.int32(np.floor(Md / np.float(d)))
+        L = Md // d
         # dd2=d*(d-1)/2;
-        dd2 = np.int32(d * (d - 1) / 2.)
+        dd2 = d * (d - 1) // 2
         # Md=L*d;
         Md = L * d
         # if nargin<4
@@ -615,32 +508,24 @@ class IWASOBI():
             W_est = W_est0
 
         # Ms=M;
-        Ms = M.copy()
         # Rs=zeros(d,L);
-        Rs = np.zeros((d, L))
         # for k=1:L
         #       ini=(k-1)*d;
         #       M(:,ini+1:ini+d)=0.5*(M(:,ini+1:ini+d)+M(:,ini+1:ini+d)');
         #       Ms(:,ini+1:ini+d)=W_est*M(:,ini+1:ini+d)*W_est';
         #       Rs(:,k)=diag(Ms(:,ini+1:ini+d));
         # end
-        for k in range(L):
-            ini = k * d
-            M[:, ini:ini + d] = 0.5 * (M[:, ini:ini + d] + M[:, ini:ini + d].T)
-            Ms[:, ini:ini +
-                d] = np.dot(np.dot(W_est, M[:, ini:ini + d]), W_est.T)
-            Rs[:, k] = np.diag(Ms[:, ini:ini + d])
+        Mb = M[:, :Md].reshape(d, L, d)
+        Mb[:] = 0.5 * (Mb + Mb.transpose(2, 1, 0))
+        Ms, Rs = self._transform(M, W_est, L)
+
+        # the source pairs (id, id2) with id2 < id and their weights
+        I, K = np.tril_indices(d, -1)
+        Wm = H[:, :dd2 * L].reshape(L, dd2, L).transpose(1, 0, 2)
 
         # for iter=1:maxnumit
         for iter in range(maxnumit):
             #  b11=zeros(dd2,1); b12=b11; b22=b11; c1=b11; c2=c1;
-            b11 = np.zeros((dd2, 1))
-            b12 = np.zeros((dd2, 1))
-            b22 = np.zeros((dd2, 1))
-            c1 = np.zeros((dd2, 1))
-            c2 = np.zeros((dd2, 1))
-            #  m=0;
-            m = 0
             #  for id=2:d
             #     for id2=1:id-1
             #         m=m+1; im=(m-1)*L;
@@ -657,21 +542,17 @@ class IWASOBI():
             #         c2(m)=Wlam1'*Yim';
             #      end
             #   end
-            for id in range(1, d):
-                for id2 in range(id):
-                    im = m * L
-                    Wm = H[:, im:im + L]
-                    Yim = Ms[id, id2:Md:d]
-                    Rs_id = Rs[id, :]
-                    Rs_id2 = Rs[id2, :]
-                    Wlam1 = np.dot(Wm, Rs_id.T)
-                    Wlam2 = np.dot(Wm, Rs_id2.T)
-                    b11[m] = np.dot(Rs_id2, Wlam2)
-                    b12[m] = np.dot(Rs_id, Wlam2)
-                    b22[m] = np.dot(Rs_id, Wlam1)
-                    c1[m] = np.dot(Wlam2.T, Yim.T)
-                    c2[m] = np.dot(Wlam1.T, Yim.T)
-                    m += 1
+            # (for all the pairs at once)
+            Yim = Ms.reshape(d, L, d)[I, :, K]
+            Rs_id = Rs[I]
+            Rs_id2 = Rs[K]
+            Wlam1 = np.einsum('mab,mb->ma', Wm, Rs_id)
+            Wlam2 = np.einsum('mab,mb->ma', Wm, Rs_id2)
+            b11 = (Rs_id2 * Wlam2).sum(1)
+            b12 = (Rs_id * Wlam2).sum(1)
+            b22 = (Rs_id * Wlam1).sum(1)
+            c1 = (Wlam2 * Yim).sum(1)
+            c2 = (Wlam1 * Yim).sum(1)
             #   det0=b11.*b22-b12.^2;
             det0 = b11 * b22 - b12**2
             #   d1=(c1.*b22-b12.*c2)./det0;
@@ -679,18 +560,14 @@ class IWASOBI():
             #   d2=(b11.*c2-b12.*c1)./det0;
             d2 = (b11 * c2 - b12 * c1) / det0
             #   m=0;
-            m = 0
-            #   A0=eye(d);
             A0 = np.eye(d)
             #   for id=2:d
             #       A0(id,1:id-1)=d1(m+1:m+id-1,1)';
             #       A0(1:id-1,id)=d2(m+1:m+id-1,1);
             #       m=m+id-1;
             #   end
-            for id in range(1, d):
-                A0[id, 0:id] = d1[m:m + id, 0]
-                A0[0:id, id] = d2[m:m + id, 0]
-                m += id
+            A0[I, K] = d1
+            A0[K, I] = d2
             #   Ainv=inv(A0);
             Ainv = np.linalg.inv(A0)
             #   W_est=Ainv*W_est;
@@ -706,11 +583,7 @@ class IWASOBI():
             #      Ms(:,ini+1:ini+d) = W_est*M(:,ini+1:ini+d)*W_est';
             #      Rs(:,k)=diag(Ms(:,ini+1:ini+d));
             #   end
-            for k in range(L):
-                ini = k * d
-                Ms[:, ini:ini +
-                    d] = np.dot(np.dot(W_est, M[:, ini:ini + d]), W_est.T)
-                Rs[:, k] = np.diag(Ms[:, ini:ini + d])
+            Ms, Rs = self._transform(M, W_est, L)
         # end %%%%%%%%%%% of for
         # end %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% of wajd
         return W_est, Ms
@@ -11,7 +11,8 @@
 import numpy as np
 
 
-def pca(X, ncomps=None, eigratio=1e6):
+def pca(X, ncomps=None, eigratio=1e6, method='full', block_samples=2**16,
+        oversamples=10, n_iter=4, random_state=None):
     """
     Principal components analysis
 
@@ -22,23 +23,151 @@ def pca(X, ncomps=None, eigratio=1e6):
 %   EIGRATIO. In such a case, the function will return as few components as
 %   are necessary to guarantee that such ratio is greater than EIGRATIO.
 
+    The method selects how the leading eigenvectors of the covariance
+    are found:
+
+    'full' : eigendecomposition of the full covariance.
+    'randomized' : randomized range finder (with n_iter subspace
+        iterations and oversamples extra dimensions) that only needs
+        products of the data (centered in blocks of block_samples)
+        with ncomps+oversamples vectors instead of the full
+        covariance.  Only worth it when ncomps is much
+        smaller than the number of channels.
+    'incremental' : the covariance and the components are computed
+        from blocks of block_samples samples, so X can be anything
+        that can be sliced like a [channels, samples] array (e.g., a
+        LazyTimeSeries, np.memmap, or h5py dataset) and is never
+        loaded at once.
     """
+    if method not in ['full', 'randomized', 'incremental']:
+        raise ValueError("method must be 'full', 'randomized', or " +
+                         "'incremental'. Invalid value: " + str(method))
 
     if ncomps is None:
         ncomps = X.shape[0]
 
-    C = np.cov(X)
-    D, V = np.linalg.eigh(C)
+    if method == 'incremental':
+        acc = CovarianceAccumulator()
+        for start in range(0, X.shape[1], block_samples):
+            acc.update(np.asarray(X[:, start:start + block_samples]))
+        D, V = np.linalg.eigh(acc.cov)
+    elif method == 'randomized':
+        X = np.asarray(X)
+        D, V = _randomized_eigh(X, ncomps + oversamples, n_iter,
+                                random_state, block_samples)
+    else:
+        C = np.cov(X)
+        D, V = np.linalg.eigh(C)
     val = np.abs(D)
     I = np.argsort(val)[::-1]
     val = val[I]
 
-    while (val[0] / val[ncomps - 1]) > eigratio:
-        ncomps -= 1
+    # the ratio grows with the number of components, so keep those
+    # within eigratio of the largest eigenvalue
+    ncomps = min(ncomps, len(val), np.sum(val[0] <= eigratio * val))
 
     V = V[:, I[:ncomps]]
     D = np.diag(D[I[:ncomps]]**(-.5))
     W = np.dot(D, V.T)
-    Y = np.dot(W, X)
+    if method == 'incremental':
+        Y = dot_blocks(W, X, block_samples)
+    else:
+        Y = np.dot(W, X)
 
     return W, Y
+
+
+def dot_blocks(W, X, block_samples=2**16):
+    """
+    Return np.dot(W, X), reading X (anything that can be sliced like
+    a [channels, samples] array) block_samples samples at a time.
+    """
+    Y = np.empty((W.shape[0], X.shape[1]),
+                 dtype=np.result_type(W.dtype, np.float32))
+    for start in range(0, X.shape[1], block_samples):
+        stop = min(start + block_samples, X.shape[1])
+        Y[:, start:stop] = np.dot(W, np.asarray(X[:, start:stop]))
+    return Y
+
+
+class CovarianceAccumulator(object):
+    """
+    Covariance of [channels, samples] data that arrive in blocks.
+
+    The blocks are merged with the pairwise update of the means and
+    the sums of squared deviations (Chan et al.), which is as accurate
+    as np.cov on all the data at once.
+
+    Examples
+    --------
+    >>> X = np.random.randn(4, 1000)
+    >>> acc = CovarianceAccumulator()
+    >>> for start in range(0, X.shape[1], 256):
+    ...     acc.update(X[:, start:start + 256])
+    >>> np.allclose(acc.cov, np.cov(X))
+    True
+
+    The blocks can come from anything that is read in pieces, e.g.,
+    LazyTimeSeries.iter_chunks.
+    """
+
+    def __init__(self):
+        self.nsamples = 0
+        self.mean = None
+        self._m2 = None
+
+    def update(self, block):
+        """
+        Add the samples of a [channels, samples] block.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        n = block.shape[1]
+        if n == 0:
+            return
+        mean = block.mean(1)
+        dev = block - mean[:, np.newaxis]
+        m2 = np.dot(dev, dev.T)
+        if self.mean is None:
+            self.nsamples, self.mean, self._m2 = n, mean, m2
+            return
+        total = self.nsamples + n
+        delta = mean - self.mean
+        self._m2 += m2 + np.outer(delta, delta) * (self.nsamples * n / total)
+        self.mean = self.mean + delta * (n / total)
+        self.nsamples = total
+
+    def _get_cov(self):
+        if self.nsamples < 2:
+            raise ValueError('At least two samples are needed.')
+        return self._m2 / (self.nsamples - 1)
+
+    cov = property(_get_cov)
+
+
+def _randomized_eigh(X, k, n_iter, random_state, block_samples=2**16):
+    """
+    Approximate the k leading eigenpairs of np.cov(X) without forming
+    it (Halko et al., 2011).
+    """
+    d, N = X.shape
+    k = min(k, d)
+    mean = X.mean(1)[:, np.newaxis]
+
+    def _cov_dot(Q):
+        # np.cov(X) @ Q from products with the data, centered block by
+        # block (subtracting the product with the mean afterwards
+        # loses precision when the offsets are large)
+        CQ = np.zeros((d, Q.shape[1]))
+        for start in range(0, N, block_samples):
+            Xc = X[:, start:start + block_samples] - mean
+            CQ += np.dot(Xc, np.dot(Xc.T, Q))
+        return CQ / (N - 1)
+
+    rng = np.random.RandomState(random_state)
+    Q = np.linalg.qr(_cov_dot(rng.randn(d, k)))[0]
+    for i in range(n_iter):
+        Q = np.linalg.qr(_cov_dot(Q))[0]
+
+    # eigendecomposition of the covariance projected on the subspace
+    D, U = np.linalg.eigh(np.dot(Q.T, _cov_dot(Q)))
+    return D, np.dot(Q, U)
@@ -0,0 +1,86 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal,\
+    assert_array_almost_equal
+
+from scipy.signal import butter, sosfiltfilt
+
+from ptsa.filt import buttfilt, buttfilt_blocks, butter_design, _butter_design
+from ptsa.data import TimeSeries, Dim
+
+
+class test_buttfilt(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(3, 2000)
+
+    def test_sos(self):
+        # both forms agree on well conditioned filters
+        assert_array_almost_equal(
+            buttfilt(self.dat, [58., 62.], 500., 'stop', 2),
+            buttfilt(self.dat, [58., 62.], 500., 'stop', 2, use_sos=True))
+
+        # only sos survives a high order narrow notch at a high rate
+        t = np.arange(20000) / 5000.
+        x = np.sin(2 * np.pi * 10 * t) + np.sin(2 * np.pi * 60 * t)
+        y = buttfilt(x, [58., 62.], 5000., 'stop', 4, use_sos=True)
+        self.assertTrue(np.abs(y - np.sin(2 * np.pi * 10 * t))[5000:-5000]
+                        .max() < .01)
+        y = buttfilt(x, [58., 62.], 5000., 'stop', 4)
+        self.assertFalse(np.abs(y - np.sin(2 * np.pi * 10 * t))[5000:-5000]
+                         .max() < 1.)
+
+        ts = TimeSeries(self.dat, 'time', 500.,
+                        dims=[Dim(np.arange(3), 'channels'),
+                              Dim(np.arange(2000) / 500., 'time')])
+        assert_array_almost_equal(
+            ts.filtered([58., 62.], order=6, use_sos=True),
+            buttfilt(self.dat, [58., 62.], 500., 'stop', 6, use_sos=True))
+
+    def test_design_cache(self):
+        misses = _butter_design.cache_info().misses
+        sos = butter_design(4, [58, 62], 500, 'stop', use_sos=True)[0]
+        sos[:] = 0
+        assert_array_equal(butter_design(4, np.array([58., 62.]), 500.,
+                                         'stop', use_sos=True)[0],
+                           butter(4, [58 / 250., 62 / 250.], 'stop',
+                                  output='sos'))
+        butter_design(4, [58, 62], 1000, 'stop', use_sos=True)
+        self.assertEqual(_butter_design.cache_info().misses, misses + 2)
+
+
+class test_buttfilt_blocks(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(3, 1000)
+
+    def test_buttfilt_blocks(self):
+        filtered = buttfilt(self.dat, [.5], 200., 'high', 4)
+        # blocks that don't divide the data evenly, filtered in place
+        out = self.dat.copy()
+        buttfilt_blocks(out, out, [.5], 200., 'high', 4, block_samples=128)
+        assert_array_almost_equal(out, filtered, decimal=10)
+
+        # blocks shorter than the padding
+        filtered = buttfilt(self.dat, [58., 62.], 200., 'stop', 4)
+        out = np.empty_like(self.dat)
+        buttfilt_blocks(self.dat, out, [58., 62.], 200., 'stop', 4,
+                        block_samples=7)
+        assert_array_almost_equal(out, filtered, decimal=10)
+
+        # second-order sections
+        out = np.empty_like(self.dat)
+        buttfilt_blocks(self.dat, out, [58., 62.], 200., 'stop', 4,
+                        block_samples=100, use_sos=True)
+        sos = butter_design(4, [58., 62.], 200., 'stop', use_sos=True)[0]
+        assert_array_almost_equal(out, sosfiltfilt(sos, self.dat),
+                                  decimal=10)
+
+        self.assertRaises(ValueError, buttfilt_blocks, self.dat[:, :15],
+                          out, [.5], 200., 'high', 4)
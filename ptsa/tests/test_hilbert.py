@@ -0,0 +1,35 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal
+
+from ptsa.hilbert import hilbert_pow
+from ptsa.data import TimeSeries, Dim
+
+
+class test_hilbert_pow(TestCase):
+    def setUp(self):
+        self.dat = TimeSeries(np.random.randn(3, 5000), 'time', 500.,
+                              dims=[Dim(np.arange(3), 'channels'),
+                                    Dim(np.arange(5000) / 500., 'time')])
+        self.bands = [('beta', [16.0, 26.0]), ('gamma', [44.0, 100.0])]
+
+    def test_filter_bank(self):
+        pow = hilbert_pow(self.dat, self.bands, verbose=False)
+        for pad in [False, True]:
+            pow_fb = hilbert_pow(self.dat, self.bands, pad_to_pow2=pad,
+                                 filter_bank=True, dtype=np.float32)
+            self.assertEqual(pow_fb.dtype, np.float32)
+            self.assertEqual(pow_fb.dim_names, ['freqs', 'channels', 'time'])
+            self.assertEqual(pow_fb.shape, pow.shape)
+            assert_array_equal(np.asarray(pow_fb['freqs']), ['beta', 'gamma'])
+            # same away from the edges, where filtering differs
+            err = np.abs(np.asarray(pow_fb) - np.asarray(pow))[..., 500:-500]
+            self.assertTrue(err.max() < .01 * np.asarray(pow).mean())
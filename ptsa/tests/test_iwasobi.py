@@ -0,0 +1,54 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_almost_equal
+
+from scipy.linalg import toeplitz, hankel
+from scipy.signal import lfilter
+
+from ptsa.iwasobi import IWASOBI, iwasobi
+
+
+class test_iwasobi(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.sources = np.array([lfilter([1], [1, a], rng.randn(5000))
+                                 for a in [-.9, -.5, 0., .5, .8]])
+        self.dat = rng.randn(5, 5).dot(self.sources)
+
+    def test_kernels(self):
+        iw = IWASOBI()
+        K, M = 4, 3
+        phi = np.random.rand(2 * K - 1, M)
+        eps = np.random.rand(M)
+        G = iw.THinv5(phi, K, M, eps)
+        for im in range(M):
+            A = (toeplitz(phi[:K, im]) + hankel(phi[:K, im], phi[K - 1:, im]) +
+                 eps[im] * np.eye(K))
+            assert_array_almost_equal(G[:, im * K:(im + 1) * K],
+                                      np.linalg.inv(A))
+
+        x = self.dat - self.dat.mean(1)[:, np.newaxis]
+        R = iw.corr_est(x, 4990, 10)
+        self.assertEqual(R.shape, (5, 55))
+        assert_array_almost_equal(R[:, 15:20],
+                                  np.dot(x[:, :4990], x[:, 3:4993].T) / 4990.)
+
+        # AR(1) models of AR(1) covariances
+        R = np.array([[1., .5, .25, .125], [1., -.8, .64, -.512]]).T
+        ARC, sigmy = iw.armodel(R, .99)
+        assert_array_almost_equal(ARC.T, [[1., -.5, 0, 0], [1., .8, 0, 0]])
+
+    def test_iwasobi(self):
+        W, Winit, ISR, signals = iwasobi(self.dat)
+        self.assertEqual(W.shape, (5, 5))
+        # each source is recovered (up to order and scale)
+        corr = np.abs(np.corrcoef(signals, self.sources)[:5, 5:])
+        self.assertTrue(np.all(corr.max(0) > .99))
@@ -0,0 +1,74 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import doctest
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_almost_equal
+
+from ptsa import pca as pca_module
+from ptsa.pca import pca, CovarianceAccumulator
+from ptsa.data import ArrayWrapper
+
+
+class test_pca(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        # a few strong components plus weak noise on 20 channels
+        self.dat = (np.dot(rng.randn(20, 4) * [10., 5., 3., 2.],
+                           rng.randn(4, 3000)) +
+                    .1 * rng.randn(20, 3000) + 50.)
+
+    def assert_same_rows(self, W1, W2, decimal=6):
+        # rows of the PCA matrices only agree up to the sign
+        signs = np.sign(np.sum(W1 * W2, 1))[:, np.newaxis]
+        assert_array_almost_equal(W1, W2 * signs, decimal=decimal)
+
+    def test_full(self):
+        W, Y = pca(self.dat)
+        self.assertEqual(W.shape, (20, 20))
+        assert_array_almost_equal(np.cov(Y), np.eye(20))
+        W, Y = pca(self.dat, ncomps=3)
+        self.assertEqual(Y.shape, (3, 3000))
+        # eigratio drops the components too weak compared to the first
+        W, Y = pca(self.dat, eigratio=1e3)
+        self.assertEqual(W.shape, (4, 20))
+
+    def test_incremental(self):
+        acc = CovarianceAccumulator()
+        for start in range(0, 3000, 700):
+            acc.update(self.dat[:, start:start + 700])
+        assert_array_almost_equal(acc.cov, np.cov(self.dat))
+        assert_array_almost_equal(acc.mean, self.dat.mean(1))
+
+        W, Y = pca(self.dat, ncomps=5)
+        # straight from a wrapper
+        lts = ArrayWrapper(self.dat, 100.).get_all_data(lazy=True)
+        W_i, Y_i = pca(lts, ncomps=5, method='incremental',
+                       block_samples=512)
+        self.assert_same_rows(W_i, W)
+        self.assert_same_rows(Y_i, Y)
+
+    def test_randomized(self):
+        W, Y = pca(self.dat, ncomps=4)
+        W_r, Y_r = pca(self.dat, ncomps=4, method='randomized',
+                       random_state=0)
+        self.assert_same_rows(W_r, W, decimal=4)
+
+        # large offsets (as in EEG) don't cost precision
+        dat = self.dat + 1e6 * np.arange(20)[:, np.newaxis]
+        W, Y = pca(dat, ncomps=4)
+        W_r, Y_r = pca(dat, ncomps=4, method='randomized', random_state=0,
+                       block_samples=1000)
+        self.assert_same_rows(W_r / np.abs(W).max(), W / np.abs(W).max(),
+                              decimal=10)
+        self.assertRaises(ValueError, pca, self.dat, method='svd')
+
+    def test_doctests(self):
+        self.assertEqual(doctest.testmod(pca_module).failed, 0)
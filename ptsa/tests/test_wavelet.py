@@ -9,6 +9,7 @@
 
 import numpy as np
 import re
+import pywt
 from numpy.testing import *  # NumpyTest, NumpyTestCase
 
 from ptsa.wavelet import *
@@ -375,3 +376,162 @@ class test_morlet_multi(TestCase):
         # ensure valid output values:
         powerTest = z_ts >= 0
         self.assertTrue(powerTest.all())
+
+    def test_fconv_multi(self):
+        x = np.random.randn(3, 200)
+        wavelets = morlet_multi([5, 10, 20], 5, 100)
+        for mode in ['full', 'same', 'valid']:
+            conv = fconv_multi(wavelets[0], x, mode)
+            for i in range(3):
+                assert_array_almost_equal(
+                    conv[i], np.convolve(wavelets[0], x[i], mode))
+
+        # all the frequencies from the data transformed only once
+        phase, power = phase_pow_multi([5, 10, 20], x, 100,
+                                       conv_dtype=np.complex128)
+        for f, wav in enumerate(wavelets):
+            conv = np.array([np.convolve(wav, x[i], 'same')
+                             for i in range(3)])
+            assert_array_almost_equal(power[f], np.abs(conv)**2)
+            assert_array_almost_equal(phase[f], np.angle(conv))
+
+    def test_phase_pow_multi_chunks(self):
+        dat = np.random.randn(3, 4, 500)
+        phase, power = phase_pow_multi([5, 10, 20], dat, 100)
+        self.assertEqual(power.dtype, np.float32)
+        self.assertEqual(power.shape, (3, 3, 4, 500))
+        for kwargs in [dict(chunk_size=5), dict(max_memory=1)]:
+            phase_c, power_c = phase_pow_multi([5, 10, 20], dat, 100,
+                                               **kwargs)
+            assert_array_equal(phase_c, phase)
+            assert_array_equal(power_c, power)
+        assert_array_equal(phase_pow_multi([5, 10, 20], dat, 100,
+                                           to_return='power', chunk_size=2),
+                           power)
+
+    def test_phase_pow_multi_n_jobs(self):
+        dat = TimeSeries(np.random.randn(3, 500), tdim='time', samplerate=100,
+                         dims=[Dim(np.arange(3), name='chans'),
+                               Dim(np.arange(500) / 100., name='time')])
+        freqs = np.arange(5, 30, 3)
+        phase, power = phase_pow_multi(freqs, dat)
+        for kwargs in [dict(n_jobs=4), dict(n_jobs=3, chunk_size=2)]:
+            phase_p, power_p = phase_pow_multi(freqs, dat, **kwargs)
+            assert_array_equal(phase_p, phase)
+            assert_array_equal(power_p, power)
+            self.assertEqual(power_p.dim_names, ['freqs', 'chans', 'time'])
+            assert_array_equal(np.asarray(power_p['freqs']), freqs)
+
+    def test_wavelet_cache(self):
+        from ptsa import wavelet
+        from ptsa.wavelet import _morlet_bank, _fft_bank_cache
+        clear_wavelet_cache()
+        wavelets = morlet_multi([5, 10], 5, 100)
+        # returned wavelets are copies, so changing them is harmless
+        wavelets[0][:] = 0
+        self.assertEqual(_morlet_bank.cache_info().currsize, 1)
+        assert_array_equal(morlet_multi(np.array([5., 10.]), [5], 100.)[1],
+                           wavelets[1])
+        self.assertEqual(_morlet_bank.cache_info().hits, 1)
+        self.assertTrue(np.any(morlet_multi([5, 10], 5, 100)[0] != 0))
+
+        # phase_pow_multi reuses the bank and its transforms
+        dat = np.random.randn(2, 300)
+        power = phase_pow_multi([5, 10], dat, 100, to_return='power')
+        self.assertEqual(len(_fft_bank_cache), 1)
+        bank = list(_fft_bank_cache.values())[0]
+        assert_array_equal(phase_pow_multi([5, 10], dat, 100,
+                                           to_return='power'), power)
+        self.assertTrue(list(_fft_bank_cache.values())[0] is bank)
+
+        # the transforms are limited by size (larger ones aren't kept)
+        max_bytes = wavelet._fft_bank_max_bytes
+        try:
+            wavelet._fft_bank_max_bytes = bank.nbytes
+            phase_pow_multi([10, 20], dat, 100, to_return='power')
+            self.assertEqual(len(_fft_bank_cache), 1)
+            self.assertFalse(list(_fft_bank_cache.values())[0] is bank)
+            phase_pow_multi([5, 10], np.random.randn(2, 2000), 100,
+                            to_return='power')
+            self.assertEqual(len(_fft_bank_cache), 1)
+        finally:
+            wavelet._fft_bank_max_bytes = max_bytes
+
+        # calcPhasePow reuses its wavelets, too
+        phase, power = calcPhasePow([5, 10], dat, 100)
+        phase1, power1 = phasePow1d(10, dat[1], 100, 5)
+        assert_array_almost_equal(power[1, 1], power1, decimal=4)
+        assert_array_almost_equal(phase[1, 1], phase1, decimal=4)
+        clear_wavelet_cache()
+        self.assertEqual(_morlet_bank.cache_info().currsize, 0)
+        self.assertEqual(len(_fft_bank_cache), 0)
+
+    def test_phase_pow_multi_output_times(self):
+        dat = TimeSeries(np.random.randn(2, 3, 600), tdim='time',
+                         samplerate=200,
+                         dims=[Dim(np.arange(2), name='chans'),
+                               Dim(np.arange(3), name='events'),
+                               Dim(np.arange(600) / 200. - 1., name='time')])
+        freqs = [4, 10, 30]
+        phase, power = phase_pow_multi(freqs, dat, conv_dtype=np.complex128)
+
+        # decimated output without the buffer
+        for method in ['auto', 'fft', 'direct']:
+            phase_d, power_d = phase_pow_multi(freqs, dat, buffer=.5,
+                                               output_stride=4,
+                                               output_method=method,
+                                               conv_dtype=np.complex128)
+            self.assertEqual(power_d.shape, (3, 2, 3, 100))
+            self.assertEqual(power_d.samplerate, 50.)
+            assert_array_almost_equal(np.asarray(power_d['time']),
+                                      np.arange(100) / 50. - .5)
+            assert_array_almost_equal(power_d, power[..., 100:500:4])
+            assert_array_almost_equal(phase_d, phase[..., 100:500:4])
+
+        # a few arbitrary points on a plain array with time first
+        times = [0, 17, 300, -1]
+        power_t = phase_pow_multi(freqs, np.asarray(dat).T, samplerates=200,
+                                  time_axis=0, to_return='power',
+                                  output_times=times,
+                                  conv_dtype=np.complex128)
+        self.assertEqual(power_t.shape, (3, 4, 3, 2))
+        assert_array_almost_equal(
+            power_t, np.asarray(power)[..., times].transpose(0, 3, 2, 1))
+
+        self.assertRaises(ValueError, phase_pow_multi, freqs, dat,
+                          output_times=[1], output_stride=2)
+        self.assertRaises(ValueError, phase_pow_multi, freqs, dat,
+                          output_times=[600])
+
+
+class test_swt(TestCase):
+    def test_swt(self):
+        x = np.random.randn(3, 256)
+        coefs = swt(x, 'db3', level=5)
+        self.assertEqual(len(coefs), 5)
+        for r in range(3):
+            for (cA, cD), (pA, pD) in zip(coefs, pywt.swt(x[r], 'db3',
+                                                          level=5)):
+                assert_array_almost_equal(cA[r], pA)
+                assert_array_almost_equal(cD[r], pD)
+
+        # any axis
+        coefs_t = swt(x.T, pywt.Wavelet('db3'), level=5, axis=0)
+        for (cA, cD), (tA, tD) in zip(coefs, coefs_t):
+            assert_array_almost_equal(tA.T, cA)
+            assert_array_almost_equal(tD.T, cD)
+
+        self.assertRaises(ValueError, swt, x[:, :100], 'db3', level=5)
+
+    def test_iswt(self):
+        x = np.random.randn(256, 2)
+        coefs = swt(x, 'db3', level=8, axis=0)
+        assert_array_almost_equal(iswt(coefs, 'db3', axis=0), x)
+
+        # thresholded details like in wica, inverted in place
+        coefs = [(cA, (np.abs(cD) > 1) * cD) for cA, cD in coefs]
+        xd = iswt(coefs, 'db3', axis=0)
+        self.assertFalse(np.allclose(xd, x))
+        out = coefs[0][0]
+        self.assertTrue(iswt(coefs, 'db3', axis=0, out=out) is out)
+        assert_array_almost_equal(out, xd)
@@ -0,0 +1,158 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal,\
+    assert_array_almost_equal
+
+from ptsa.wica import find_blinks, remove_strong_artifacts, _clean_comp,\
+    WICA
+from ptsa.data import ArrayWrapper
+from ptsa.data.hdf5wrapper import HDF5Wrapper
+
+
+def _running_average(zd, a=.5, c=.975):
+    # reference recursion of the running averages
+    fast = np.zeros(len(zd) + 1)
+    slow = np.zeros(len(zd) + 1)
+    slow[0] = np.mean(zd[:10])
+    for i in range(len(zd)):
+        fast[i + 1] = a * fast[i] + (1 - a) * (zd[i] - slow[i])
+        slow[i + 1] = c * slow[i] + (1 - c) * zd[i]
+    return fast[1:]
+
+
+class test_find_blinks(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(3, 2000)
+        self.dat[:, 500:520] += 20
+        self.dat[2, 1900:1910] -= 30
+
+    def test_find_blinks(self):
+        L = 10
+        for chan in self.dat:
+            fast = (_running_average(chan) *
+                    _running_average(chan[::-1])) / 2.
+            idx = np.nonzero(np.abs(fast) > np.std(np.abs(fast)))[0]
+            artef = np.zeros(len(chan), dtype=bool)
+            artef[0] = True
+            for i in idx:
+                artef[max(i - L, 0):i + L] = True
+            id_artef, id_noise = find_blinks(chan, L)
+            assert_array_equal(id_artef, np.nonzero(artef)[0])
+            assert_array_equal(id_noise, np.nonzero(~artef)[0])
+
+    def test_batch(self):
+        id_artef, id_noise = find_blinks(self.dat, 10, thresh=[2., 2., 3.])
+        self.assertEqual(len(id_artef), 3)
+        for i, chan in enumerate(self.dat):
+            artef, noise = find_blinks(chan, 10, thresh=[2., 2., 3.][i])
+            assert_array_equal(id_artef[i], artef)
+            assert_array_equal(id_noise[i], noise)
+            self.assertEqual(len(artef) + len(noise), self.dat.shape[1])
+
+
+class test_remove_strong_artifacts(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.comps = rng.randn(3, 3000)
+        for i in range(200, 3000, 400):
+            self.comps[0, i:i + 30] += 15 * np.hanning(30)
+            self.comps[2, i + 100:i + 120] -= 10 * np.hanning(20)
+
+    def test_shared_memory(self):
+        comps = self.comps.copy()
+        opt = remove_strong_artifacts(None, None, comps, [0, 2], 1.25, 100)
+        self.assertTrue(np.all(opt > 0))
+        self.assertFalse(np.allclose(comps[[0, 2]], self.comps[[0, 2]]))
+        assert_array_equal(comps[1], self.comps[1])
+
+        # cleaned in place by the workers
+        comps_mp = self.comps.copy()
+        opt_mp = remove_strong_artifacts(None, None, comps_mp, [0, 2], 1.25,
+                                         100, num_mp_procs=2)
+        assert_array_equal(opt_mp, opt)
+        assert_array_equal(comps_mp, comps)
+
+    def test_thresh_only(self):
+        for num_mp_procs in [0, 2]:
+            comps = self.comps.copy()
+            opt = remove_strong_artifacts(None, None, comps[:, :2048], [0, 2],
+                                          1.25, 100, thresh_only=True,
+                                          num_mp_procs=num_mp_procs)
+            assert_array_equal(comps, self.comps)
+            self.assertTrue(np.all(opt > 0))
+            # reusing the thresholds
+            remove_strong_artifacts(None, None, comps, [0, 2], 1.25, 100,
+                                    Cthr=opt, num_mp_procs=num_mp_procs)
+            expected = self.comps.copy()
+            for i, c in enumerate([0, 2]):
+                expected[c] = _clean_comp(expected[c], 1.25, 10, opt[i])[0]
+            assert_array_equal(comps, expected)
+
+
+class test_WICA(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        sources = rng.randn(6, 8000)
+        for i in range(300, 8000, 700):
+            sources[0, i:i + 40] += 20 * np.hanning(40)
+        self.dat = rng.randn(8, 6).dot(sources)
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        HDF5Wrapper._handle_pool.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_stream(self):
+        wica = WICA(self.dat, 256., pure_range=(0, 4096))
+        comp_inds = wica.pick()
+        wica.clean(comp_inds)
+        corrected = wica.get_corrected()
+        self.assertFalse(np.allclose(corrected, self.dat))
+
+        # the same in one block, but only loading the pure range first
+        swica = WICA(ArrayWrapper(self.dat, 256.), 256.,
+                     pure_range=(0, 4096), stream=True)
+        self.assertEqual(swica._components.shape, (6, 4096))
+        assert_array_almost_equal(swica._components,
+                                  np.dot(swica._unmixing, self.dat[:, :4096]))
+        swica.clean(comp_inds)
+        assert_array_almost_equal(
+            swica.get_corrected(block_samples=8000, overlap=0), corrected)
+
+        # overlapping blocks into an array and appended to a file
+        blocked = swica.get_corrected(block_samples=1500, overlap=512)
+        self.assertTrue(np.corrcoef(blocked.ravel(),
+                                    corrected.ravel())[0, 1] > .99)
+        hw = HDF5Wrapper(os.path.join(self.tempdir, 'wica.hdf5'),
+                         data=np.empty((8, 0)), samplerate=256.,
+                         maxshape=(8, None))
+        swica.get_corrected(out=hw, block_samples=1500, overlap=512)
+        self.assertEqual(hw.nsamples, 8000)
+        assert_array_almost_equal(
+            hw._load_data(np.arange(8), [0], 8000, 0)[:, 0], blocked)
+
+    def test_pca_method(self):
+        wica = WICA(self.dat, 256., pure_range=(0, 4096))
+        wica.clean(wica.pick())
+        corrected = wica.get_corrected()
+        for pca_method in ['incremental', 'randomized']:
+            swica = WICA(ArrayWrapper(self.dat, 256.), 256.,
+                         pure_range=(0, 4096), stream=True,
+                         pca_method=pca_method, ncomps=6,
+                         pca_opts={'block_samples': 1000, 'random_state': 0})
+            swica.clean(wica.pick())
+            self.assertEqual(swica.ICA_weights.shape, (8, 6))
+            assert_array_almost_equal(
+                swica.get_corrected(block_samples=8000, overlap=0),
+                corrected, decimal=4)
@@ -15,12 +15,16 @@ from scipy.fftpack import fft, ifft
 # import scipy.signal
 # import scipy.ndimage
 # from ptsa.filt import decimate
-from ptsa.helper import reshape_to_2d, reshape_from_2d, centered, next_pow2
+from ptsa.helper import reshape_to_2d, reshape_from_2d, centered, next_pow2,\
+    sliding_windows
 from ptsa.data import TimeSeries, Dim
 from ptsa.fixed_scipy import morlet as morlet_wavelet
 
 import pywt
-import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from collections import OrderedDict
+import threading
 
 # try:
 #     import multiprocessing as mp
@@ -29,63 +33,71 @@ import math
 #     has_mp = False
 
 
-def swt(data, wavelet, level=None):
+def swt(data, wavelet, level=None, axis=-1):
     """
     Stationary Wavelet Transform
 
-    This version is 2 orders of magnitude faster than the one in pywt
-    even though it uses pywt for all the calculations.
+    Undecimated (a trous) transform that filters the whole signal with
+    the upsampled wavelet filters at each level (with periodic
+    boundaries).  The coefficients are identical to those of
+    decimating each subsequence with pywt.dwt in 'per' mode, but all
+    rows of a multi-dimensional input are transformed at once.
 
       Input parameters:
 
         data
-          One-dimensional data to transform
+          Data to transform; the length along axis must be divisible
+          by 2**level
         wavelet
           Either the name of a wavelet or a Wavelet object
         level
           Number of levels
+        axis
+          Axis to transform along (the others are batched)
+
+      Returns:
+
+        [(cAn, cDn), ..., (cA2, cD2), (cA1, cD1)], where each array
+        has the shape of data
 
     """
+    data = np.asarray(data)
+    if not isinstance(wavelet, pywt.Wavelet):
+        wavelet = pywt.Wavelet(wavelet)
+    if axis < 0:
+        axis += data.ndim
     if level is None:
-        level = pywt.swt_max_level(len(data))
-    num_levels = level
-    idata = data.copy()
+        level = pywt.swt_max_level(data.shape[axis])
+    if data.shape[axis] % 2**level != 0:
+        raise ValueError('The length of the data (' +
+                         str(data.shape[axis]) + ') must be divisible ' +
+                         'by 2**level (' + str(2**level) + ').')
+    dtype = data.dtype
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+
+    # filter along the last axis
+    idata = np.moveaxis(data, axis, -1)
+    scratch = np.empty(idata.shape, dtype=dtype)
+    offset = len(wavelet.dec_lo) // 2
     res = []
-    for j in range(1, num_levels + 1):
-        step_size = int(math.pow(2, j - 1))
-        last_index = step_size
-        # allocate
-        cA = np.empty_like(data)
-        cD = np.empty_like(data)
-        for first in range(last_index):  # 0 to last_index - 1
-            # Getting the indices that we will transform
-            indices = np.arange(first, len(cD), step_size)
-
-            # select the even indices
-            even_indices = indices[0::2]
-            # select the odd indices
-            odd_indices = indices[1::2]
-
-            # get the even
-            (cA1, cD1) = pywt.dwt(idata[indices], wavelet, 'per')
-            cA[even_indices] = cA1
-            cD[even_indices] = cD1
-
-            # then the odd
-            (cA1, cD1) = pywt.dwt(np.roll(idata[indices], -1), wavelet, 'per')
-            cA[odd_indices] = cA1
-            cD[odd_indices] = cD1
+    for j in range(1, level + 1):
+        step_size = 2**(j - 1)
+        cA = np.zeros(idata.shape, dtype=dtype)
+        cD = np.zeros(idata.shape, dtype=dtype)
+        _atrous_filter(idata, wavelet.dec_lo, step_size, offset, cA, scratch)
+        _atrous_filter(idata, wavelet.dec_hi, step_size, offset, cD, scratch)
 
         # set the data for the next loop
         idata = cA
 
         # prepend the result
-        res.insert(0, (cA, cD))
+        res.insert(0, (np.moveaxis(cA, -1, axis), np.moveaxis(cD, -1, axis)))
 
     return res
 
 
-def iswt(coefficients, wavelet):
+def iswt(coefficients, wavelet, axis=-1, out=None):
     """
     Inverse Stationary Wavelet Transform
 
@@ -99,39 +111,59 @@ def iswt(coefficients, wavelet):
         wavelet
           Either the name of a wavelet or a Wavelet object
 
+        axis
+          Axis the coefficients were transformed along
+
+        out
+          Array for the result (e.g., coefficients[0][0] to invert in
+          place); by default a new array is returned
+
     """
-    output = coefficients[0][0].copy()  # Avoid modification of input data
+    if not isinstance(wavelet, pywt.Wavelet):
+        wavelet = pywt.Wavelet(wavelet)
+    cA = np.asarray(coefficients[0][0])
+    if axis < 0:
+        axis += cA.ndim
+    if out is None:
+        out = cA.copy()  # Avoid modification of input data
+    elif out is not cA:
+        out[...] = cA
+    output = np.moveaxis(out, axis, -1)
+
+    # work arrays for the filtering
+    acc = np.empty(output.shape, dtype=output.dtype)
+    scratch = np.empty(output.shape, dtype=output.dtype)
+    offset = len(wavelet.rec_lo) // 2 - 1
 
     # num_levels, equivalent to the decomposition level, n
     num_levels = len(coefficients)
     for j in range(num_levels, 0, -1):
-        step_size = int(math.pow(2, j - 1))
-        last_index = step_size
-        _, cD = coefficients[num_levels - j]
-        for first in range(last_index):  # 0 to last_index - 1
-
-            # Getting the indices that we will transform
-            indices = np.arange(first, len(cD), step_size)
+        step_size = 2**(j - 1)
+        cD = np.moveaxis(np.asarray(coefficients[num_levels - j][1]),
+                         axis, -1)
+        # average of the reconstructions from the even and odd
+        # subsequences
+        acc[...] = 0
+        _atrous_filter(output, wavelet.rec_lo, step_size, offset, acc,
+                       scratch)
+        _atrous_filter(cD, wavelet.rec_hi, step_size, offset, acc, scratch)
+        np.multiply(acc, .5, out=output)
 
-            # select the even indices
-            even_indices = indices[0::2]
-            # select the odd indices
-            odd_indices = indices[1::2]
+    return out
 
-            # perform the inverse dwt on the selected indices,
-            # making sure to use periodic boundary conditions
-            x1 = pywt.idwt(output[even_indices],
-                           cD[even_indices], wavelet, 'per')
-            x2 = pywt.idwt(output[odd_indices],
-                           cD[odd_indices], wavelet, 'per')
 
-            # perform a circular shift right
-            x2 = np.roll(x2, 1)
-
-            # average and insert into the correct indices
-            output[indices] = (x1 + x2) / 2.
-
-    return output
+def _atrous_filter(x, filt, step_size, offset, out, scratch):
+    """
+    Add the circular filtering of x with the filter upsampled by
+    step_size to out along the last axis:
+    out[..., n] += sum_j filt[j] * x[..., (n + (offset - j)*step_size) % N]
+    """
+    N = x.shape[-1]
+    for j in range(len(filt)):
+        k = ((offset - j) * step_size) % N
+        np.multiply(x[..., k:], filt[j], out=scratch[..., :N - k])
+        np.multiply(x[..., :k], filt[j], out=scratch[..., N - k:])
+        out += scratch
 
 
 def morlet_multi(freqs, widths, samplerates,
@@ -143,6 +175,8 @@ def morlet_multi(freqs, widths, samplerates,
     Morlet wavelets with the specified frequencies, samplerates, and
     widths (in cycles); see the docstring for the scipy morlet function
     for details. These wavelets are normalized before they are returned.
+    Wavelet banks are cached (see clear_wavelet_cache), so repeated
+    calls with the same parameters don't regenerate them.
 
     Parameters
     ----------
@@ -196,6 +230,17 @@ def morlet_multi(freqs, widths, samplerates,
     >>> wavelet.shape
     (3, 112)
     """
+    return [wav.copy() for wav in
+            _morlet_bank(_morlet_key(freqs, widths, samplerates,
+                                     sampling_windows, complete))]
+
+
+def _morlet_key(freqs, widths, samplerates, sampling_windows=7,
+                complete=True):
+    """
+    Check the morlet_multi parameters and return them as a hashable
+    key for the wavelet bank caches.
+    """
     # ensure the proper dimensions
     freqs = np.atleast_1d(freqs)
     widths = np.atleast_1d(widths)
@@ -221,15 +266,28 @@ def morlet_multi(freqs, widths, samplerates,
                          "len(sampling_windows).\nlen(freqs) = " + str(len(freqs)) +
                          "\nlen(sampling_windows) = " + str(len(sampling_windows)))
 
+    return (tuple(freqs.tolist()), tuple(widths.tolist()),
+            tuple(samplerates.tolist()), tuple(sampling_windows.tolist()),
+            bool(complete))
+
+
+@lru_cache(maxsize=32)
+def _morlet_bank(key):
+    """
+    Generate the (read-only) normalized wavelets for a _morlet_key.
+    """
+    freqs, widths, samplerates, sampling_windows, complete = \
+        [np.asarray(k) for k in key[:4]] + [key[4]]
+
     # make len(widths)==len(freqs):
-    widths = widths.repeat(len(freqs) / len(widths))
+    widths = widths.repeat(len(freqs) // len(widths))
 
     # make len(samplerates)==len(freqs):
-    samplerates = samplerates.repeat(len(freqs) / len(samplerates))
+    samplerates = samplerates.repeat(len(freqs) // len(samplerates))
 
     # make len(sampling_windows)==len(freqs):
     sampling_windows = sampling_windows.repeat(
-        len(freqs) / len(sampling_windows))
+        len(freqs) // len(sampling_windows))
 
     # std. devs. in the time domain:
     st = widths / (2 * np.pi * freqs)
@@ -241,7 +299,7 @@ def morlet_multi(freqs, widths, samplerates,
     scales = (freqs * samples) / (2. * widths * samplerates)
 
     # generate list of unnormalized wavelets:
-    wavelets = [morlet_wavelet(samples[i], w=widths[i], s=scales[i],
+    wavelets = [morlet_wavelet(int(samples[i]), w=widths[i], s=scales[i],
                                complete=complete)
                 for i in range(len(scales))]
 
@@ -250,12 +308,70 @@ def morlet_multi(freqs, widths, samplerates,
                 for i in range(len(scales))]
 
     # normalize the wavelets by dividing each one by its energy:
-    norm_wavelets = [wavelets[i] / energies[i]
-                     for i in range(len(scales))]
+    norm_wavelets = tuple(wavelets[i] / energies[i]
+                          for i in range(len(scales)))
+    for wav in norm_wavelets:
+        wav.setflags(write=False)
 
     return norm_wavelets
 
 
+# cached wavelet FFT banks (least recently used first), limited by
+# their total size rather than their number, since a bank for long
+# continuous data can be huge (banks larger than the limit are not
+# cached at all)
+_fft_bank_cache = OrderedDict()
+_fft_bank_lock = threading.Lock()
+_fft_bank_max_bytes = 64 * 1024**2
+
+
+def _morlet_fft_bank(key, size):
+    """
+    Return the (read-only) FFTs at the given size of the wavelets for
+    a _morlet_key as a [wavelets, size] array.
+    """
+    with _fft_bank_lock:
+        wav_ffts = _fft_bank_cache.pop((key, size), None)
+        if wav_ffts is not None:
+            _fft_bank_cache[(key, size)] = wav_ffts
+            return wav_ffts
+
+    wav_ffts = _wavelet_ffts(_morlet_bank(key), size)
+    wav_ffts.setflags(write=False)
+
+    with _fft_bank_lock:
+        if wav_ffts.nbytes <= _fft_bank_max_bytes:
+            _fft_bank_cache[(key, size)] = wav_ffts
+            # evict the least recently used banks
+            total = sum([w.nbytes for w in _fft_bank_cache.values()])
+            while total > _fft_bank_max_bytes:
+                total -= _fft_bank_cache.popitem(last=False)[1].nbytes
+    return wav_ffts
+
+
+def clear_wavelet_cache():
+    """
+    Release the cached wavelet banks (and their FFTs) that
+    morlet_multi, phase_pow_multi, and calcPhasePow reuse across calls.
+    The FFTs are kept up to a total of 64MB (_fft_bank_max_bytes).
+    """
+    _morlet_bank.cache_clear()
+    with _fft_bank_lock:
+        _fft_bank_cache.clear()
+    _phase_pow_wavelet.cache_clear()
+
+
+def _wavelet_ffts(wavelets, size):
+    """
+    Return the FFTs (at the given size) of a list of wavelets as a
+    [wavelets, size] array.
+    """
+    wav_ffts = np.empty((len(wavelets), size), dtype=np.complex128)
+    for i, wav in enumerate(wavelets):
+        wav_ffts[i] = fft(wav, size)
+    return wav_ffts
+
+
 def convolve_wave(wav, eegdat):
     wave_coef = []
     for ev_dat in eegdat:
@@ -300,22 +416,16 @@ def fconv_multi(in1, in2, mode='full'):
     num2, s2 = in2.shape
 
     # see if we will be returning a complex result
-    complex_result = (np.issubdtype(in1.dtype, np.complex) or
-                      np.issubdtype(in2.dtype, np.complex))
+    complex_result = (np.issubdtype(in1.dtype, np.complexfloating) or
+                      np.issubdtype(in2.dtype, np.complexfloating))
 
     # determine the size based on the next power of 2
     actual_size = s1 + s2 - 1
     size = np.power(2, next_pow2(actual_size))
 
-    # perform the fft of each row of in1 and in2:
-    #in1_fft = np.empty((num1,size),dtype=np.complex128)
-    in1_fft = np.empty((num1, size), dtype=np.complex)
-    for i in range(num1):
-        in1_fft[i] = fft(in1[i], size)
-    #in2_fft = np.empty((num2,size),dtype=np.complex128)
-    in2_fft = np.empty((num2, size), dtype=np.complex)
-    for i in range(num2):
-        in2_fft[i] = fft(in2[i], size)
+    # perform the fft of all rows of in1 and in2 at once:
+    in1_fft = fft(in1, size, axis=1)
+    in2_fft = fft(in2, size, axis=1)
 
     # duplicate the signals and multiply before taking the inverse
     in1_fft = in1_fft.repeat(num2, axis=0)
@@ -350,7 +460,9 @@ def fconv_multi(in1, in2, mode='full'):
 def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
                     to_return='both', time_axis=-1,
                     conv_dtype=np.complex64, freq_name='freqs',
-                    **kwargs):
+                    max_memory=None, chunk_size=None, n_jobs=1,
+                    buffer=None, output_stride=1, output_times=None,
+                    output_method='auto', **kwargs):
     """
     Calculate phase and power with wavelets across multiple events.
 
@@ -393,6 +505,35 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
     freq_name : {string},optional
         Name of frequency dimension of the returned TimeSeries object
         (only used if dat is a TimeSeries instance).
+    max_memory : {int},optional
+        Approximate upper limit (in bytes) on the memory used for the
+        convolutions on top of the outputs.  The data rows (e.g.,
+        channels x events) are then processed in chunks that fit.
+    chunk_size : {int},optional
+        Number of data rows to process at a time (overrides
+        max_memory).  By default all rows are processed at once.
+    n_jobs : {int},optional
+        Number of threads to spread the frequencies over (the FFTs
+        release the GIL).  Each thread writes its frequencies into the
+        shared outputs, which are identical to those of the serial
+        (n_jobs=1) computation.
+    buffer : {float, (float, float)},optional
+        Duration (in units of 1/samplerate, e.g., seconds) to leave out
+        of the outputs at the beginning and end (see
+        TimeSeries.remove_buffer).  The buffer is still used for the
+        convolutions.
+    output_stride : {int},optional
+        Only compute and return every output_stride-th time point
+        (after removing the buffer).  There is no anti-aliasing, so
+        this is meant for the smooth power.
+    output_times : {array_like of ints},optional
+        Indices of the time samples of dat for which to compute and
+        return the outputs (instead of buffer and output_stride).
+    output_method : {'auto','fft','direct'},optional
+        How the requested time points are computed: gathered from the
+        inverse FFT of each frequency ('fft'), or with dot products of
+        the wavelet and the data around each point ('direct'), which
+        is faster for very sparse outputs.  'auto' picks per frequency.
     **kwargs : {**kwargs},optional
         Additional key word arguments to be passed on to morlet_multi().
 
@@ -401,7 +542,9 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
     Array(s) of phase and/or power values as specified in to_return. The
     returned array(s) has/have one more dimension than dat. The added
     dimension is for the frequencies and is inserted as the first
-    dimension.
+    dimension. If time points were selected, the time dimension only
+    includes those (for a TimeSeries with the samplerate divided by
+    their spacing if they are evenly spaced).
     """
 
     dat_is_ts = False  # is dat a TimeSeries instance?
@@ -426,82 +569,189 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
                          "specify whether power, phase, or both are to be " +
                          "returned. Invalid value: %s " % to_return)
 
-    if not np.issubdtype(conv_dtype, np.complex):
+    if not np.issubdtype(conv_dtype, np.complexfloating):
         raise ValueError("conv_dtype must be a complex data type!\n" +
                          "Invalid value: " + str(conv_dtype))
 
-    # generate list of wavelets:
-    wavelets = morlet_multi(freqs, widths, samplerates, **kwargs)
+    if output_method not in ['auto', 'fft', 'direct']:
+        raise ValueError("output_method must be 'auto', 'fft', or " +
+                         "'direct'. Invalid value: " + str(output_method))
+
+    # get the (cached) list of wavelets:
+    bank_key = _morlet_key(freqs, widths, samplerates, **kwargs)
+    wavelets = _morlet_bank(bank_key)
 
     # make sure we have at least as many data samples as wavelet samples
-    if (np.max([len(i) for i in wavelets]) > dat.shape[time_axis]):
+    wav_lens = [len(i) for i in wavelets]
+    if (np.max(wav_lens) > dat.shape[time_axis]):
         raise ValueError("The number of data samples is insufficient compared " +
                          "to the number of wavelet samples. Try increasing " +
                          "data samples by using a (longer) buffer.\n data " +
                          "samples: " + str(dat.shape[time_axis]) + "\nmax wavelet " +
-                         "samples: " + str(np.max([len(i) for i in wavelets])))
+                         "samples: " + str(np.max(wav_lens)))
 
     # reshape the data to 2D with time on the 2nd dimension
     origshape = dat.shape
-    eegdat = reshape_to_2d(dat, time_axis)  # .view(np.ndarray)
-
-    # for efficiency pre-generate empty array for convolution:
-    wav_coef = np.empty((eegdat.shape[0] * len(freqs),
-                         eegdat.shape[1]), dtype=conv_dtype)
-
-    # populate this array with the convolutions:
-    i = 0
-    step = len(eegdat)
-    for wav in wavelets:
-        wc = fconv_multi(wav, eegdat, 'same')
-        wav_coef[i:i + step] = wc
-        i += step
-        # for ev_dat in eegdat:
-        #     wav_coef[i]=np.convolve(wav,ev_dat,'same')
-        #     #wav_coef[i]=scipy.signal.fftconvolve(ev_dat,wav,'same')
-        #     i+=1
+    eegdat = reshape_to_2d(np.asarray(dat), time_axis)
+    nrows, ntime = eegdat.shape
+
+    # time points to compute (None for all of them)
+    tind = None
+    if output_times is not None:
+        if buffer is not None or output_stride != 1:
+            raise ValueError("output_times can't be combined with buffer " +
+                             "or output_stride.")
+        tind = np.atleast_1d(np.asarray(output_times, dtype=int))
+        tind[tind < 0] += ntime
+        if np.any(tind < 0) or np.any(tind >= ntime):
+            raise ValueError("output_times must be sample indices in the " +
+                             "range of the time dimension.")
+    elif buffer is not None or output_stride != 1:
+        if int(output_stride) < 1:
+            raise ValueError("output_stride must be positive. Invalid " +
+                             "value: " + str(output_stride))
+        num_samp = [0, 0]
+        if buffer is not None:
+            rates = np.unique(np.atleast_1d(samplerates))
+            if len(rates) != 1:
+                raise ValueError("A buffer requires a single samplerate.")
+            buffer = np.atleast_1d(buffer)
+            if len(buffer) != 2:
+                buffer = buffer.repeat(2)
+            num_samp = np.round(rates[0] * buffer).astype(int)
+            if np.any(num_samp < 0) or num_samp.sum() >= ntime:
+                raise ValueError("Invalid buffer: " + str(buffer))
+        tind = np.arange(num_samp[0], ntime - num_samp[1], int(output_stride))
+    nout = ntime if tind is None else len(tind)
+
+    # transform the data rows at a size that fits the convolution
+    # with the longest wavelet (zero padding beyond the size needed
+    # for a shorter wavelet doesn't change its result)
+    size = 2 ** next_pow2(ntime + np.max(wav_lens) - 1)
+
+    # which frequencies to compute with direct dot products (cheaper
+    # when there are few output points per sample of the transform)
+    if tind is None or output_method == 'fft':
+        use_direct = [False] * len(wavelets)
+    elif output_method == 'direct':
+        use_direct = [True] * len(wavelets)
+    else:
+        use_direct = [nout * wav_len <= 2 * size for wav_len in wav_lens]
+    if not all(use_direct):
+        wav_ffts = _morlet_fft_bank(bank_key, size)
+    # padding for the direct dot products with the longest wavelet
+    npad = np.max(wav_lens) - 1
+
+    # number of rows to process at a time
+    n_jobs = max(1, int(n_jobs))
+    if chunk_size is None and max_memory is not None:
+        # the transformed rows and, for each job, their product with a
+        # wavelet and its inverse transform are complex128
+        chunk_size = max(1, int(max_memory) //
+                         ((1 + 2 * n_jobs) * 16 * size))
+    if chunk_size is None:
+        chunk_size = nrows
+    chunk_size = int(chunk_size)
+
+    # preallocate the outputs, with frequencies first
+    out_dtype = np.zeros(1, dtype=conv_dtype).real.dtype
+    power = phase = None
+    if to_return == 'power' or to_return == 'both':
+        power = np.empty((len(freqs), nrows, nout), dtype=out_dtype)
+    if to_return == 'phase' or to_return == 'both':
+        phase = np.empty((len(freqs), nrows, nout), dtype=out_dtype)
+
+    def _convolve(i, r0, r1, dat_fft, dat_pad):
+        # start of the 'same' part of the full convolution:
+        start = (wav_lens[i] - 1) // 2
+        if use_direct[i]:
+            # each output point is the dot product of the reversed
+            # wavelet with the (zero padded) data around it
+            wav = wavelets[i][::-1]
+            windows = sliding_windows(dat_pad, wav_lens[i])[
+                :, tind + start + npad - wav_lens[i] + 1]
+            wav_coef = np.empty((r1 - r0, nout), dtype=conv_dtype)
+            wav_coef.real = windows.dot(wav.real)
+            wav_coef.imag = windows.dot(wav.imag)
+        else:
+            # only the multiply and the inverse transform are done per
+            # frequency
+            wav_coef = ifft(dat_fft * wav_ffts[i], axis=1)
+            if tind is None:
+                wav_coef = wav_coef[:, start:start + ntime]
+            else:
+                wav_coef = wav_coef[:, start + tind]
+            wav_coef = np.asarray(wav_coef, dtype=conv_dtype)
+        if power is not None:
+            # power directly from the real and imaginary parts
+            p = power[i, r0:r1]
+            np.square(wav_coef.real, out=p)
+            p += np.square(wav_coef.imag)
+        if phase is not None:
+            # the angle doesn't depend on the magnitude, so no need to
+            # normalize (and it's 0 where that is 0)
+            np.arctan2(wav_coef.imag, wav_coef.real, out=phase[i, r0:r1])
+
+    pool = None
+    if n_jobs > 1 and len(wavelets) > 1:
+        pool = ThreadPoolExecutor(max_workers=n_jobs)
+    try:
+        for r0 in range(0, nrows, chunk_size):
+            r1 = min(r0 + chunk_size, nrows)
+            # transform (or pad) the rows of the chunk once
+            dat_fft = dat_pad = None
+            if not all(use_direct):
+                dat_fft = fft(eegdat[r0:r1], size, axis=1)
+            if any(use_direct):
+                dat_pad = np.zeros((r1 - r0, ntime + 2 * npad))
+                dat_pad[:, npad:npad + ntime] = eegdat[r0:r1]
+            if pool is None:
+                for i in range(len(wavelets)):
+                    _convolve(i, r0, r1, dat_fft, dat_pad)
+            else:
+                # list forces exceptions in the workers to be raised
+                list(pool.map(lambda i: _convolve(i, r0, r1, dat_fft,
+                                                  dat_pad),
+                              range(len(wavelets))))
+            del dat_fft, dat_pad
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
     # Determine shape for ouput arrays with added frequency dimension:
     newshape = list(origshape)
+    newshape[time_axis] = nout
     # freqs must be first for reshape_from_2d to work
     newshape.insert(0, len(freqs))
     newshape = tuple(newshape)
-    # must add to the time axis, too
-    time_axis += 1
     if dat_is_ts:
         freq_dim = Dim(freqs, freq_name)
         dims_with_freq = np.empty(len(dat.dims) + 1, dat.dims.dtype)
         dims_with_freq[0] = freq_dim
         dims_with_freq[1:] = dat.dims[:]
+        samplerate = dat.samplerate
+        if tind is not None:
+            dims_with_freq[time_axis + 1] = dat.dims[time_axis][tind]
+            steps = np.unique(np.diff(tind))
+            if len(steps) == 1 and steps[0] > 0:
+                samplerate = dat.samplerate / float(steps[0])
+    # must add to the time axis, too
+    time_axis += 1
 
-    if to_return == 'power' or to_return == 'both':
-        # calculate power (wav_coef values are complex, so taking the
-        # absolute value is necessary before taking the power):
-        power = np.abs(wav_coef)**2
+    if power is not None:
         # reshape to new shape:
-        power = reshape_from_2d(power, time_axis, newshape)
+        power = reshape_from_2d(power.reshape(-1, nout), time_axis, newshape)
         if dat_is_ts:
             power = TimeSeries(power, tdim=dat.tdim,
-                               samplerate=dat.samplerate,
+                               samplerate=samplerate,
                                dims=dims_with_freq)
 
-    if to_return == 'phase' or to_return == 'both':
-        # normalize the phase estimates to length one taking care of
-        # instances where they are zero:
-        norm_factor = np.abs(wav_coef)
-        ind = norm_factor == 0
-        norm_factor[ind] = 1.
-        wav_coef = wav_coef / norm_factor
-        # wav_coef contains complex numbers, so we need to set these
-        # to 0 when the absolute value 0.
-        wav_coef[ind] = 0
-        # calculate phase:
-        phase = np.angle(wav_coef)
+    if phase is not None:
         # reshape to new shape
-        phase = reshape_from_2d(phase, time_axis, newshape)
+        phase = reshape_from_2d(phase.reshape(-1, nout), time_axis, newshape)
         if dat_is_ts:
             phase = TimeSeries(phase, tdim=dat.tdim,
-                               samplerate=dat.samplerate,
+                               samplerate=samplerate,
                                dims=dims_with_freq)
 
     if to_return == 'power':
@@ -572,7 +822,7 @@ def phase_pow_multi_old(freqs, dat, samplerates, widths=5, to_return='both',
                          "specify whether power, phase, or both are to be " +
                          "returned. Invalid value: %s " % to_return)
 
-    if not np.issubdtype(conv_dtype, np.complex):
+    if not np.issubdtype(conv_dtype, np.complexfloating):
         raise ValueError("conv_dtype must be a complex data type!\n" +
                          "Invalid value: " + str(conv_dtype))
 
@@ -649,18 +899,30 @@ def morlet(freq, t, width):
     return y
 
 
-def phasePow1d(freq, dat, samplerate, width):
-    """ Calculate phase and power for a single freq and 1d signal.
-
+@lru_cache(maxsize=128)
+def _phase_pow_wavelet(freq, samplerate, width):
+    """
+    The (read-only) Morlet wavelet of phasePow1d and phasePow2d,
+    cached so calcPhasePow doesn't regenerate it for every call.
     """
     # set the parameters for the wavelet
-    dt = 1. / float(samplerate)
-    sf = float(freq) / float(width)
+    dt = 1. / samplerate
+    sf = freq / width
     st = 1. / (2 * np.pi * sf)
 
     # get the morlet wavelet for the proper time range
     t = np.arange(-3.5 * st, 3.5 * st, dt)
     m = morlet(freq, t, width)
+    m.setflags(write=False)
+    return m
+
+
+def phasePow1d(freq, dat, samplerate, width):
+    """ Calculate phase and power for a single freq and 1d signal.
+
+    """
+    # get the (cached) morlet wavelet
+    m = _phase_pow_wavelet(float(freq), float(samplerate), float(width))
 
     # make sure we are not trying to get a too low a freq
     # for now it is up to them
@@ -671,7 +933,7 @@ def phasePow1d(freq, dat, samplerate, width):
     y = np.convolve(m, dat, 'full')
 
     # cut off the extra
-    y = y[np.ceil(len(m) / 2.) - 1:len(y) - np.floor(len(m) / 2.)];
+    y = y[(len(m) + 1) // 2 - 1:len(y) - len(m) // 2]
 
     # get the power
     power = np.power(np.abs(y), 2)
@@ -696,14 +958,8 @@ def phasePow2d(freq, dat, samplerate, width):
 
     This will be slightly faster than phasePow1d for multiple events
     because it only calculates the Morlet wavelet once.  """
-    # set the parameters for the wavelet
-    dt = 1. / float(samplerate)
-    sf = float(freq) / float(width)
-    st = 1. / (2 * np.pi * sf)
-
-    # get the morlet wavelet for the proper time range
-    t = np.arange(-3.5 * st, 3.5 * st, dt)
-    m = morlet(freq, t, width)
+    # get the (cached) morlet wavelet
+    m = _phase_pow_wavelet(float(freq), float(samplerate), float(width))
 
     # make sure is array
     dat = np.asarray(dat)
@@ -717,7 +973,7 @@ def phasePow2d(freq, dat, samplerate, width):
         y = np.convolve(m, evDat, 'full')
 
         # cut off the extra
-        y = y[np.ceil(len(m) / 2.) - 1:len(y) - np.floor(len(m) / 2.)];
+        y = y[(len(m) + 1) // 2 - 1:len(y) - len(m) // 2]
 
         # insert the data
         wCoef[ev] = y
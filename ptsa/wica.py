@@ -10,13 +10,16 @@
 import numpy as np
 import pywt
 import sys
+from scipy.signal import lfilter
 
 from ptsa.pca import pca
 from ptsa.iwasobi import iwasobi
 from ptsa.wavelet import iswt, swt
+from ptsa.data.basewrapper import BaseWrapper
 
 try:
     import multiprocessing as mp
+    from multiprocessing import shared_memory
     has_mp = True
 except ImportError:
     has_mp = False
@@ -25,25 +28,37 @@ except ImportError:
 def find_blinks(dat, L, fast_rate=.5, slow_rate=.975, thresh=None):
     """
     Identify eyeblinks with fast and slow running averages.
+
+    Parameters
+    ----------
+    dat : {array_like}
+        The (EOG) data with time on the last axis.  A 2-D array is
+        processed as a batch of channels.
+    L : {int}
+        Number of samples to extend each artifact by.
+    fast_rate : {float},optional
+        Decay of the fast running average.
+    slow_rate : {float},optional
+        Decay of the slow running average.
+    thresh : {float, array_like},optional
+        Threshold for the fast running average (one per channel for a
+        batch).  Defaults to the std of its absolute value.
+
+    Returns
+    -------
+    id_artef : {array}
+        Indices of the artifact samples.
+    id_noise : {array}
+        Indices of the remaining samples.
+    For a batch, both are lists with the indices for each channel.
     """
     # make the range to go around an eyeblink
     #L = np.int32(np.round(samplerate*0.1))*2
 
-    # process the data
-    # if thresh is None:
-    #    zd = (dat-np.mean(dat))/np.std(dat)
-    # else:
-    #    zd = dat
-    zdf = dat
-    zdb = dat[::-1]
-
-    # initialize the fast and slow running averages
-    fastf = np.zeros(len(dat) + 1)
-    slowf = np.zeros(len(dat) + 1)
-    slowf[0] = np.mean(zdf[:10])
-    fastb = np.zeros(len(dat) + 1)
-    slowb = np.zeros(len(dat) + 1)
-    slowb[0] = np.mean(zdb[:10])
+    dat = np.asarray(dat)
+    batch = dat.ndim == 2
+    dat = np.atleast_2d(dat)
+    N = dat.shape[-1]
 
     # params for running averages
     a = fast_rate
@@ -51,48 +66,52 @@ def find_blinks(dat, L, fast_rate=.5, slow_rate=.975, thresh=None):
     c = slow_rate
     d = 1 - c
 
-    # first forward
-    # calc running average
-    for i in range(len(zdf)):
-        fastf[i + 1] = a * fastf[i] + b * (zdf[i] - slowf[i])
-        slowf[i + 1] = c * slowf[i] + d * (zdf[i])
-
-    # remove the first value
-    fastf = fastf[1:]
-    slowf = slowf[1:]
-
-    # then backward
-    # calc running average
-    for i in range(len(zdb)):
-        fastb[i + 1] = a * fastb[i] + b * (zdb[i] - slowb[i])
-        slowb[i + 1] = c * slowb[i] + d * (zdb[i])
-
-    # remove the first value
-    fastb = fastb[1:]
-    slowb = slowb[1:]
+    def _running_averages(zd):
+        # the slow average is a first-order IIR filter starting from
+        # the mean of the first samples:
+        # slow[i+1] = c*slow[i] + d*zd[i]
+        slow0 = np.mean(zd[:, :10], axis=-1)[:, np.newaxis]
+        slow = lfilter([d], [1, -c], zd, axis=-1, zi=c * slow0)[0]
+        # the fast one filters the data minus the previous slow value:
+        # fast[i+1] = a*fast[i] + b*(zd[i] - slow[i])
+        slow_prev = np.concatenate([slow0, slow[:, :-1]], axis=-1)
+        return lfilter([b], [1, -a], zd - slow_prev, axis=-1)
+
+    # first forward, then backward (not flipped back, so the samples
+    # are combined like in the original matlab code)
+    fastf = _running_averages(dat)
+    fastb = _running_averages(dat[:, ::-1])
 
     # combine
     fast = (fastf * fastb) / 2.
 
     # determine the thresh
     if thresh is None:
-        thresh = np.std(np.abs(fast))
+        thresh = np.std(np.abs(fast), axis=-1)
+    thresh = np.broadcast_to(np.asarray(thresh, dtype=float),
+                             (len(dat),))[:, np.newaxis]
 
     # determine the artifact indices
 
     # first apply a thresh
-    idx = np.nonzero(np.abs(fast) > thresh)[0]
-    inds = np.arange(len(dat), dtype=np.int32)
-
-    # make sure to connect contiguous artifacts
-    idx_ext = np.zeros(len(idx) * (2 * L + 1), dtype=np.int32)
-    for k in range(len(idx)):
-        idx_ext[(2 * L + 1) * (k):(2 * L + 1) * (k + 1) -
-                1] = np.arange(idx[k] - L, idx[k] + L)
-    id_noise = np.setdiff1d(inds, idx_ext)
-    id_artef = np.setdiff1d(inds, id_noise)
-
-    return id_artef, id_noise
+    mask = np.abs(fast) > thresh
+
+    # make sure to connect contiguous artifacts: sample t is an
+    # artifact if there is a suprathreshold sample in (t-L, t+L],
+    # which is counted with a cumulative sum
+    counts = np.zeros((len(dat), N + 1), dtype=np.int64)
+    np.cumsum(mask, axis=-1, out=counts[:, 1:])
+    inds = np.arange(N)
+    artef = (counts[:, np.minimum(inds + L + 1, N)] -
+             counts[:, np.maximum(inds - L + 1, 0)]) > 0
+    # the extended indices always included the first sample
+    artef[:, 0] |= mask.any(axis=-1)
+
+    id_artef = [np.flatnonzero(art).astype(np.int32) for art in artef]
+    id_noise = [np.flatnonzero(~art).astype(np.int32) for art in artef]
+    if batch:
+        return id_artef, id_noise
+    return id_artef[0], id_noise[0]
 
 
 def _clean_find_thresh(Y, Kthr, wavelet, L):
@@ -219,7 +238,7 @@ def _clean_use_thresh(Y, thld, wavelet):
     return xn
 
 
-def _clean_comp(comp, Kthr, L, thld=None):
+def _clean_comp(comp, Kthr, L, thld=None, thresh_only=False):
     wavelet = pywt.Wavelet('db3')
     N = np.int32(2**np.floor(np.log2(len(comp))))
 
@@ -229,7 +248,7 @@ def _clean_comp(comp, Kthr, L, thld=None):
     if thld is None:
         # opt(c) = thld;
         xn, thld = _clean_find_thresh(Y, Kthr, wavelet, L)
-        if thld == 0.0:
+        if thld == 0.0 or thresh_only:
             return comp, thld
     else:
         # just apply the thresh
@@ -252,8 +271,28 @@ def _clean_comp(comp, Kthr, L, thld=None):
     return comp, thld
 
 
+# the shared memory block (kept open for the lifetime of the worker)
+# and the component rows in it shared with the worker processes
+_shared_shm = None
+_shared_comps = None
+
+
+def _init_shared_worker(shm_name, shape, dtype):
+    global _shared_shm, _shared_comps
+    _shared_shm = shared_memory.SharedMemory(name=shm_name)
+    _shared_comps = np.ndarray(shape, dtype=dtype, buffer=_shared_shm.buf)
+
+
+def _clean_shared_comp(args):
+    # clean a row of the shared components in place and only send the
+    # threshold back
+    i, Kthr, L, thld, thresh_only = args
+    return _clean_comp(_shared_comps[i], Kthr, L, thld=thld,
+                       thresh_only=thresh_only)[1]
+
+
 def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
-                            Cthr=None, num_mp_procs=0):
+                            Cthr=None, num_mp_procs=0, thresh_only=False):
     """
     % This function denoise high amplitude artifacts (e.g. ocular) and remove them from the
     % Independent Components (ICs).
@@ -286,6 +325,13 @@ def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
     %       the function will skip this component (no action), dispaly a
     %       warning and the corresponding output "opt" will be set to zero.
 
+    With num_mp_procs != 0, the rows of the components to clean are
+    placed in shared memory and the worker processes clean them in
+    place, so only the thresholds are passed back and forth.  With
+    thresh_only, the thresholds are determined without cleaning
+    icaEEG (e.g., on a pure range, to reuse them as Cthr for the
+    whole recording).
+
     """
     # make sure not to modify data
     #icaEEG = data.copy()
@@ -320,8 +366,34 @@ def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
         find_thresh = False
 
     if has_mp and num_mp_procs != 0:
-        po = mp.Pool(num_mp_procs)
-        mp_res = []
+        # copy the rows to clean to shared memory (num_mp_procs < 0
+        # uses all cores)
+        comps = np.asarray(icaEEG[np.asarray(Comp, dtype=int)])
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(comps.nbytes, 1))
+        try:
+            shared = np.ndarray(comps.shape, dtype=comps.dtype,
+                                buffer=shm.buf)
+            shared[:] = comps
+            del comps
+            po = mp.Pool(num_mp_procs if num_mp_procs > 0 else None,
+                         initializer=_init_shared_worker,
+                         initargs=(shm.name, shared.shape, shared.dtype))
+            try:
+                thlds = po.map(_clean_shared_comp,
+                               [(c, Kthr, L, None if find_thresh else opt[c],
+                                 thresh_only)
+                                for c in range(len(Comp))], chunksize=1)
+            finally:
+                po.close()
+                po.join()
+            if not thresh_only:
+                for c in range(len(Comp)):
+                    icaEEG[Comp[c]] = shared[c]
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
 
     # for c=1:length(Comp),
     for c in range(len(Comp)):
@@ -329,44 +401,25 @@ def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
             thld = None
         else:
             thld = opt[c]
+        sys.stdout.write("Component #%d: " % (Comp[c]))
+        sys.stdout.flush()
         if has_mp and num_mp_procs != 0:
-            # call with mp
-            mp_res.append(po.apply_async(_clean_comp,
-                                         (icaEEG[Comp[c]], Kthr,
-                                          L, thld)))
+            # already cleaned in parallel
+            thld = thlds[c]
         else:
-            sys.stdout.write("Component #%d: " % (Comp[c]))
+            comp, thld = _clean_comp(icaEEG[Comp[c]], Kthr, L, thld=thld,
+                                     thresh_only=thresh_only)
+            if not thresh_only:
+                icaEEG[Comp[c]] = comp
+        if find_thresh:
+            opt[c] = thld
+        if opt[c] > 0.0:
+            # disp(['The component #' num2str(Comp(c)) ' has been filtered']);
+            sys.stdout.write("was filtered at %f\n" % (opt[c]))
             sys.stdout.flush()
-            comp, thld = _clean_comp(icaEEG[Comp[c]], Kthr, L, thld=thld)
-            icaEEG[Comp[c]] = comp
-            if find_thresh:
-                opt[c] = thld
-            if opt[c] > 0.0:
-                # disp(['The component #' num2str(Comp(c)) ' has been filtered']);
-                sys.stdout.write("was filtered at %f\n" % (opt[c]))
-                sys.stdout.flush()
-            else:
-                sys.stdout.write("passed unchanged\n")
-                sys.stdout.flush()
-
-    if has_mp and num_mp_procs != 0:
-        # collect results
-        po.close()
-        po.join()
-        for c in range(len(Comp)):
-            sys.stdout.write("Component #%d: " % (Comp[c]))
+        else:
+            sys.stdout.write("passed unchanged\n")
             sys.stdout.flush()
-            comp, thld = mp_res[c].get()
-            icaEEG[Comp[c]] = comp
-            if find_thresh:
-                opt[c] = thld
-            if opt[c] > 0.0:
-                # disp(['The component #' num2str(Comp(c)) ' has been filtered']);
-                sys.stdout.write("was filtered at %f\n" % (opt[c]))
-                sys.stdout.flush()
-            else:
-                sys.stdout.write("passed unchanged\n")
-                sys.stdout.flush()
 
     # end
     return opt
@@ -400,21 +453,45 @@ class WICA(object):
     and make sure you provide enough samples for a good ICA
     decomposition.  A good rule of thumb is 3*(N^2) where N is the
     number of channels/sources.
+
+    For long recordings, use stream=True.  Then only the pure range is
+    loaded to learn the unmixing and the thresholds (in clean), and
+    get_corrected projects, cleans, and back-projects the data block
+    by block, writing them to an output array, HDF5 dataset, or
+    wrapper.  The data can then also be a wrapper (or anything that
+    can be sliced like a [channels, samples] array, e.g., a
+    LazyTimeSeries, np.memmap, or h5py dataset).
+
+    The PCA before the ICA can keep only the leading ncomps
+    components and use a randomized or an incremental (block-wise)
+    engine, selected with pca_method (see pca.pca, which also takes
+    the options in pca_opts).  With pca_method='incremental', the pure
+    range is read in blocks instead of being loaded at once.
     """
     ICA_weights = property(lambda self: self._ICA_weights)
 
-    def __init__(self, data, samplerate, pure_range=None):
+    def __init__(self, data, samplerate, pure_range=None, stream=False,
+                 pca_method='full', ncomps=None, pca_opts=None):
         """
         """
         # process the pure range
         if pure_range is None:
             pure_range = (None, None)
         self._pure_range = pure_range
+        self._stream = stream
+        if isinstance(data, BaseWrapper):
+            data = data.get_all_data(lazy=True)
+        pure_data = data[:, pure_range[0]:pure_range[1]]
+        if pca_method != 'incremental':
+            pure_data = np.asarray(pure_data)
+        if pca_opts is None:
+            pca_opts = {}
 
         # run pca
         sys.stdout.write("Running PCA...")
         # , ncomps, eigratio)
-        Wpca, pca_data = pca(data[:, pure_range[0]:pure_range[1]])
+        Wpca, pca_data = pca(pure_data, ncomps=ncomps, method=pca_method,
+                             **pca_opts)
 
         # Run iwasobi
         sys.stdout.write("Running IWASOBI ICA...")
@@ -437,15 +514,21 @@ class WICA(object):
         sys.stdout.write("DONE!\n")
         sys.stdout.flush()
 
-        # expand signals to span the entire dataset if necessary
-        if (not pure_range[0] is None) or (not pure_range[1] is None):
+        # expand signals to span the entire dataset if necessary (when
+        # streaming, the iwasobi signals, i.e., W times the pca output,
+        # cover the pure range and the rest is done in blocks)
+        if not stream and ((not pure_range[0] is None) or
+                           (not pure_range[1] is None)):
             # Xmean=data[:,pure_range[0]:pure_range[1]].mean(1)
             #signals = np.add(np.dot(W,data).T,np.dot(W,Xmean)).T
             signals = np.dot(W, data)
 
+        self._unmixing = W
         self._components = signals
         self._samplerate = samplerate
         self._data = data
+        self._comp_inds = np.array([], dtype=int)
+        self._Cthr = np.array([])
 
     def pick(self, EOG_elecs=[0, 1], std_fact=1.5):
         # pick which signals to clean (ones that weigh on EOG elecs)
@@ -485,18 +568,31 @@ class WICA(object):
     def clean(self, comp_inds=None, Kthr=2.5, num_mp_procs=0):
         if comp_inds is None:
             comp_inds = self.pick()
-        if not isinstance(comp_inds, list):
-            comp_inds = [comp_inds]
+        comp_inds = np.atleast_1d(comp_inds)
+
+        if self._stream:
+            # only determine the thresholds on the pure range and apply
+            # them in get_corrected
+            self._Cthr = remove_strong_artifacts(None, self.ICA_weights,
+                                                 self._components,
+                                                 comp_inds, Kthr,
+                                                 self._samplerate,
+                                                 num_mp_procs=num_mp_procs,
+                                                 thresh_only=True)
+            self._comp_inds = comp_inds
+            return
 
         # remove strong artifacts
         if (not self._pure_range[0] is None) or (not self._pure_range[1] is None):
-            # figure out the thresh for the range
+            # figure out the thresh for the range (only cleaning once
+            # with it below)
             Cthr = remove_strong_artifacts(self._data[:, self._pure_range[0]:self._pure_range[1]], self.ICA_weights,
                                            self._components[:, self._pure_range[0]
                                                :self._pure_range[1]],
                                            comp_inds, Kthr,
                                            self._samplerate,
-                                           num_mp_procs=num_mp_procs)
+                                           num_mp_procs=num_mp_procs,
+                                           thresh_only=True)
         else:
             Cthr = None
         Cthr = remove_strong_artifacts(self._data, self.ICA_weights, self._components,
@@ -505,13 +601,71 @@ class WICA(object):
                                        num_mp_procs=num_mp_procs)
         pass
 
-    def get_corrected(self):
-        # return cleaned data back in EEG space
-        return np.dot(self.ICA_weights, self._components)
+    def get_corrected(self, out=None, block_samples=2**16, overlap=2**12):
+        """
+        Return the cleaned data back in EEG space.
+
+        Parameters
+        ----------
+        out : {array_like},optional
+            Where to write the [channels, samples] cleaned data, e.g.,
+            a np.memmap or h5py dataset, or a wrapper with append_data
+            (e.g., an HDF5Wrapper with an existing resizable dataset)
+            to append the blocks to.  By default a new array is
+            returned.
+        block_samples : {int},optional
+            Number of samples to clean at a time (with stream=True).
+        overlap : {int},optional
+            Number of extra samples read on either side of each block
+            (and discarded after cleaning) to avoid the edge effects of
+            the wavelet transforms (with stream=True).
+
+        Returns
+        -------
+        out : {array_like}
+            The cleaned data (or out if provided).
+        """
+        if not self._stream:
+            # return cleaned data back in EEG space
+            corrected = np.dot(self.ICA_weights, self._components)
+            if out is None:
+                return corrected
+            if hasattr(out, 'append_data'):
+                out.append_data(corrected)
+            else:
+                out[:, :] = corrected
+            return out
+
+        nchannels, nsamples = self._data.shape
+        block_samples = int(block_samples)
+        overlap = int(overlap)
+        if out is None:
+            out = np.empty((nchannels, nsamples))
+        for start in range(0, nsamples, block_samples):
+            stop = min(start + block_samples, nsamples)
+            # read with the overlap
+            bstart = max(start - overlap, 0)
+            bstop = min(stop + overlap, nsamples)
+            comps = np.dot(self._unmixing,
+                           np.asarray(self._data[:, bstart:bstop]))
+            # clean the components with the thresholds from the pure
+            # range
+            for c, thld in zip(self._comp_inds, self._Cthr):
+                if thld > 0.0:
+                    comps[c] = _clean_comp(comps[c], None, None,
+                                           thld=thld)[0]
+            corrected = np.dot(self.ICA_weights,
+                               comps[:, start - bstart:stop - bstart])
+            if hasattr(out, 'append_data'):
+                out.append_data(corrected)
+            else:
+                out[:, start:stop] = corrected
+        return out
 
 
 def wica_clean(data, samplerate=None, pure_range=(None, None),
-               EOG_elecs=[0, 1], std_fact=1.5, Kthr=2.5, num_mp_procs=0):
+               EOG_elecs=[0, 1], std_fact=1.5, Kthr=2.5, num_mp_procs=0,
+               pca_method='full', ncomps=None, pca_opts=None):
     """
     Clean data with the Wavelet-ICA method described here:
 
@@ -538,11 +692,18 @@ def wica_clean(data, samplerate=None, pure_range=(None, None),
     and make sure you provide enough samples for a good ICA
     decomposition.  A good rule of thumb is 3*(N^2) where N is the
     number of channels/sources.
+
+    The PCA engine and the number of components to keep are selected
+    with pca_method and ncomps (see WICA).
     """
+    if pca_opts is None:
+        pca_opts = {}
+
     # run pca
     sys.stdout.write("Running PCA...")
     # , ncomps, eigratio)
-    Wpca, pca_data = pca(data[:, pure_range[0]:pure_range[1]])
+    Wpca, pca_data = pca(data[:, pure_range[0]:pure_range[1]], ncomps=ncomps,
+                         method=pca_method, **pca_opts)
 
     # Run iwasobi
     sys.stdout.write("Running IWASOBI ICA...")
@@ -594,14 +755,17 @@ def wica_clean(data, samplerate=None, pure_range=(None, None),
 
     # remove strong artifacts
     if (not pure_range[0] is None) or (not pure_range[1] is None):
-        # figure out the thresh for the range
-        Cthr = remove_strong_artifacts(signals[:, pure_range[0]:pure_range[1]],
+        # figure out the thresh for the range (only cleaning once
+        # with it below)
+        Cthr = remove_strong_artifacts(data[:, pure_range[0]:pure_range[1]], A,
+                                       signals[:, pure_range[0]:pure_range[1]],
                                        comp_ind, Kthr,
                                        samplerate,
-                                       num_mp_procs=num_mp_procs)
+                                       num_mp_procs=num_mp_procs,
+                                       thresh_only=True)
     else:
         Cthr = None
-    Cthr = remove_strong_artifacts(signals, comp_ind, Kthr,
+    Cthr = remove_strong_artifacts(data, A, signals, comp_ind, Kthr,
                                    samplerate, Cthr,
                                    num_mp_procs=num_mp_procs)
 